@@ -31,15 +31,130 @@ def main(debug):
 
 --
 
+Non-blocking mode (the records are written by a background thread):
+--
+from MyLogger import configure_logging, sample_key
+
+configure_logging(async_mode=True, json_format=False, sample=10)
+
+# hot path: 1 of 10 records per key is written
+_log.debug('msg=%s', msg, extra=sample_key(msg['type']))
+--
+
+Pass the values as arguments ('%s'), not formatted strings:
+they are formatted only when the record is written
+(in async mode: by the writer thread, so don't log objects
+that are modified afterwards).
 """
 __author__ = 'Yoichi Tanibayashi'
 __date__   = '2020/03/31'
 
-from logging import getLogger, StreamHandler, Formatter
+from logging import getLogger, StreamHandler, Formatter, Filter
 from logging import NOTSET, DEBUG, INFO, WARNING, ERROR, CRITICAL
+from logging.handlers import QueueHandler, QueueListener
+import atexit
+import itertools
+import json
+import queue
+
+SAMPLE_KEY = 'sample_key'
+
+
+def sample_key(key):
+    """
+    Returns
+    -------
+    extra: dict
+        for logger.debug(.., extra=sample_key(key))
+    """
+    return {SAMPLE_KEY: key}
+
+
+class SampleFilter(Filter):
+    """
+    pass 1 of every `n` records per sample key.
+
+    Records without a sample key, and WARNING or above, always pass.
+    """
+    def __init__(self, n):
+        super().__init__()
+        self.n = n
+        # key -> counter
+        self._count = {}
+
+    def filter(self, record):
+        key = getattr(record, SAMPLE_KEY, None)
+        if key is None or self.n <= 1 or record.levelno >= WARNING:
+            return True
+
+        c = self._count.get(key)
+        if c is None:
+            c = self._count.setdefault(key, itertools.count())
+        if next(c) % self.n != 0:
+            return False
+        record.sample = self.n
+        return True
+
+
+class JsonFormatter(Formatter):
+    """
+    one JSON object per line
+    """
+    def format(self, record):
+        obj = {
+            'time': round(record.created, 6),
+            'level': record.levelname,
+            'file': record.filename,
+            'name': record.name,
+            'func': record.funcName,
+            'line': record.lineno,
+            'msg': record.getMessage(),
+        }
+        for k in [SAMPLE_KEY, 'sample']:
+            if hasattr(record, k):
+                obj[k] = getattr(record, k)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            obj['exc'] = record.exc_text
+        return json.dumps(obj, ensure_ascii=False, default=str)
+
+
+class AsyncHandler(QueueHandler):
+    """
+    enqueue the records as they are (not formatted),
+    and drop them when the queue is full (not to block the caller)
+    """
+    def __init__(self, q):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record):
+        if record.exc_info:
+            # the traceback can't wait
+            record.exc_text = Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class AsyncListener(QueueListener):
+    """
+    writer thread of AsyncHandler
+    """
+    def enqueue_sentinel(self):
+        # wait for a room: the queue may be full
+        self.queue.put(self._sentinel)
 
 
 class MyLogger:
+    DEF_QUEUE_SIZE = 10000
+
     def __init__(self, name=''):
         fmt_hdr = '%(asctime)s %(levelname)s '
         fmt_loc = '%(filename)s.%(name)s.%(funcName)s:%(lineno)d> '
@@ -55,6 +170,64 @@ class MyLogger:
         self.logger.addHandler(self.console_handler)
         self.logger.propagate = False
 
+        self.handler = self.console_handler
+        self.listener = None
+
+    def configure(self, async_mode=False, json_format=False, sample=0,
+                  queue_size=DEF_QUEUE_SIZE):
+        """
+        Parameters
+        ----------
+        async_mode: bool
+            write the records in a background thread
+        json_format: bool
+            structured output (JSON lines)
+        sample: int
+            write 1 of `sample` records per sample key (0, 1: all)
+        queue_size: int
+            records waiting to be written (async_mode),
+            the others are dropped
+        """
+        self.stop()
+        self.logger.removeHandler(self.handler)
+
+        if json_format:
+            self.console_handler.setFormatter(JsonFormatter())
+        else:
+            self.console_handler.setFormatter(self.handler_fmt)
+
+        self.handler = self.console_handler
+        if async_mode:
+            self.handler = AsyncHandler(queue.Queue(queue_size))
+            self.listener = AsyncListener(self.handler.queue,
+                                          self.console_handler,
+                                          respect_handler_level=True)
+            self.listener.start()
+
+        for f in list(self.handler.filters):
+            self.handler.removeFilter(f)
+        if sample > 1:
+            # before enqueueing: the dropped ones cost nothing more
+            self.handler.addFilter(SampleFilter(sample))
+
+        self.logger.addHandler(self.handler)
+
+    def stop(self):
+        """
+        write the queued records and stop the writer thread
+        """
+        if self.listener is None:
+            return
+        self.listener.stop()
+        self.listener = None
+
+        dropped = self.handler.dropped
+        if dropped > 0:
+            self.console_handler.handle(self.logger.makeRecord(
+                self.logger.name, WARNING, __file__, 0,
+                '%d log records dropped (queue full)', (dropped,), None,
+                func='stop'))
+
     def get_logger(self, name, debug):
         logger = self.logger.getChild(name)
         if debug in (NOTSET, DEBUG, INFO, WARNING, ERROR, CRITICAL):
@@ -73,3 +246,11 @@ myLogger = MyLogger()
 
 def get_logger(name, debug):
     return myLogger.get_logger(name, debug)
+
+
+def configure_logging(async_mode=False, json_format=False, sample=0,
+                      queue_size=MyLogger.DEF_QUEUE_SIZE):
+    myLogger.configure(async_mode, json_format, sample, queue_size)
+
+
+atexit.register(myLogger.stop)
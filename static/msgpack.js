@@ -0,0 +1,299 @@
+/**
+ *=====================================================
+ * MessagePack codec for the "msgpack" transport
+ *
+ *   MessagePack.encode(obj) => Uint8Array
+ *   MessagePack.decode(Uint8Array) => obj
+ *
+ * Same interface as @msgpack/msgpack, for the types of
+ * the messages (nil, bool, int, float, str, bin, array, map).
+ * Served by the server itself (asset_url()), not by a CDN.
+ *=====================================================
+ */
+const MessagePack = (() => {
+    const utf8_enc = new TextEncoder();
+    const utf8_dec = new TextDecoder();
+
+    /**
+     * growing output buffer
+     */
+    class Writer {
+        constructor() {
+            this.buf = new Uint8Array(256);
+            this.view = new DataView(this.buf.buffer);
+            this.pos = 0;
+        }
+
+        /**
+         * @param {number} n - bytes to be written
+         */
+        reserve(n) {
+            if ( this.pos + n <= this.buf.length ) {
+                return;
+            }
+            let size = this.buf.length * 2;
+            while ( size < this.pos + n ) {
+                size *= 2;
+            }
+            const buf = new Uint8Array(size);
+            buf.set(this.buf);
+            this.buf = buf;
+            this.view = new DataView(this.buf.buffer);
+        }
+
+        u8(v) {
+            this.reserve(1);
+            this.view.setUint8(this.pos, v);
+            this.pos += 1;
+        }
+
+        u16(v) {
+            this.reserve(2);
+            this.view.setUint16(this.pos, v);
+            this.pos += 2;
+        }
+
+        u32(v) {
+            this.reserve(4);
+            this.view.setUint32(this.pos, v);
+            this.pos += 4;
+        }
+
+        bytes(b) {
+            this.reserve(b.length);
+            this.buf.set(b, this.pos);
+            this.pos += b.length;
+        }
+
+        /**
+         * @param {number} head - first byte
+         * @param {function} setter - DataView method name
+         * @param {number} size
+         * @param {number|BigInt} v
+         */
+        typed(head, setter, size, v) {
+            this.u8(head);
+            this.reserve(size);
+            this.view[setter](this.pos, v);
+            this.pos += size;
+        }
+
+        result() {
+            return this.buf.slice(0, this.pos);
+        }
+    } // class Writer
+
+    /**
+     * @param {Writer} w
+     * @param {number} n - length
+     * @param {number[]} heads - [fix, 8bit, 16bit, 32bit] (fix: mask)
+     * @param {number} fix_max
+     */
+    const write_len = (w, n, heads, fix_max) => {
+        if ( n <= fix_max && heads[0] !== undefined ) {
+            w.u8(heads[0] | n);
+        } else if ( n < 0x100 && heads[1] !== undefined ) {
+            w.u8(heads[1]);
+            w.u8(n);
+        } else if ( n < 0x10000 ) {
+            w.u8(heads[2]);
+            w.u16(n);
+        } else {
+            w.u8(heads[3]);
+            w.u32(n);
+        }
+    };
+
+    const write_int = (w, v) => {
+        if ( v >= 0 ) {
+            if ( v < 0x80 ) {
+                w.u8(v);
+            } else if ( v < 0x100 ) {
+                w.typed(0xcc, "setUint8", 1, v);
+            } else if ( v < 0x10000 ) {
+                w.typed(0xcd, "setUint16", 2, v);
+            } else if ( v < 0x100000000 ) {
+                w.typed(0xce, "setUint32", 4, v);
+            } else {
+                w.typed(0xcf, "setBigUint64", 8, BigInt(v));
+            }
+            return;
+        }
+        if ( v >= -0x20 ) {
+            w.u8(v & 0xff);
+        } else if ( v >= -0x80 ) {
+            w.typed(0xd0, "setInt8", 1, v);
+        } else if ( v >= -0x8000 ) {
+            w.typed(0xd1, "setInt16", 2, v);
+        } else if ( v >= -0x80000000 ) {
+            w.typed(0xd2, "setInt32", 4, v);
+        } else {
+            w.typed(0xd3, "setBigInt64", 8, BigInt(v));
+        }
+    };
+
+    const write = (w, obj) => {
+        if ( obj === null || obj === undefined ) {
+            w.u8(0xc0);
+        } else if ( obj === false ) {
+            w.u8(0xc2);
+        } else if ( obj === true ) {
+            w.u8(0xc3);
+        } else if ( typeof obj == "number" ) {
+            if ( Number.isSafeInteger(obj) ) {
+                write_int(w, obj);
+            } else {
+                w.typed(0xcb, "setFloat64", 8, obj);
+            }
+        } else if ( typeof obj == "string" ) {
+            const b = utf8_enc.encode(obj);
+            write_len(w, b.length, [0xa0, 0xd9, 0xda, 0xdb], 31);
+            w.bytes(b);
+        } else if ( obj instanceof Uint8Array ) {
+            write_len(w, obj.length, [undefined, 0xc4, 0xc5, 0xc6], -1);
+            w.bytes(obj);
+        } else if ( obj instanceof ArrayBuffer ) {
+            write(w, new Uint8Array(obj));
+        } else if ( Array.isArray(obj) ) {
+            write_len(w, obj.length, [0x90, undefined, 0xdc, 0xdd], 15);
+            for ( const v of obj ) {
+                write(w, v);
+            }
+        } else if ( typeof obj == "object" ) {
+            // as JSON.stringify(): undefined values are left out
+            const keys = Object.keys(obj).filter(k => obj[k] !== undefined);
+            write_len(w, keys.length, [0x80, undefined, 0xde, 0xdf], 15);
+            for ( const k of keys ) {
+                write(w, k);
+                write(w, obj[k]);
+            }
+        } else {
+            throw new TypeError(`MessagePack.encode: ${typeof obj}`);
+        }
+    };
+
+    /**
+     * @param {Object} obj
+     * @return {Uint8Array}
+     */
+    const encode = obj => {
+        const w = new Writer();
+        write(w, obj);
+        return w.result();
+    };
+
+    /**
+     * input buffer
+     */
+    class Reader {
+        /**
+         * @param {Uint8Array} buf
+         */
+        constructor(buf) {
+            this.buf = buf;
+            this.view = new DataView(buf.buffer, buf.byteOffset,
+                                     buf.byteLength);
+            this.pos = 0;
+        }
+
+        /**
+         * @param {string} getter - DataView method name
+         * @param {number} size
+         */
+        get(getter, size) {
+            const v = this.view[getter](this.pos);
+            this.pos += size;
+            return v;
+        }
+
+        bytes(n) {
+            const b = this.buf.subarray(this.pos, this.pos + n);
+            this.pos += n;
+            return b;
+        }
+
+        str(n) {
+            return utf8_dec.decode(this.bytes(n));
+        }
+
+        array(n) {
+            const a = [];
+            for ( let i=0; i < n; i++ ) {
+                a.push(this.read());
+            }
+            return a;
+        }
+
+        map(n) {
+            const m = {};
+            for ( let i=0; i < n; i++ ) {
+                const k = this.read();
+                m[k] = this.read();
+            }
+            return m;
+        }
+
+        read() {
+            const head = this.get("getUint8", 1);
+
+            if ( head < 0x80 ) {
+                return head;
+            }
+            if ( head < 0x90 ) {
+                return this.map(head & 0x0f);
+            }
+            if ( head < 0xa0 ) {
+                return this.array(head & 0x0f);
+            }
+            if ( head < 0xc0 ) {
+                return this.str(head & 0x1f);
+            }
+            if ( head >= 0xe0 ) {
+                return head - 0x100;
+            }
+
+            switch ( head ) {
+            case 0xc0: return null;
+            case 0xc2: return false;
+            case 0xc3: return true;
+            case 0xc4: return this.bytes(this.get("getUint8", 1));
+            case 0xc5: return this.bytes(this.get("getUint16", 2));
+            case 0xc6: return this.bytes(this.get("getUint32", 4));
+            case 0xca: return this.get("getFloat32", 4);
+            case 0xcb: return this.get("getFloat64", 8);
+            case 0xcc: return this.get("getUint8", 1);
+            case 0xcd: return this.get("getUint16", 2);
+            case 0xce: return this.get("getUint32", 4);
+            case 0xcf: return Number(this.get("getBigUint64", 8));
+            case 0xd0: return this.get("getInt8", 1);
+            case 0xd1: return this.get("getInt16", 2);
+            case 0xd2: return this.get("getInt32", 4);
+            case 0xd3: return Number(this.get("getBigInt64", 8));
+            case 0xd9: return this.str(this.get("getUint8", 1));
+            case 0xda: return this.str(this.get("getUint16", 2));
+            case 0xdb: return this.str(this.get("getUint32", 4));
+            case 0xdc: return this.array(this.get("getUint16", 2));
+            case 0xdd: return this.array(this.get("getUint32", 4));
+            case 0xde: return this.map(this.get("getUint16", 2));
+            case 0xdf: return this.map(this.get("getUint32", 4));
+            }
+            throw new TypeError(
+                `MessagePack.decode: 0x${head.toString(16)}: not supported`);
+        }
+    } // class Reader
+
+    /**
+     * @param {Uint8Array} buf
+     * @return {Object}
+     */
+    const decode = buf => {
+        const r = new Reader(buf);
+        const obj = r.read();
+        if ( r.pos != buf.byteLength ) {
+            throw new RangeError("MessagePack.decode: extra bytes");
+        }
+        return obj;
+    };
+
+    return { encode: encode, decode: decode };
+})();
@@ -69,14 +69,17 @@ const VERSION = "0.96";
 const GAMEINFO_FILE = "gameinfo.json";
 
 let ws = undefined;
+// message format: "json" or "msgpack" (?fmt=msgpack, when accepted)
+let ws_fmt = "json";
 let board = undefined;
 const nav = document.getElementById("nav-input");
 
 let GlobalSoundSwitch = undefined;
-const SOUND_ROLL = "/static/sounds/roll1.mp3";
-const SOUND_PUT = "/static/sounds/put1.mp3";
-const SOUND_HIT = "/static/sounds/hit1.mp3";
-const SOUND_TURN_CHANGE = "/static/sounds/turn_change1.mp3";
+// SOUND_DIR: index.html (content-hashed URL)
+const SOUND_ROLL = SOUND_DIR + "roll1.mp3";
+const SOUND_PUT = SOUND_DIR + "put1.mp3";
+const SOUND_HIT = SOUND_DIR + "hit1.mp3";
+const SOUND_TURN_CHANGE = SOUND_DIR + "turn_change1.mp3";
 
 /**
  * Emit message to server
@@ -87,7 +90,36 @@ const SOUND_TURN_CHANGE = "/static/sounds/turn_change1.mp3";
  */
 const emit_msg = (type, data, history=false) => {
     console.log(`emit_msg> type=${type}, data=${JSON.stringify(data)}`);
-    ws.emit("json", {src: "client", type: type, data: data, history: history});
+    const msg = {src: "client", type: type, data: data, history: history};
+    if ( ws_fmt == "msgpack" ) {
+        const buf = MessagePack.encode(msg);
+        ws.emit("msgpack", buf.buffer.slice(buf.byteOffset,
+                                            buf.byteOffset + buf.byteLength));
+        return;
+    }
+    ws.emit("json", msg);
+};
+
+/**
+ * Apply gameinfo patch from server (in place)
+ *
+ * @param {Object} gameinfo
+ * @param {Array} patch - [[path, value], ..]
+ * @return {Object} gameinfo
+ */
+const apply_gameinfo_patch = (gameinfo, patch) => {
+    for (const [path, value] of patch) {
+        if ( path.length == 0 ) {
+            gameinfo = value;
+            continue;
+        }
+        let obj = gameinfo;
+        for (const k of path.slice(0, -1)) {
+            obj = obj[k];
+        }
+        obj[path[path.length - 1]] = value;
+    }
+    return gameinfo;
 };
 
 /**
@@ -683,8 +715,8 @@ class PlayerClock extends PlayerText {
      * 
      */
     change_turn() {
+        // the server sends back its clock value
         this.emit_stop();
-        this.emit();
 
         this.board.player_clock[1-this.player].emit_start();
     } // PlayerClock.change_turn()
@@ -698,7 +730,6 @@ class PlayerClock extends PlayerText {
         } else if ( this.board.clock_sw ) {
             this.emit_resume();
         }
-        this.emit();
     } // PlayerClock.push()
 
     /**
@@ -980,7 +1011,6 @@ class BgImage extends BgBase {
     constructor(id, x, y, deg=0, w=undefined, h=undefined) {
         super(id, x, y, deg, w, h);
 
-        this.image_parent_dir = "/static";
         this.image_suffix = ".png";
 
         this.image_el = this.el.children[0];
@@ -1006,19 +1036,16 @@ class BgImage extends BgBase {
     } // BgImage.constructor()
 
     /**
-     * 
+     * directory of the image (with the last "/"),
+     * ex. "/assets/images2.<hash>/"
      */
     get_image_dir() {
-        const image_src = this.image_el.src;
+        const image_src = this.image_el.getAttribute("src");
         console.log(`image_src=${image_src}`);
-        const index1 = image_src.indexOf(this.image_parent_dir);
-        console.log(`index1=${index1}`);
-        const index2 = image_src.indexOf("/", index1+1);
-        console.log(`index2=${index2}`);
-        const index3 = image_src.indexOf("/", index2+1);
-        console.log(`index3=${index3}`);
-
-        const image_dir = image_src.slice(index1, index3+1);
+        const index = image_src.lastIndexOf("/");
+        console.log(`index=${index}`);
+
+        const image_dir = image_src.slice(0, index+1);
         console.log(`image_dir=${image_dir}`);
 
         return image_dir;
@@ -2668,6 +2695,11 @@ class Board extends BgImage {
 
         this.gameinfo = undefined;
 
+        // last gameinfo from server and its sequence number
+        this.gameinfo_base = undefined;
+        this.gameinfo_seq = undefined;
+        this.resync_pending = false;
+
         // Title
         const name_el = document.getElementById("name");
         const ver_el = document.getElementById("version");
@@ -3990,6 +4022,57 @@ const fwd_all = () => {
     console.log("fwd_all()");
     emit_msg("fwd_all", {}, false);
 };
+
+/**
+ * Jump to any history position
+ *
+ * @param {number} hist_i - 1: first, < 0: from the end (-1: last)
+ * @param {number} [sec=0.5] - animation
+ */
+const seek_hist = (hist_i, sec=0.5) => {
+    nav.checked=false;
+    console.log(`seek_hist(hist_i=${hist_i},sec=${sec})`);
+    emit_msg("seek", {hist_i: hist_i, sec: sec}, false);
+};
+
+/**
+ * Jump to the last time the current position occurred
+ */
+const seek_same = () => {
+    nav.checked=false;
+    console.log("seek_same()");
+    emit_msg("seek_same", {sec: 0.5}, false);
+};
+
+/**
+ * Request the variations of the history (answered by "branches")
+ */
+const branches = () => {
+    nav.checked=false;
+    console.log("branches()");
+    emit_msg("branches", {}, false);
+};
+
+/**
+ * Make another variation the current history
+ *
+ * @param {number} id - variation id
+ * @param {number} [sec=0.5] - animation
+ */
+const switch_branch = (id, sec=0.5) => {
+    nav.checked=false;
+    console.log(`switch_branch(id=${id},sec=${sec})`);
+    emit_msg("switch_branch", {id: id, sec: sec}, false);
+};
+
+/**
+ * Request move hints (server side evaluation)
+ */
+const hint = () => {
+    nav.checked=false;
+    console.log("hint()");
+    emit_msg("hint", {}, false);
+};
     
 /**
  *
@@ -4153,7 +4236,21 @@ window.onload = () => {
     url += "/";
     console.log(`url=${url}`);
 
-    ws = io.connect(url);
+    // join the board's room (multi-board server)
+    const svr_id = document.getElementById("server-id").innerHTML;
+    let query = `board=${encodeURIComponent(svr_id)}`;
+
+    // spectator ("/watch"): coalesced updates
+    if ( location.pathname.endsWith("/watch") ) {
+        query += "&role=spectator";
+    }
+
+    // binary messages: the server answers in msgpack if it accepts
+    const fmt = new URLSearchParams(location.search).get("fmt");
+    if ( fmt == "msgpack" && typeof MessagePack !== "undefined" ) {
+        query += "&fmt=msgpack";
+    }
+    ws = io.connect(url, {query: query});
 
     // initialize board
     board = new Board("board",
@@ -4175,16 +4272,44 @@ window.onload = () => {
      *   data: Object
      * }
      */
-    ws.on("json", function(msg) {
+    const on_json = function(msg) {
         console.log(`ws.on(json):msg=${JSON.stringify(msg)}`);
 
         if ( msg.type == "gameinfo" ) {
+            // keep a private copy as the base of following patches
+            board.gameinfo_base = JSON.parse(JSON.stringify(
+                msg.data.gameinfo));
+            board.gameinfo_seq = msg.data.seq;
+            board.resync_pending = false;
             board.load_gameinfo(msg.data.gameinfo,
                                 msg.data.sec,
                                 msg.data.history_flag);
             return;
         } // "gameinfo"
 
+        if ( msg.type == "gameinfo_patch" ) {
+            if ( board.resync_pending ) {
+                return;
+            }
+            if ( board.gameinfo_base === undefined
+                 || msg.data.base_seq != board.gameinfo_seq ) {
+                console.log(`ws.on(json)gameinfo_patch>`
+                            + `base_seq=${msg.data.base_seq},`
+                            + `seq=${board.gameinfo_seq}: resync`);
+                board.resync_pending = true;
+                emit_msg("resync", {seq: board.gameinfo_seq}, false);
+                return;
+            }
+            board.gameinfo_base = apply_gameinfo_patch(board.gameinfo_base,
+                                                       msg.data.patch);
+            board.gameinfo_seq = msg.data.seq;
+            board.load_gameinfo(JSON.parse(JSON.stringify(
+                board.gameinfo_base)),
+                                msg.data.sec,
+                                msg.data.history_flag);
+            return;
+        } // "gameinfo_patch"
+
         if ( msg.type == "put_checker" ) {
             if ( board.turn == -1 ) {
                 console.log(`ws.on(json)put_checker>`
@@ -4274,7 +4399,52 @@ window.onload = () => {
             board.player_clock[msg.data.player].reset();
             return;
         } // set_player_clock
+
+        if ( msg.type == "hint" ) {
+            // data: {sn: int, player: int,
+            //        hints: [{play: [[from, to], ..], win, equity}, ..]}
+            let txt = `player${msg.data.player}:\n`;
+            for (let h of msg.data.hints) {
+                const play = h.play.map(m => `${m[0]}/${m[1]}`).join(" ");
+                txt += `${play} (${h.equity.toFixed(3)})\n`;
+            }
+            console.log(`ws.on(json)>hint:${txt}`);
+            window.alert(txt);
+            return;
+        } // hint
+
+        if ( msg.type == "branches" ) {
+            // data: {current: int,
+            //        branches: [{id, parent, fork, n, sn, current}, ..]}
+            let txt = "";
+            for (let b of msg.data.branches) {
+                const mark = b.current ? "*" : " ";
+                const fork = b.fork === null ? "" : ` fork=${b.fork}`;
+                txt += `${mark}${b.id}:${fork} n=${b.n} sn=${b.sn}\n`;
+            }
+            console.log(`ws.on(json)>branches:${txt}`);
+            const id = window.prompt(txt, msg.data.current);
+            if ( id !== null && id !== "" &&
+                 parseInt(id) != msg.data.current ) {
+                switch_branch(parseInt(id));
+            }
+            return;
+        } // branches
+
+        if ( msg.type == "clock_timeout" ) {
+            console.log(`ws.on(json)>clock_timeout:player=${msg.data.player}`);
+            board.player_clock[msg.data.player].stop();
+            return;
+        } // clock_timeout
         
         console.log("ws.on(json)>msg.type=???");
-    }); // ws.on(json)
+    }; // on_json
+
+    ws.on("json", on_json);
+
+    ws.on("msgpack", function(data) {
+        // the server has accepted msgpack: use it also for sending
+        ws_fmt = "msgpack";
+        on_json(MessagePack.decode(new Uint8Array(data)));
+    });
 }; // window.onload
@@ -0,0 +1,67 @@
+#
+# (c) Yoichi Tanibayashi
+#
+"""
+conftest.py
+
+boards without clients: the data files are in tmp_path,
+the messages to the clients are recorded
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__   = '2020/05'
+
+from ytBackgammonServer import ytBackgammonServer
+from types import SimpleNamespace
+import pytest
+
+REQ = SimpleNamespace(sid='sid0')
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    """
+    messages sent by the boards: [(event, data, room), ..]
+    """
+    sent = []
+    monkeypatch.setattr(ytBackgammonServer, 'emit_event',
+                        lambda self, event, data, room:
+                        sent.append((event, data, room)))
+    return sent
+
+
+@pytest.fixture
+def new_board(tmp_path, monkeypatch, sent):
+    """
+    factory of ytBackgammonServer('a', ..) on tmp_path
+    (the same data files for each call: a restart)
+    """
+    monkeypatch.setattr(ytBackgammonServer, 'DATAFILE_DIR', str(tmp_path))
+
+    def new_board(**kwargs):
+        return ytBackgammonServer('test', '0', 'a', 'images1', **kwargs)
+    return new_board
+
+
+def send(svr, mtype, data, history=True):
+    svr.on_json(REQ, {'src': 'client', 'type': mtype, 'data': data,
+                      'history': history})
+
+
+def move(svr, player, ch_i, p):
+    """
+    move a checker, and add it to the history
+    """
+    send(svr, 'put_checker', {'ch': player * 100 + ch_i, 'p': p, 'idx': 0})
+
+
+def play(svr, n, seed=0):
+    """
+    n moves (and a dice roll every 4 moves) of both players
+    """
+    for i in range(n):
+        player = (i // 4) % 2
+        if i % 4 == 0:
+            send(svr, 'dice', {'player': player,
+                               'dice': [(i + seed) % 6 + 1, 3, 0, 0],
+                               'roll': True})
+        move(svr, player, (i * 7 + seed) % 15, (i * 5 + seed) % 24 + 1)
@@ -0,0 +1,94 @@
+#
+# (c) Yoichi Tanibayashi
+#
+"""
+test_clock.py
+
+server side clocks: one scheduler, the delay and the main time,
+the timeout is pushed to the clients
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__   = '2020/05'
+
+from ytBackgammonClock import ClockScheduler
+import threading
+import time
+import pytest
+
+
+def test_scheduler_order():
+    sch = ClockScheduler()
+    called = []
+    done = threading.Event()
+    t = time.monotonic()
+    sch.schedule(t + 0.2, called.append, 3)
+    sch.schedule(t + 0.05, called.append, 1)
+    timer = sch.schedule(t + 0.1, called.append, 2)
+    sch.schedule(t + 0.3, done.set)
+    sch.cancel(timer)
+
+    assert done.wait(2)
+    assert called == [1, 3]
+
+
+@pytest.fixture
+def svr(new_board):
+    svr = new_board(clock_scheduler=ClockScheduler())
+    svr._bg.set_player_clock({'player': 0, 'clock': [0.3, 0.1]})
+    svr._clock.set_switch(True)
+    return svr
+
+
+def clock_msgs(sent):
+    return [(d['type'], d['data']) for (_, d, _) in sent
+            if d['type'] in ('set_player_clock', 'clock_timeout')]
+
+
+def wait_msg(sent, mtype, sec=3):
+    t_end = time.monotonic() + sec
+    while time.monotonic() < t_end:
+        if mtype in [m[0] for m in clock_msgs(sent)]:
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_count_down(svr):
+    svr._clock.resume(0)
+    time.sleep(0.15)
+    # the delay first, then the main time
+    [c0, c1] = svr._clock.get(0)
+    assert c1 == 0
+    assert 0.1 < c0 < 0.3
+
+    svr._clock.stop(0)
+    clock = svr._clock.get(0)
+    time.sleep(0.05)
+    assert svr._clock.get(0) == clock
+    assert svr._bg.gameinfo['board']['clock'][0] == clock
+
+
+def test_timeout(svr, sent):
+    t0 = time.monotonic()
+    svr._clock.resume(0)
+    assert wait_msg(sent, 'clock_timeout')
+    assert time.monotonic() - t0 >= 0.35
+
+    msgs = clock_msgs(sent)
+    # the end of the delay, then the timeout
+    assert msgs[0] == ('set_player_clock',
+                       {'player': 0, 'clock': pytest.approx([0.3, 0],
+                                                            abs=0.05)})
+    assert msgs[-2:] == [('set_player_clock', {'player': 0, 'clock': [0, 0]}),
+                         ('clock_timeout', {'player': 0})]
+    assert svr._bg.gameinfo['board']['clock'][0] == [0, 0]
+    assert not svr._clock.active[0]
+
+
+def test_no_timeout_after_stop(svr, sent):
+    svr._clock.resume(0)
+    time.sleep(0.2)
+    svr._clock.stop(0)
+    time.sleep(0.4)
+    assert 'clock_timeout' not in [m[0] for m in clock_msgs(sent)]
+    assert svr._clock.get(0)[0] > 0
@@ -0,0 +1,82 @@
+#
+# (c) Yoichi Tanibayashi
+#
+"""
+test_clock_msg.py
+
+set_player_clock: the accepted clock is broadcast,
+the received message is left as it is (it may be in the log queue),
+and no received message is kept in gameinfo
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__   = '2020/05'
+
+from ytBackgammonServer import ytBackgammonServer
+from flask import Flask
+from flask_socketio import SocketIO
+from types import SimpleNamespace
+import copy
+import pytest
+
+
+@pytest.fixture
+def svr(tmp_path, monkeypatch):
+    monkeypatch.setattr(ytBackgammonServer, 'DATAFILE_DIR', str(tmp_path))
+
+    app = Flask(__name__)
+    socketio = SocketIO(app, async_mode='threading')
+    sent = []
+    monkeypatch.setattr(ytBackgammonServer, 'emit_json',
+                        lambda self, msg, room=None: sent.append(msg))
+
+    svr = ytBackgammonServer('test', '0', 'a', 'images1', socketio=socketio)
+    return svr, sent
+
+
+def test_set_player_clock_keeps_received_msg(svr):
+    [svr, sent] = svr
+    request = SimpleNamespace(sid='sid0')
+
+    # counting: the value from the client is ignored
+    svr._clock.set_switch(True)
+    svr._clock.start(0)
+    clock = svr._clock.get(0)
+
+    msg = {'src': 'client', 'type': 'set_player_clock',
+           'data': {'player': 0, 'clock': [1, 2]}, 'history': False}
+    received = copy.deepcopy(msg)
+    svr.on_json(request, msg)
+    svr._clock.stop(0)
+
+    assert msg == received
+    assert sent[-1]['type'] == 'set_player_clock'
+    assert sent[-1]['data']['player'] == 0
+    assert sent[-1]['data']['clock'] == pytest.approx(clock, abs=1)
+    assert sent[-1]['data']['clock'] != [1, 2]
+
+
+@pytest.mark.parametrize('mtype, data, path', [
+    ('cube', {'side': 0, 'value': 2, 'accepted': True}, ['cube']),
+    ('dice', {'player': 1, 'dice': [3, 5, 0, 0], 'roll': True},
+     ['dice', 1]),
+    ('set_player_clock', {'player': 1, 'clock': [30, 5]}, ['clock', 1]),
+])
+def test_received_msg_not_in_gameinfo(svr, mtype, data, path):
+    [svr, sent] = svr
+    request = SimpleNamespace(sid='sid0')
+
+    msg = {'src': 'client', 'type': mtype, 'data': data, 'history': True}
+    received = copy.deepcopy(msg)
+    svr.on_json(request, msg)
+
+    value = svr._bg.gameinfo['board']
+    for k in path:
+        value = value[k]
+    assert value is not data
+    assert all(value is not v for v in data.values())
+
+    # the next changes of the board don't reach the received message
+    svr._clock.reset(1)
+    svr._bg.gameinfo['board']['cube']['value'] = 64
+    svr._bg.gameinfo['board']['dice'][1][0] = 6
+    assert msg == received
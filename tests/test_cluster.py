@@ -0,0 +1,134 @@
+#
+# (c) Yoichi Tanibayashi
+#
+"""
+test_cluster.py
+
+clustered mode: boards of several workers on one SQLite database
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__   = '2020/05'
+
+from ytBackgammonSqlite import ytBackgammonSqlite
+from ytBackgammonCluster import ytBackgammonBroker, BROKER_SCHEME
+from ytBackgammonLoadTest import start_server, stop_server
+from conftest import move, play
+import copy
+import queue
+import socket
+import socketio
+import sqlite3
+import time
+import pytest
+
+
+def test_write_error_rolls_back(new_board, monkeypatch):
+    a = new_board(storage='sqlite', cluster=True)
+    b = new_board(storage='sqlite', cluster=True)
+    play(a, 4)
+    n = len(a._hist)
+    gameinfo = copy.deepcopy(a._bg.gameinfo)
+
+    def apply(self, ops):
+        raise sqlite3.OperationalError('disk I/O error')
+
+    with monkeypatch.context() as m:
+        m.setattr(ytBackgammonSqlite, 'apply', apply)
+        with pytest.raises(sqlite3.OperationalError):
+            move(a, 0, 3, 20)
+
+    # the board before the move, also in the worker that failed
+    for svr in [b, a]:
+        with svr.board_lock(write=False):
+            assert len(svr._hist) == n
+            assert svr._bg.gameinfo == gameinfo
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+
+class Client:
+    """
+    Socket.IO client of a worker, receives the json messages
+    """
+    def __init__(self, port):
+        self.msgs = queue.Queue()
+        self.sio = socketio.Client(reconnection=False)
+        self.sio.on('json', self.msgs.put)
+        self.sio.connect('http://localhost:%d?board=a' % (port))
+
+    def emit(self, mtype, data, history=True):
+        self.sio.emit('json', {'src': 'client', 'type': mtype,
+                               'data': data, 'history': history})
+
+    def wait(self, mtype, sec=10):
+        """
+        Returns
+        -------
+        msg: dict
+            the next message of the type (None: timeout)
+        """
+        t_end = time.monotonic() + sec
+        while True:
+            try:
+                msg = self.msgs.get(timeout=max(t_end - time.monotonic(), 0))
+            except queue.Empty:
+                return None
+            if msg['type'] == mtype:
+                return msg
+
+
+@pytest.fixture
+def cluster(tmp_path):
+    """
+    factory of ytbg.py workers serving board 'a' through a local broker
+    """
+    broker = ytBackgammonBroker(port=0)
+    broker.start()
+    options = ['-M', 'threading', '-s', 'sqlite',
+               '-C', '%slocalhost:%d' % (BROKER_SCHEME, broker.port)]
+    procs = []
+    clients = []
+
+    def new_worker():
+        port = free_port()
+        procs.append(start_server('threading', port, ['a'], str(tmp_path),
+                                  str(tmp_path / 'assets'), options=options))
+        clients.append(Client(port))
+        return procs[-1], clients[-1]
+
+    yield new_worker
+    for c in clients:
+        c.sio.disconnect()
+    for proc in procs:
+        if proc.poll() is None:
+            stop_server(proc)
+    broker.close()
+
+
+def test_broadcast_and_restart(cluster):
+    [proc_a, client_a] = cluster()
+    [proc_b, client_b] = cluster()
+    assert client_b.wait('gameinfo') is not None
+
+    # a move on worker a, to the clients of worker b
+    client_a.emit('put_checker', {'ch': 3, 'p': 20, 'idx': 0})
+    msg = client_b.wait('put_checker')
+    assert msg is not None
+    assert msg['data'] == {'ch': 3, 'p': 20, 'idx': 0}
+
+    # and worker b has the new board
+    client_b.emit('resync', {'seq': 0}, False)
+    gameinfo = client_b.wait('gameinfo')['data']
+    assert gameinfo['gameinfo']['board']['checker'][0][3] == [20, 0]
+
+    # a restarted worker takes over the board
+    stop_server(proc_a)
+    [proc_c, client_c] = cluster()
+    msg = client_c.wait('gameinfo')
+    assert msg['data']['gameinfo'] == gameinfo['gameinfo']
+    assert msg['data']['hist_i'] == gameinfo['hist_i']
+    assert msg['data']['hist_n'] == gameinfo['hist_n']
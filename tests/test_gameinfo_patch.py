@@ -0,0 +1,118 @@
+#
+# (c) Yoichi Tanibayashi
+#
+"""
+test_gameinfo_patch.py
+
+gameinfo broadcasts: patches with sequence numbers,
+a client that has missed one resyncs
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__   = '2020/05'
+
+from ytBackgammonHistory import gameinfo_patch
+from conftest import REQ, play, send
+import copy
+
+
+class Client:
+    """
+    gameinfo of a client, as static/ytbg.js keeps it
+    """
+    def __init__(self):
+        self.gameinfo = None
+        self.seq = None
+        self.resync_pending = False
+        self.n_resync = 0
+
+    def on_msg(self, svr, msg):
+        if msg['type'] == 'gameinfo':
+            self.gameinfo = copy.deepcopy(msg['data']['gameinfo'])
+            self.seq = msg['data']['seq']
+            self.resync_pending = False
+            return
+
+        if msg['type'] != 'gameinfo_patch' or self.resync_pending:
+            return
+        if msg['data']['base_seq'] != self.seq:
+            self.resync_pending = True
+            self.n_resync += 1
+            send(svr, 'resync', {'seq': self.seq}, False)
+            return
+        self.gameinfo = gameinfo_patch(self.gameinfo, msg['data']['patch'])
+        self.seq = msg['data']['seq']
+
+
+def receive(svr, sent, client, skip=()):
+    """
+    the messages to all clients or to REQ.sid,
+    except the patches of seq in skip
+    """
+    k = 0
+    while k < len(sent):
+        [_, msg, room] = sent[k]
+        k += 1
+        if room not in (svr._svr_id, REQ.sid):
+            continue
+        if msg['type'] == 'gameinfo_patch' and msg['data']['seq'] in skip:
+            continue
+        client.on_msg(svr, msg)
+    del sent[:]
+
+
+def test_patches(new_board, sent):
+    svr = new_board()
+    play(svr, 30)
+    client = Client()
+    send(svr, 'resync', {'seq': 0}, False)
+    receive(svr, sent, client)
+    seq = client.seq
+
+    for hist_i in [10, 3, 25, 26]:
+        send(svr, 'seek', {'hist_i': hist_i}, False)
+        [msg] = [d for (_, d, _) in sent if d['type'] == 'gameinfo_patch']
+        # only what has changed
+        assert 0 < len(msg['data']['patch']) < 40
+        receive(svr, sent, client)
+        assert client.gameinfo == svr._bg.gameinfo
+    assert client.seq == seq + 4
+    assert client.n_resync == 0
+
+
+def test_resync_after_gap(new_board, sent):
+    svr = new_board()
+    play(svr, 30)
+    client = Client()
+    send(svr, 'resync', {'seq': 0}, False)
+    receive(svr, sent, client)
+
+    send(svr, 'seek', {'hist_i': 10}, False)
+    lost = svr._bcast_seq
+    send(svr, 'seek', {'hist_i': 20}, False)
+    receive(svr, sent, client, skip=[lost])
+
+    assert client.n_resync == 1
+    assert client.seq == svr._bcast_seq
+    assert client.gameinfo == svr._bg.gameinfo
+
+    # and the patches apply again
+    send(svr, 'seek', {'hist_i': 5}, False)
+    receive(svr, sent, client)
+    assert client.n_resync == 1
+    assert client.gameinfo == svr._bg.gameinfo
+
+
+def test_resync_after_unbroadcast_change(new_board, sent):
+    # moves are broadcast as they are, not as gameinfo patches:
+    # a resync brings the last broadcast up to date first
+    svr = new_board()
+    play(svr, 4)
+    client = Client()
+    send(svr, 'resync', {'seq': 0}, False)
+    receive(svr, sent, client)
+
+    play(svr, 4, seed=2)
+    send(svr, 'resync', {'seq': client.seq}, False)
+    receive(svr, sent, client)
+    assert client.gameinfo == svr._bg.gameinfo
+    assert client.seq == svr._bcast_seq
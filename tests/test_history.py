@@ -0,0 +1,105 @@
+#
+# (c) Yoichi Tanibayashi
+#
+"""
+test_history.py
+
+history entries: keyframes and diffs, the cursor,
+and the data file (version 2 and the old format)
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__   = '2020/05'
+
+from ytBackgammonHistory import ytBackgammonHistory
+from ytBackgammonHistory import gameinfo_diff, gameinfo_patch
+from conftest import play, send
+import copy
+import json
+
+
+def entries(hist):
+    return [hist.get(i) for i in range(len(hist))]
+
+
+def played(new_board, n=30):
+    """
+    Returns
+    -------
+    gameinfos: list of dict
+        of a played board
+    """
+    svr = new_board()
+    play(svr, n)
+    return entries(svr._hist)
+
+
+def test_diff_patch(new_board):
+    [old, new] = played(new_board, 2)[-2:]
+    old0 = copy.deepcopy(old)
+    diff = gameinfo_diff(old, new)
+
+    assert 0 < len(diff) < 5
+    assert gameinfo_patch(copy.deepcopy(old), diff) == new
+    assert old == old0
+
+
+def test_keyframes(new_board):
+    gameinfos = played(new_board)
+    hist = ytBackgammonHistory(keyframe_interval=4)
+    for gameinfo in gameinfos:
+        hist.add(copy.deepcopy(gameinfo))
+
+    for i, gameinfo in enumerate(gameinfos):
+        ent = hist.entry(i)
+        assert ('key' in ent) == (i % 4 == 0)
+        if 'diff' in ent:
+            assert len(json.dumps(ent)) < len(json.dumps(gameinfo)) / 4
+    assert entries(hist) == gameinfos
+
+
+def test_cursor(new_board):
+    gameinfos = played(new_board)
+    hist = ytBackgammonHistory(keyframe_interval=4)
+    for gameinfo in gameinfos:
+        hist.add(gameinfo)
+
+    assert hist.backward() == gameinfos[-2]
+    assert hist.set_cursor(7) == gameinfos[6]
+    assert hist.backward() == gameinfos[5]
+    assert hist.forward() == gameinfos[6]
+    # a new object each time
+    hist.forward()['sn'] = -1
+    assert hist.set_cursor(8) == gameinfos[7]
+    assert hist.set_cursor(0) == gameinfos[0]
+    assert hist.set_cursor(len(hist) + 5) == gameinfos[-1]
+
+
+def test_data_file(new_board):
+    svr = new_board()
+    play(svr, 40)
+    send(svr, 'seek', {'hist_i': 33})
+    expected = entries(svr._hist)
+
+    with open(svr._datafile_path) as f:
+        data = json.load(f)
+    assert data['version'] == 2
+    assert data['hist_i'] == 33
+    assert 'key' in data['entries'][0]
+    assert any('diff' in ent for ent in data['entries'])
+
+    svr = new_board()
+    assert entries(svr._hist) == expected
+    assert svr._bg.gameinfo == expected[32]
+
+
+def test_old_data_file(new_board):
+    svr = new_board()
+    play(svr, 12)
+    gameinfos = entries(svr._hist)
+    with open(svr._datafile_path, 'w') as f:
+        json.dump({'history': gameinfos[:9],
+                   'fwd_hist': gameinfos[9:][::-1]}, f)
+
+    svr = new_board()
+    assert entries(svr._hist) == gameinfos
+    assert svr._hist.hist_i == 9
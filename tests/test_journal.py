@@ -0,0 +1,82 @@
+#
+# (c) Yoichi Tanibayashi
+#
+"""
+test_journal.py
+
+journal storage: records are appended, replayed on restart
+and compacted
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__   = '2020/05'
+
+from conftest import play, send
+import json
+
+
+def entries(hist):
+    return [hist.get(i) for i in range(len(hist))]
+
+
+def records(svr):
+    with open(svr._journal_path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_append_only(new_board):
+    svr = new_board(storage='journal')
+    play(svr, 3)
+    with open(svr._journal_path) as f:
+        head = f.read()
+    n = len(svr._hist)
+    assert [rec['op'] for rec in records(svr)] == ['add'] * n
+
+    play(svr, 2, seed=3)
+    send(svr, 'seek', {'hist_i': 2})
+    with open(svr._journal_path) as f:
+        assert f.read().startswith(head)
+    assert [rec['op'] for rec in records(svr)] == \
+        ['add'] * len(svr._hist) + ['cursor']
+    assert records(svr)[-1]['hist_i'] == 2
+
+
+def test_restart(new_board):
+    svr = new_board(storage='journal')
+    play(svr, 40)
+    send(svr, 'seek', {'hist_i': 30})
+    play(svr, 5, seed=1)
+    send(svr, 'seek', {'hist_i': 20})
+    expected = entries(svr._hist)
+    hist_i = svr._hist.hist_i
+
+    svr = new_board(storage='journal')
+    assert entries(svr._hist) == expected
+    assert svr._hist.hist_i == hist_i
+    assert svr._bg.gameinfo == expected[hist_i - 1]
+
+    # compacted: the variations, the entries and the cursor
+    ops = [rec['op'] for rec in records(svr)]
+    assert ops == ['vars'] + ['add'] * len(expected) + ['cursor']
+    assert new_board(storage='journal')._hist.hist_i == hist_i
+
+
+def test_cut_last_line(new_board):
+    svr = new_board(storage='journal')
+    play(svr, 6)
+    expected = entries(svr._hist)
+    with open(svr._journal_path, 'a') as f:
+        f.write('{"op": "add", "sn": 99, "di')
+
+    svr = new_board(storage='journal')
+    assert entries(svr._hist) == expected
+
+
+def test_migrate_from_json(new_board):
+    svr = new_board(storage='json')
+    play(svr, 10)
+    send(svr, 'seek', {'hist_i': 5})
+    expected = entries(svr._hist)
+
+    svr = new_board(storage='journal')
+    assert entries(svr._hist) == expected
+    assert svr._hist.hist_i == 5
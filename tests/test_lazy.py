@@ -0,0 +1,69 @@
+#
+# (c) Yoichi Tanibayashi
+#
+"""
+test_lazy.py
+
+lazy loading: only the entries near the cursor are loaded at startup,
+the others when they are accessed
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__   = '2020/05'
+
+from conftest import play, send
+import pytest
+
+
+def entries(hist):
+    return [hist.get(i) for i in range(len(hist))]
+
+
+@pytest.mark.parametrize('storage, kwargs, n_moves', [
+    ('json', {}, 300), ('sqlite', {}, 300),
+    # spilled
+    ('sqlite', {'max_hist': 300}, 1000),
+])
+def test_lazy(new_board, storage, kwargs, n_moves):
+    svr = new_board(storage=storage)
+    play(svr, n_moves)
+    hist_i = len(svr._hist) - 50
+    send(svr, 'seek', {'hist_i': hist_i})
+    expected = entries(svr._hist)
+    n = len(expected)
+
+    svr = new_board(storage=storage, lazy=10, **kwargs)
+    hist = svr._hist
+    assert 0 < hist.lazy_n <= hist_i - 10
+    assert len(hist) == n
+    assert hist.hist_i == hist_i
+    assert svr._bg.gameinfo == expected[hist_i - 1]
+
+    # back into the entries not loaded yet
+    send(svr, 'seek', {'hist_i': 100}, False)
+    assert svr._bg.gameinfo == expected[99]
+    assert hist.lazy_n < 100
+    assert entries(hist) == expected
+
+    # saved with the entries not loaded
+    svr = new_board(storage=storage, lazy=10, **kwargs)
+    play(svr, 2, seed=5)
+    expected = expected[:100] + entries(svr._hist)[100:]
+    svr = new_board(storage=storage)
+    assert svr._hist.lazy_n == 0
+    assert entries(svr._hist) == expected
+
+
+def test_json_save_without_loading(new_board):
+    svr = new_board()
+    play(svr, 200)
+    with open(svr._datafile_path) as f:
+        data = f.read()
+
+    svr = new_board(lazy=10)
+    lazy_n = svr._hist.lazy_n
+    assert lazy_n > 0
+    svr.flush()
+    # the old entries are copied as they are
+    assert svr._hist.lazy_n == lazy_n
+    with open(svr._datafile_path) as f:
+        assert f.read() == data
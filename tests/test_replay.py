@@ -0,0 +1,93 @@
+#
+# (c) Yoichi Tanibayashi
+#
+"""
+test_replay.py
+
+history replay: a background task, cancelled by a move
+or by another replay
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__   = '2020/05'
+
+from flask import Flask
+from flask_socketio import SocketIO
+from conftest import play, move, send
+import time
+import pytest
+
+
+def test_sync(new_board, sent):
+    # without socketio: runs in the handler
+    svr = new_board(storage='journal')
+    play(svr, 10)
+    n = len(svr._hist)
+    del sent[:]
+
+    send(svr, 'back', {'n': 3}, False)
+    assert svr._hist.hist_i == n - 3
+    # each step is broadcast
+    assert [d['type'] for (_, d, _) in sent][1:] == ['gameinfo_patch'] * 2
+    assert [d['data']['hist_i'] for (_, d, _) in sent] == \
+        [n - 1, n - 2, n - 3]
+    assert svr._bg.gameinfo == svr._hist.get(n - 4)
+
+    # the cursor is saved at the end
+    svr = new_board(storage='journal')
+    assert svr._hist.hist_i == n - 3
+
+
+@pytest.fixture
+def bg_board(new_board):
+    """
+    board with socketio: the replay runs in a background task
+    """
+    app = Flask(__name__)
+    socketio = SocketIO(app, async_mode='threading')
+    svr = new_board(storage='journal', socketio=socketio)
+    play(svr, 20)
+    yield svr
+    svr.cancel_replay()
+
+
+def wait_stop(svr, sec=0.3):
+    """
+    Returns
+    -------
+    hist_i: int
+        after the cursor has stopped
+    """
+    while True:
+        hist_i = svr._hist.hist_i
+        time.sleep(sec)
+        if svr._hist.hist_i == hist_i:
+            return hist_i
+
+
+def test_cancel_by_move(bg_board):
+    svr = bg_board
+    n = len(svr._hist)
+
+    t0 = time.monotonic()
+    send(svr, 'back2', {}, False)
+    # the handler returns at once
+    assert time.monotonic() - t0 < 0.3
+    time.sleep(1.2)
+
+    move(svr, 0, 3, 20)
+    hist_i = wait_stop(svr)
+    assert 1 < hist_i < n
+    # the move is after the cursor where the replay was stopped
+    assert len(svr._hist) == hist_i
+    assert svr._bg.gameinfo['board']['checker'][0][3] == [20, 0]
+
+
+def test_cancel_by_replay(bg_board):
+    svr = bg_board
+    n = len(svr._hist)
+
+    send(svr, 'back2', {}, False)
+    time.sleep(1.2)
+    send(svr, 'fwd_all', {}, False)
+    assert wait_stop(svr) == n
+    assert svr._bg.gameinfo == svr._hist.get(n - 1)
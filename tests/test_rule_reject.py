@@ -0,0 +1,101 @@
+#
+# (c) Yoichi Tanibayashi
+#
+"""
+test_rule_reject.py
+
+server side move check (-r): an illegal move is rejected
+and the sender is resynced with the current board
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__   = '2020/05'
+
+from ytBackgammonServer import ytBackgammonServer
+from flask import Flask, request
+from flask_socketio import SocketIO
+import pytest
+
+
+@pytest.fixture
+def board(tmp_path, monkeypatch):
+    monkeypatch.setattr(ytBackgammonServer, 'DATAFILE_DIR', str(tmp_path))
+
+    app = Flask(__name__)
+    socketio = SocketIO(app, async_mode='threading')
+    svr = ytBackgammonServer('test', '0', 'a', 'images1', rule=True,
+                             socketio=socketio)
+
+    @socketio.on('connect')
+    def handle_connect():
+        svr.on_connect(request)
+
+    @socketio.on('json')
+    def handle_json(msg):
+        svr.on_json(request, msg)
+
+    client = socketio.test_client(app)
+    client.get_received()
+    return svr, client
+
+
+def send(client, mtype, data, history):
+    client.emit('json', {'src': 'client', 'type': mtype, 'data': data,
+                         'history': history})
+
+
+def checker_on(gameinfo, player, p):
+    """
+    index of a checker of player on point p
+    """
+    checkers = gameinfo['board']['checker'][player]
+    return [i for i in range(len(checkers)) if checkers[i][0] == p][0]
+
+
+def test_reject_resyncs_current_board(board):
+    [svr, client] = board
+
+    send(client, 'set_turn', {'turn': 0, 'resign': -1}, True)
+    send(client, 'dice', {'player': 0, 'dice': [3, 1, 0, 0], 'roll': True},
+         True)
+    ch8 = checker_on(svr._bg.gameinfo, 0, 8)
+    ch13 = checker_on(svr._bg.gameinfo, 0, 13)
+
+    # legal: 8 -> 5, the dice are marked used by the client
+    send(client, 'put_checker', {'ch': ch8, 'p': 5, 'idx': 0}, False)
+    send(client, 'dice', {'player': 0, 'dice': [13, 1, 0, 0], 'roll': False},
+         True)
+    client.get_received()
+
+    # illegal: 13 -> 10 with the 1 left
+    send(client, 'put_checker', {'ch': ch13, 'p': 10, 'idx': 0}, False)
+    resync = [m['args'] for m in client.get_received()
+              if m['args']['type'] == 'gameinfo']
+    assert len(resync) == 1
+
+    gameinfo = resync[0]['data']['gameinfo']
+    assert gameinfo == svr._bg.gameinfo
+    assert gameinfo['turn'] == 0
+    assert gameinfo['board']['dice'][0] == [13, 1, 0, 0]
+    assert gameinfo['board']['checker'][0][ch8][0] == 5
+    assert gameinfo['board']['checker'][0][ch13][0] == 13
+
+
+def test_reject_drops_followup_dice(board):
+    [svr, client] = board
+
+    send(client, 'set_turn', {'turn': 0, 'resign': -1}, True)
+    send(client, 'dice', {'player': 0, 'dice': [3, 1, 0, 0], 'roll': True},
+         True)
+    ch13 = checker_on(svr._bg.gameinfo, 0, 13)
+    hist_n = len(svr._hist)
+
+    send(client, 'put_checker', {'ch': ch13, 'p': 7, 'idx': 0}, False)
+    send(client, 'dice', {'player': 0, 'dice': [13, 1, 0, 0], 'roll': False},
+         True)
+    assert svr._bg.gameinfo['board']['dice'][0] == [3, 1, 0, 0]
+    assert len(svr._hist) == hist_n
+
+    # only the one right after the rejected move
+    send(client, 'dice', {'player': 0, 'dice': [13, 1, 0, 0], 'roll': False},
+         True)
+    assert svr._bg.gameinfo['board']['dice'][0] == [13, 1, 0, 0]
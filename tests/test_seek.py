@@ -0,0 +1,61 @@
+#
+# (c) Yoichi Tanibayashi
+#
+"""
+test_seek.py
+
+seek: the cursor jumps, only the final position is broadcast
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__   = '2020/05'
+
+from conftest import play, send
+
+
+def gameinfo_msgs(sent):
+    return [d for (_, d, _) in sent
+            if d['type'] in ('gameinfo', 'gameinfo_patch')]
+
+
+def test_seek(new_board, sent):
+    svr = new_board()
+    play(svr, 200)
+    n = len(svr._hist)
+    del sent[:]
+
+    send(svr, 'seek', {'hist_i': 5, 'sec': 0.5}, False)
+    assert svr._hist.hist_i == 5
+    assert svr._bg.gameinfo == svr._hist.get(4)
+    [msg] = gameinfo_msgs(sent)
+    assert msg['data']['hist_i'] == 5
+    assert msg['data']['hist_n'] == n
+    assert msg['data']['sec'] == 0.5
+    assert msg['data']['history_flag']
+
+    # from the end
+    send(svr, 'seek', {'hist_i': -2}, False)
+    assert svr._hist.hist_i == n - 1
+    assert svr._bg.gameinfo == svr._hist.get(n - 2)
+    assert len(gameinfo_msgs(sent)) == 2
+
+
+def test_out_of_range(new_board):
+    svr = new_board()
+    play(svr, 8)
+    n = len(svr._hist)
+
+    send(svr, 'seek', {'hist_i': n + 10}, False)
+    assert svr._hist.hist_i == n
+    send(svr, 'seek', {'hist_i': 0}, False)
+    assert svr._hist.hist_i == 1
+    send(svr, 'seek', {'hist_i': -n - 10}, False)
+    assert svr._hist.hist_i == 1
+
+
+def test_cursor_saved(new_board):
+    svr = new_board(storage='journal')
+    play(svr, 20)
+    send(svr, 'seek', {'hist_i': 7}, False)
+
+    svr = new_board(storage='journal')
+    assert svr._hist.hist_i == 7
@@ -0,0 +1,65 @@
+#
+# (c) Yoichi Tanibayashi
+#
+"""
+test_spectator.py
+
+spectators: the broadcasts are coalesced to a snapshot of the board
+(and the latest clock messages), at most spectator_rate times/sec
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__   = '2020/05'
+
+from ytBackgammonClock import ClockScheduler
+from conftest import play, send
+import time
+
+ROOM = 'a/watch'
+
+
+def spec_msgs(sent):
+    return [d for (event, d, room) in sent
+            if room == ROOM and event == 'json']
+
+
+def test_coalesce(new_board, sent):
+    svr = new_board(storage='journal', fanout_scheduler=ClockScheduler(),
+                    spectator_rate=4)
+    svr._spectator_sid.add('spec0')
+    del sent[:]
+
+    play(svr, 20)
+    for c in [[10, 1], [9, 1], [8, 0]]:
+        send(svr, 'set_player_clock', {'player': 1, 'clock': c}, False)
+    send(svr, 'set_player_clock', {'player': 0, 'clock': [7, 0]}, False)
+    time.sleep(0.6)
+
+    # players: each message
+    assert len([d for (_, d, room) in sent if room == 'a']) > 20
+    # spectators: the first one at once, then the rest every 1/4 sec
+    msgs = spec_msgs(sent)
+    assert 2 <= [d['type'] for d in msgs].count('gameinfo') <= 3
+    assert msgs[-3]['type'] == 'gameinfo'
+    assert msgs[-3]['data']['gameinfo'] == svr._bg.gameinfo
+    # the latest clock message of each player
+    assert [(d['type'], d['data']) for d in msgs[-2:]] == [
+        ('set_player_clock', {'player': 1, 'clock': [8, 0]}),
+        ('set_player_clock', {'player': 0, 'clock': [7, 0]})]
+
+
+def test_not_coalesced(new_board, sent):
+    # spectator_rate=0: a snapshot for each broadcast
+    svr = new_board(fanout_scheduler=ClockScheduler(), spectator_rate=0)
+    svr._spectator_sid.add('spec0')
+    del sent[:]
+
+    play(svr, 3)
+    msgs = spec_msgs(sent)
+    assert [d['type'] for d in msgs] == ['gameinfo'] * 4
+    assert msgs[-1]['data']['gameinfo'] == svr._bg.gameinfo
+
+
+def test_no_spectators(new_board, sent):
+    svr = new_board(fanout_scheduler=ClockScheduler())
+    play(svr, 3)
+    assert spec_msgs(sent) == []
@@ -0,0 +1,68 @@
+#
+# (c) Yoichi Tanibayashi
+#
+"""
+test_spill.py
+
+ytBackgammonSpill: the slots are reused, the file doesn't grow
+with the rewrites of the segments
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__   = '2020/05'
+
+from ytBackgammonHistory import ytBackgammonSpill
+from conftest import play
+
+
+def test_overwrite_in_place(tmp_path):
+    spill = ytBackgammonSpill(str(tmp_path))
+    spill.put(0, list(range(100)))
+    size = spill.size()
+    for i in range(50):
+        spill.put(0, list(range(100 - i)))
+        assert spill.get(0) == list(range(100 - i))
+    assert spill.size() == size
+
+
+def test_reuse_free_slots(tmp_path):
+    spill = ytBackgammonSpill(str(tmp_path))
+    for s in range(4):
+        spill.put(s, [s] * 100)
+    size = spill.size()
+
+    # larger: to a new slot, and the old one is reused
+    spill.put(0, [0] * 200)
+    spill.discard(1)
+    spill.put(4, [4] * 100)
+    spill.put(5, [5] * 100)
+    assert spill.size() < size * 2
+    assert 1 not in spill
+    for s in [0, 2, 3, 4, 5]:
+        assert spill.get(s) == [s] * (200 if s == 0 else 100)
+
+
+def test_compact(tmp_path):
+    spill = ytBackgammonSpill(str(tmp_path))
+    spill.COMPACT_BYTES = 1000
+    for n in range(1, 200):
+        # always larger: no slot fits
+        spill.put(0, [0] * n)
+        spill.put(1, [1] * n)
+        assert spill.get(0) == [0] * n
+    assert spill.size() < 3 * len('[%s]' % ','.join(['0'] * 199)) + 1000
+
+
+def test_max_hist(new_board):
+    svr = new_board(storage='journal', max_hist=300)
+    play(svr, 1500)
+    hist = svr._hist
+    size = hist._spill.size()
+    # the same history in memory
+    ref = new_board(storage='journal')._hist
+    assert len(ref) == len(hist)
+
+    # random access: segments are spilled and read back again and again
+    for k in range(3000):
+        i = k * 7919 % len(hist)
+        assert hist.get(i) == ref.get(i)
+    assert hist._spill.size() <= size * 2
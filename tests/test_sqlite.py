@@ -0,0 +1,78 @@
+#
+# (c) Yoichi Tanibayashi
+#
+"""
+test_sqlite.py
+
+SQLite storage: entries and cursor over restarts,
+queries of the games and the positions
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__   = '2020/05'
+
+from ytBackgammonSqlite import games, game_positions
+from conftest import play, send
+import sqlite3
+
+
+def entries(hist):
+    return [hist.get(i) for i in range(len(hist))]
+
+
+def test_restart(new_board):
+    svr = new_board(storage='sqlite')
+    play(svr, 50)
+    send(svr, 'seek', {'hist_i': 40})
+    play(svr, 5, seed=1)
+    send(svr, 'seek', {'hist_i': 30})
+    expected = entries(svr._hist)
+
+    db = sqlite3.connect(svr._sqlite_path)
+    [n, n_key] = db.execute('SELECT COUNT(*), COUNT(key) FROM entry'
+                            ' WHERE board_id = ?', ('a',)).fetchone()
+    # keyframes and diffs
+    assert n == len(expected)
+    assert 0 < n_key < n / 4
+
+    svr = new_board(storage='sqlite')
+    assert entries(svr._hist) == expected
+    assert svr._hist.hist_i == 30
+
+
+def test_games(new_board):
+    svr = new_board(storage='sqlite')
+    for name in ['alice', 'bob']:
+        send(svr, 'set_playername', {'player': 0, 'name': name})
+        send(svr, 'set_playername', {'player': 1, 'name': 'carol'})
+        play(svr, 6)
+        send(svr, 'new', {})
+    play(svr, 3)
+    hist = svr._hist
+
+    db = sqlite3.connect(svr._sqlite_path)
+    # the names are kept by the new game
+    assert [g['game_num'] for g in games(db, 'carol')] == [0, 1, 2]
+    [g] = games(db, 'alice')
+    assert g['game_num'] == 0
+    assert g['playername'] == ['alice', 'carol']
+    assert [g['game_num'] for g in games(db, 'bob', 'a')] == [1, 2]
+    assert games(db, 'dave') == []
+
+    positions = [hist.get(i) for i in range(len(hist))
+                 if hist.get(i)['game_num'] == 1]
+    assert game_positions(db, 'a', 1) == positions
+    assert game_positions(db, 'a', 5) == []
+
+
+def test_migrate_from_json(new_board):
+    svr = new_board()
+    play(svr, 10)
+    send(svr, 'seek', {'hist_i': 4})
+    expected = entries(svr._hist)
+
+    svr = new_board(storage='sqlite')
+    assert entries(svr._hist) == expected
+    assert svr._hist.hist_i == 4
+    # from the database at the next start
+    svr = new_board(storage='sqlite')
+    assert entries(svr._hist) == expected
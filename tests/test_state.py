@@ -0,0 +1,91 @@
+#
+# (c) Yoichi Tanibayashi
+#
+"""
+test_state.py
+
+ytBackgammonState: the same game as the gameinfo dict
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__   = '2020/05'
+
+from ytBackgammon import ytBackgammon, ytBackgammonState
+from ytBackgammonHistory import gameinfo_diff, gameinfo_patch
+from conftest import play, send
+import copy
+import pytest
+
+
+def calls(bg):
+    """
+    the same changes of the board, as the message handlers do
+    """
+    bg.put_checker(3, 20, 0)
+    bg.put_checker(112, 7, 1)
+    bg.dice({'player': 1, 'dice': [6, 2, 0, 0]})
+    bg.cube({'side': 1, 'value': 2, 'accepted': True})
+    bg.set_turn({'turn': 1, 'resign': -1})
+    bg.set_playername({'player': 0, 'name': 'ytani'})
+    bg.set_score({'player': 1, 'score': 3})
+    bg.set_game_num(2)
+    bg.set_clock_limit({'index': 1, 'clock_limit': 15})
+    bg.set_player_clock({'player': 0, 'clock': [123.5, 4]})
+    bg.resign({'player': 0})
+
+
+def test_same_as_dict():
+    bg = ytBackgammon('0')
+    compact = ytBackgammon('0', compact=True)
+    assert isinstance(compact.state, ytBackgammonState)
+    assert compact.gameinfo == bg.gameinfo
+
+    calls(bg)
+    calls(compact)
+    assert compact.gameinfo == bg.gameinfo
+
+
+def test_round_trip(new_board):
+    svr = new_board()
+    play(svr, 20)
+    for i in range(len(svr._hist)):
+        gameinfo = svr._hist.get(i)
+        st = ytBackgammonState.from_gameinfo(gameinfo)
+        assert st.to_gameinfo() == gameinfo
+
+
+def test_copy_eq_hash():
+    st = ytBackgammonState.from_gameinfo(ytBackgammon('0').gameinfo)
+    st2 = st.copy()
+    assert st2 == st and hash(st2) == hash(st)
+
+    st2.put_checker(0, 3, 20, 0)
+    st2.playername[1] = 'x'
+    assert st2 != st
+    assert st.to_gameinfo() == ytBackgammon('0').gameinfo
+
+
+def test_diff():
+    bg = ytBackgammon('0')
+    old = copy.deepcopy(bg.gameinfo)
+    calls(bg)
+
+    st0 = ytBackgammonState.from_gameinfo(old)
+    st1 = ytBackgammonState.from_gameinfo(bg.gameinfo)
+    diff = st1.diff(st0)
+    assert gameinfo_patch(copy.deepcopy(old), diff) == bg.gameinfo
+    assert sorted(map(str, diff)) == \
+        sorted(map(str, gameinfo_diff(old, bg.gameinfo)))
+
+
+@pytest.mark.parametrize('storage', ['json', 'journal', 'sqlite'])
+def test_compact_board_storage(new_board, storage):
+    svr = new_board(storage=storage, compact=True)
+    play(svr, 40)
+    send(svr, 'seek', {'hist_i': 30})
+    play(svr, 3, seed=2)
+    expected = [svr._hist.get(i) for i in range(len(svr._hist))]
+
+    for compact in [False, True]:
+        svr = new_board(storage=storage, compact=compact)
+        assert [svr._hist.get(i) for i in range(len(svr._hist))] == expected
+        assert svr._bg.gameinfo == expected[-1]
@@ -0,0 +1,27 @@
+#
+# (c) Yoichi Tanibayashi
+#
+"""
+test_top.py
+
+the top page refers to the images through the asset URLs
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__   = '2020/05'
+
+from ytBackgammonAssets import ytBackgammonAssets
+from flask import render_template
+import ytbg
+
+
+def test_checker_images(tmp_path, monkeypatch):
+    assets = ytBackgammonAssets('static', str(tmp_path))
+    monkeypatch.setattr(ytbg, 'assets', assets)
+
+    with ytbg.app.test_request_context():
+        html = render_template('top.html', name='test', version='0',
+                               image_dir='images2')
+    for p in range(2):
+        url = assets.url('images2/checker%d.png' % (p))
+        assert url.startswith(ytBackgammonAssets.URL_PREFIX)
+        assert '<image src="%s">' % (url) in html
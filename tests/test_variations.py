@@ -0,0 +1,74 @@
+#
+# (c) Yoichi Tanibayashi
+#
+"""
+test_variations.py
+
+variations of the history are kept by each storage over restarts
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__   = '2020/05'
+
+from conftest import play, send
+import pytest
+
+
+def entries(hist):
+    return [hist.get(i) for i in range(len(hist))]
+
+
+@pytest.mark.parametrize('storage, kwargs', [
+    ('json', {}), ('json', {'lazy': 4}),
+    ('journal', {}), ('journal', {'max_hist': 300}),
+    ('sqlite', {}), ('sqlite', {'lazy': 4}),
+])
+def test_restart_keeps_variations(new_board, storage, kwargs):
+    svr = new_board(storage=storage, **kwargs)
+    play(svr, 12)
+    # var_id -> entries
+    expected = {0: entries(svr._hist)}
+    send(svr, 'seek', {'hist_i': 8})
+    play(svr, 4, seed=3)
+    expected[1] = entries(svr._hist)
+    send(svr, 'seek', {'hist_i': 10})
+    play(svr, 2, seed=5)
+    expected[2] = entries(svr._hist)
+
+    send(svr, 'switch_branch', {'id': 0})
+    variations = svr._hist.variations()
+    assert [v['id'] for v in variations] == [0, 1, 2]
+    assert entries(svr._hist) == expected[0]
+
+    svr = new_board(storage=storage, **kwargs)
+    assert svr._hist.variations() == variations
+    assert svr._hist.hist_i == 9
+    assert entries(svr._hist) == expected[0]
+
+    for var_id in [2, 1, 0, 2]:
+        send(svr, 'switch_branch', {'id': var_id})
+        assert entries(svr._hist) == expected[var_id]
+    variations = svr._hist.variations()
+
+    # the switches are saved too
+    svr = new_board(storage=storage, **kwargs)
+    assert svr._hist.variations() == variations
+    assert entries(svr._hist) == expected[2]
+    send(svr, 'switch_branch', {'id': 1})
+    assert entries(svr._hist) == expected[1]
+
+
+def test_cluster_shares_variations(new_board):
+    a = new_board(storage='sqlite', cluster=True)
+    b = new_board(storage='sqlite', cluster=True)
+    play(a, 12)
+    send(a, 'seek', {'hist_i': 8})
+    play(a, 4, seed=3)
+    with a.board_lock(write=False):
+        variations = a._hist.variations()
+
+    send(b, 'switch_branch', {'id': 0})
+    with b.board_lock(write=False):
+        assert b._hist.variations() != variations
+    with a.board_lock(write=False):
+        assert a._hist.variations() == b._hist.variations()
+        assert entries(a._hist) == entries(b._hist)
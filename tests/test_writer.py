@@ -0,0 +1,109 @@
+#
+# (c) Yoichi Tanibayashi
+#
+"""
+test_writer.py
+
+write-behind persistence: coalesced writes in the writer thread,
+crash safe files
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__   = '2020/05'
+
+from ytBackgammonWriter import ytBackgammonWriter
+from conftest import play
+import os
+import threading
+import time
+import pytest
+
+
+class Target:
+    def __init__(self, sec=0):
+        self.sec = sec
+        self.n = 0
+        self.flushed = threading.Event()
+
+    def flush(self):
+        time.sleep(self.sec)
+        self.n += 1
+        self.flushed.set()
+
+
+def test_coalesce():
+    writer = ytBackgammonWriter()
+    target = Target(0.2)
+    writer.mark(target)
+    assert target.flushed.wait(1)
+    # the first change is written at once,
+    # the ones during that write are coalesced into one more
+    for i in range(10):
+        writer.mark(target)
+        time.sleep(0.01)
+    writer.close()
+    assert target.n == 3
+
+
+def test_interval():
+    writer = ytBackgammonWriter(ytBackgammonWriter.POLICY_INTERVAL, 200)
+    target = Target()
+    t0 = time.monotonic()
+    for i in range(5):
+        writer.mark(target)
+    assert target.flushed.wait(1)
+    assert time.monotonic() - t0 >= 0.2
+    assert target.n == 1
+    writer.close()
+
+
+def test_shutdown():
+    writer = ytBackgammonWriter(ytBackgammonWriter.POLICY_SHUTDOWN)
+    target = Target()
+    writer.mark(target)
+    assert not target.flushed.wait(0.2)
+    writer.close()
+    assert target.n == 1
+
+
+@pytest.mark.parametrize('storage', ['json', 'journal', 'sqlite'])
+def test_board(new_board, storage):
+    writer = ytBackgammonWriter(ytBackgammonWriter.POLICY_INTERVAL, 100)
+    svr = new_board(storage=storage, writer=writer)
+    play(svr, 30)
+    expected = [svr._hist.get(i) for i in range(len(svr._hist))]
+    writer.close()
+
+    svr = new_board(storage=storage)
+    assert [svr._hist.get(i) for i in range(len(svr._hist))] == expected
+
+
+def test_atomic_write(new_board, monkeypatch):
+    svr = new_board()
+    play(svr, 4)
+    with open(svr._datafile_path) as f:
+        data = f.read()
+
+    def replace(src, dst):
+        raise OSError('no space left on device')
+
+    with monkeypatch.context() as m:
+        m.setattr(os, 'replace', replace)
+        play(svr, 4, seed=1)
+    # the old file, as it was
+    with open(svr._datafile_path) as f:
+        assert f.read() == data
+
+
+def test_bad_file_is_kept(new_board):
+    svr = new_board()
+    play(svr, 4)
+    with open(svr._datafile_path) as f:
+        data = f.read()
+    with open(svr._datafile_path, 'w') as f:
+        f.write(data[:len(data) // 2])
+
+    # a new game, not written over the bad file
+    svr = new_board()
+    assert len(svr._hist) == 1
+    with open(svr._datafile_path + '.bad') as f:
+        assert f.read() == data[:len(data) // 2]
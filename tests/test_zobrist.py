@@ -0,0 +1,95 @@
+#
+# (c) Yoichi Tanibayashi
+#
+"""
+test_zobrist.py
+
+Zobrist hashes of the history entries: incremental hashes are the same
+as the ones made from scratch, also after a reload
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__   = '2020/05'
+
+from ytBackgammonHistory import ytBackgammonZobrist
+from conftest import play, send
+import pytest
+
+
+def zhashes(hist):
+    return [hist.zhash(i) for i in range(len(hist))]
+
+
+def scratch_zhashes(hist):
+    return [ytBackgammonZobrist(hist.get(i)).hash for i in range(len(hist))]
+
+
+@pytest.mark.parametrize('storage', ['json', 'journal', 'sqlite'])
+def test_reload_keeps_zhash(new_board, storage):
+    svr = new_board(storage=storage)
+    play(svr, 12)
+    # back, then move: cursor record and a new branch
+    send(svr, 'seek', {'hist_i': 8})
+    play(svr, 6, seed=3)
+    send(svr, 'seek', {'hist_i': 11})
+    play(svr, 3, seed=5)
+
+    hashes = zhashes(svr._hist)
+    assert hashes == scratch_zhashes(svr._hist)
+
+    svr = new_board(storage=storage)
+    assert zhashes(svr._hist) == hashes
+
+
+def test_find_position(new_board):
+    svr = new_board()
+    play(svr, 8)
+    hist = svr._hist
+    zh = hist.zhash(3)
+
+    # the same position again
+    svr._bg.gameinfo = hist.get(3)
+    svr.add_history(svr._bg.state)
+    i = len(hist) - 1
+
+    assert hist.zhash(i) == zh
+    assert hist.find_position(zh) == [3, i]
+    assert hist.last_position(i) == 3
+    assert hist.last_position(3) is None
+
+
+@pytest.mark.parametrize('storage', ['json', 'sqlite'])
+def test_find_position_lazy(new_board, storage):
+    svr = new_board(storage=storage)
+    play(svr, 80)
+    hist = svr._hist
+    zh = hist.zhash(5)
+    expected = hist.find_position(zh)
+    assert 5 in expected
+
+    # the same position again, at the end
+    svr._bg.gameinfo = hist.get(5)
+    svr.add_history(svr._bg.state)
+    expected.append(len(hist) - 1)
+
+    svr = new_board(storage=storage, lazy=10)
+    hist = svr._hist
+    assert hist.lazy_n > 0
+    lazy_n = hist.lazy_n
+
+    assert hist.find_position(zh) == expected
+    assert hist.last_position(len(hist) - 1) == expected[-2]
+    # found without loading
+    assert hist.lazy_n == lazy_n
+
+
+def test_find_position_max_hist(new_board):
+    svr = new_board(storage='journal', max_hist=300)
+    play(svr, 1200)
+    hist = svr._hist
+    zhs = scratch_zhashes(hist)
+
+    for i in [3, 600, 1150]:
+        expected = [k for k, zh in enumerate(zhs) if zh == zhs[i]]
+        assert hist.find_position(zhs[i]) == expected
+        k = expected.index(i)
+        assert hist.last_position(i) == (expected[k - 1] if k > 0 else None)
@@ -8,21 +8,614 @@ __author__ = 'Yoichi Tanibayashi'
 __date__   = '2020/05'
 
 import copy
-from MyLogger import get_logger
+from array import array
+from MyLogger import get_logger, sample_key
 CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
 
+N_CHECKER = 15
+
+
+class ytBackgammonState:
+    """
+    compact game state
+
+    All numbers are packed into two fixed-size arrays,
+    so that copy, compare and hash are cheap byte operations.
+
+    Note: hashable but mutable. Don't mutate it while used as a dict key.
+    """
+    N_CHECKER = N_CHECKER
+
+    # index of _a (array('i'))
+    I_SN = 0
+    I_GAME_NUM = 1
+    I_MATCH_SCORE = 2
+    I_SCORE = 3             # [2]
+    I_TURN = 5
+    I_RESIGN = 6
+    I_CUBE_SIDE = 7
+    I_CUBE_VALUE = 8
+    I_CUBE_ACCEPTED = 9
+    I_DICE = 10             # [2][4]
+    I_ROLL = 18
+    I_CHECKER = 19          # [2][N_CHECKER][2]
+    A_LEN = I_CHECKER + 2 * N_CHECKER * 2
+
+    # index of _clock (array('d'))
+    I_CLOCK_LIMIT = 0       # [2]
+    I_CLOCK = 2             # [2][2]
+    CLOCK_LEN = 6
+
+    # gameinfo path of each index
+    A_PATH = [['sn'], ['game_num'], ['match_score'],
+              ['score', 0], ['score', 1],
+              ['turn'], ['resign'],
+              ['board', 'cube', 'side'], ['board', 'cube', 'value'],
+              ['board', 'cube', 'accepted']] + [
+                  ['board', 'dice', p, i]
+                  for p in range(2) for i in range(4)] + [
+                      ['board', 'roll']] + [
+                          ['board', 'checker', p, ch_i, i]
+                          for p in range(2)
+                          for ch_i in range(N_CHECKER)
+                          for i in range(2)]
+    CLOCK_PATH = [['clock_limit', 0], ['clock_limit', 1]] + [
+        ['board', 'clock', p, i] for p in range(2) for i in range(2)]
+
+    __slots__ = ('_a', '_clock', 'server_version', 'playername')
+
+    def __init__(self, server_version=''):
+        self._a = array('i', bytes(4 * self.A_LEN))
+        self._clock = array('d', bytes(8 * self.CLOCK_LEN))
+        self.server_version = server_version
+        self.playername = ['', '']
+
+    @property
+    def sn(self):
+        return self._a[self.I_SN]
+
+    @sn.setter
+    def sn(self, sn):
+        self._a[self.I_SN] = sn
+
+    def copy(self):
+        st = ytBackgammonState.__new__(ytBackgammonState)
+        st._a = array('i', self._a)
+        st._clock = array('d', self._clock)
+        st.server_version = self.server_version
+        st.playername = list(self.playername)
+        return st
+
+    def __eq__(self, other):
+        if not isinstance(other, ytBackgammonState):
+            return NotImplemented
+        return (self._a == other._a and self._clock == other._clock
+                and self.server_version == other.server_version
+                and self.playername == other.playername)
+
+    def __hash__(self):
+        return hash((self._a.tobytes(), self._clock.tobytes(),
+                     self.server_version, tuple(self.playername)))
+
+    def diff(self, old):
+        """
+        diff from old state, in the same format as gameinfo_diff()
+
+        Parameters
+        ----------
+        old: ytBackgammonState
+
+        Returns
+        -------
+        diff: list
+            [[path, value], ..]
+        """
+        diff = []
+        if self.server_version != old.server_version:
+            diff.append([['server_version'], self.server_version])
+        for p in range(2):
+            if self.playername[p] != old.playername[p]:
+                diff.append([['board', 'playername', p], self.playername[p]])
+
+        if self._a != old._a:
+            for i, (v0, v1) in enumerate(zip(old._a, self._a)):
+                if v0 != v1:
+                    if i in (self.I_CUBE_ACCEPTED, self.I_ROLL):
+                        v1 = bool(v1)
+                    diff.append([self.A_PATH[i], v1])
+        if self._clock != old._clock:
+            for i, (v0, v1) in enumerate(zip(old._clock, self._clock)):
+                if v0 != v1:
+                    diff.append([self.CLOCK_PATH[i], self._num(v1)])
+        return diff
+
+    @staticmethod
+    def _num(v):
+        if v.is_integer():
+            return int(v)
+        return v
+
+    @classmethod
+    def from_gameinfo(cls, gameinfo):
+        """
+        Parameters
+        ----------
+        gameinfo: dict
+
+        Returns
+        -------
+        state: ytBackgammonState
+        """
+        st = cls(gameinfo['server_version'])
+        a = st._a
+        board = gameinfo['board']
+
+        a[cls.I_SN] = gameinfo['sn']
+        a[cls.I_GAME_NUM] = gameinfo['game_num']
+        a[cls.I_MATCH_SCORE] = gameinfo['match_score']
+        a[cls.I_SCORE:cls.I_SCORE + 2] = array('i', gameinfo['score'])
+        a[cls.I_TURN] = gameinfo['turn']
+        a[cls.I_RESIGN] = gameinfo['resign']
+        a[cls.I_CUBE_SIDE] = board['cube']['side']
+        a[cls.I_CUBE_VALUE] = board['cube']['value']
+        a[cls.I_CUBE_ACCEPTED] = bool(board['cube']['accepted'])
+        for p in range(2):
+            st.set_dice(p, board['dice'][p])
+            for ch_i, (pt, idx) in enumerate(board['checker'][p]):
+                st.put_checker(p, ch_i, pt, idx)
+        a[cls.I_ROLL] = bool(board.get('roll', False))
+
+        st.set_clock_limit(0, gameinfo['clock_limit'][0])
+        st.set_clock_limit(1, gameinfo['clock_limit'][1])
+        st.set_player_clock(0, board['clock'][0])
+        st.set_player_clock(1, board['clock'][1])
+        st.playername = list(board['playername'])
+        return st
+
+    def to_gameinfo(self):
+        """
+        Returns
+        -------
+        gameinfo: dict
+            new object, same layout as ytBackgammon.init_gameinfo()
+        """
+        a = self._a
+        c = [self._num(v) for v in self._clock]
+        ch = self.I_CHECKER
+        return {
+            'sn': a[self.I_SN],
+            'server_version': self.server_version,
+            'game_num': a[self.I_GAME_NUM],
+            'match_score': a[self.I_MATCH_SCORE],
+            'score': a[self.I_SCORE:self.I_SCORE + 2].tolist(),
+            'turn': a[self.I_TURN],
+            'resign': a[self.I_RESIGN],
+            'clock_limit': c[self.I_CLOCK_LIMIT:self.I_CLOCK_LIMIT + 2],
+            'board': {
+                'playername': list(self.playername),
+                'clock': [c[self.I_CLOCK:self.I_CLOCK + 2],
+                          c[self.I_CLOCK + 2:self.I_CLOCK + 4]],
+                'cube': {
+                    'side': a[self.I_CUBE_SIDE],
+                    'value': a[self.I_CUBE_VALUE],
+                    'accepted': bool(a[self.I_CUBE_ACCEPTED])
+                },
+                'dice': [a[self.I_DICE:self.I_DICE + 4].tolist(),
+                         a[self.I_DICE + 4:self.I_DICE + 8].tolist()],
+                'roll': bool(a[self.I_ROLL]),
+                'checker': [
+                    [[a[i], a[i + 1]]
+                     for i in range(ch + p * self.N_CHECKER * 2,
+                                    ch + (p + 1) * self.N_CHECKER * 2, 2)]
+                    for p in range(2)
+                ]
+            }
+        }
+
+    def put_checker(self, player, ch_i, p, idx):
+        i = self.I_CHECKER + (player * self.N_CHECKER + ch_i) * 2
+        self._a[i] = p
+        self._a[i + 1] = idx
+
+    def set_cube(self, side, value, accepted):
+        self._a[self.I_CUBE_SIDE] = side
+        self._a[self.I_CUBE_VALUE] = value
+        self._a[self.I_CUBE_ACCEPTED] = bool(accepted)
+
+    def set_dice(self, player, dice):
+        if len(dice) != 4:
+            raise ValueError('dice=%s: must be 4 numbers' % (dice,))
+        i = self.I_DICE + player * 4
+        self._a[i:i + 4] = array('i', dice)
+
+    def set_turn(self, turn, resign):
+        self._a[self.I_TURN] = turn
+        self._a[self.I_RESIGN] = resign
+
+    def set_score(self, player, score):
+        self._a[self.I_SCORE + player] = score
+
+    def set_game_num(self, game_num):
+        self._a[self.I_GAME_NUM] = game_num
+
+    def set_resign(self, player):
+        self._a[self.I_RESIGN] = player
+
+    def set_clock_limit(self, index, clock_limit):
+        self._clock[self.I_CLOCK_LIMIT + index] = clock_limit
+
+    def set_player_clock(self, player, clock):
+        if len(clock) != 2:
+            raise ValueError('clock=%s: must be 2 numbers' % (clock,))
+        i = self.I_CLOCK + player * 2
+        self._clock[i:i + 2] = array('d', clock)
+
+
+class ytBackgammonRule:
+    """
+    legal move generator
+
+    point: checker position in gameinfo
+        0: goal of player 0, 1..24: board, 25: goal of player 1,
+        26: bar of player 0, 27: bar of player 1
+    pip: position seen from the player to move
+        0: off, 1..24: board, 25: bar
+
+    board := [int] * N_PIP
+        pip 1..24: > 0: own checkers, < 0: opponent's checkers
+        pip 0: own checkers off, pip 25: own checkers on the bar
+
+    play := [(from_point, to_point), ..]
+    """
+    N_POINT = 28
+    N_PIP = 26
+    PIP_OFF = 0
+    PIP_BAR = 25
+    HOME_PIP = 6
+
+    GOAL_POINT = (0, 25)
+    BAR_POINT = (26, 27)
+
+    # POINT2PIP[player][point]: -1: not for the player
+    POINT2PIP = (
+        tuple(list(range(25)) + [-1, PIP_BAR, -1]),
+        tuple([-1] + [25 - p for p in range(1, 26)] + [-1, PIP_BAR])
+    )
+    # PIP2POINT[player][pip]
+    PIP2POINT = (
+        tuple(list(range(25)) + [BAR_POINT[0]]),
+        tuple([25 - pip for pip in range(25)] + [BAR_POINT[1]])
+    )
+    # DST[pip][dice]: -1: beyond the goal
+    DST = tuple(tuple(pip - d if pip - d >= 0 else -1 for d in range(7))
+                for pip in range(N_PIP))
+
+    _log = get_logger(__name__, False)
+
+    def __init__(self, debug=False):
+        self._dbg = debug
+        __class__._log = get_logger(__class__.__name__, self._dbg)
+        self._log.debug('')
+
+    @classmethod
+    def board(cls, st, player):
+        """
+        Parameters
+        ----------
+        st: dict or ytBackgammonState
+            gameinfo
+        player: int
+            player to move
+
+        Returns
+        -------
+        board: list of int
+        """
+        if isinstance(st, ytBackgammonState):
+            i = ytBackgammonState.I_CHECKER
+            n = ytBackgammonState.N_CHECKER * 2
+            points = [st._a[i:i + n:2], st._a[i + n:i + 2 * n:2]]
+        else:
+            points = [[c[0] for c in st['board']['checker'][p]]
+                      for p in range(2)]
+
+        b = [0] * cls.N_PIP
+        p2p = cls.POINT2PIP[player]
+        for pt in points[player]:
+            b[p2p[pt]] += 1
+        for pt in points[1 - player]:
+            if 1 <= pt <= 24:
+                b[p2p[pt]] -= 1
+        return b
+
+    @staticmethod
+    def dice(st, player):
+        """
+        Returns
+        -------
+        dice: list of int
+            active (not used) dice, 1..6
+        """
+        if isinstance(st, ytBackgammonState):
+            i = ytBackgammonState.I_DICE + player * 4
+            dice = st._a[i:i + 4]
+        else:
+            dice = st['board']['dice'][player]
+        return [d for d in dice if 1 <= d <= 6]
+
+    @staticmethod
+    def dice_orders(dice):
+        """
+        Returns
+        -------
+        orders: list of tuple
+            ex. [3, 5] -> [(3, 5), (5, 3)], [4, 4, 4, 4] -> [(4, 4, 4, 4)]
+        """
+        if len(set(dice)) <= 1:
+            return [tuple(dice)]
+        return [tuple(dice), tuple(dice[::-1])]
+
+    def _step(self, b, src, d):
+        """
+        Returns
+        -------
+        dst: int
+            destination pip, None: can't move
+        """
+        dst = self.DST[src][d]
+        if dst > 0:
+            if b[dst] < -1:
+                return None
+            return dst
+
+        # bear off: all checkers in the home board
+        for pip in range(self.HOME_PIP + 1, self.N_PIP):
+            if b[pip] > 0:
+                return None
+        if dst < 0:
+            # over the goal: only from the highest point
+            for pip in range(src + 1, self.HOME_PIP + 1):
+                if b[pip] > 0:
+                    return None
+        return self.PIP_OFF
+
+    def _move(self, b, src, dst):
+        """
+        Returns
+        -------
+        hit: bool
+        """
+        b[src] -= 1
+        if dst != self.PIP_OFF and b[dst] == -1:
+            b[dst] = 1
+            return True
+        b[dst] += 1
+        return False
+
+    def _unmove(self, b, src, dst, hit):
+        b[src] += 1
+        if hit:
+            b[dst] = -1
+        else:
+            b[dst] -= 1
+
+    def _srcs(self, b, max_src):
+        if b[self.PIP_BAR] > 0:
+            return (self.PIP_BAR,) if max_src >= self.PIP_BAR else ()
+        return [pip for pip in range(min(max_src, self.PIP_BAR - 1), 0, -1)
+                if b[pip] > 0]
+
+    def _gen(self, b, order, i, moves, plays, max_src):
+        """
+        depth first search, collecting leaves into plays
+        {board: [(src, dst, d), ..]}
+        """
+        found = False
+        if i < len(order):
+            d = order[i]
+            for src in self._srcs(b, max_src):
+                dst = self._step(b, src, d)
+                if dst is None:
+                    continue
+                found = True
+                hit = self._move(b, src, dst)
+                moves.append((src, dst, d))
+                # doubles: the order of the moves doesn't matter
+                self._gen(b, order, i + 1, moves, plays,
+                          src if order[0] == order[-1] else self.PIP_BAR)
+                moves.pop()
+                self._unmove(b, src, dst, hit)
+
+        if not found:
+            key = tuple(b)
+            if key not in plays or len(plays[key]) < len(moves):
+                plays[key] = list(moves)
+
+    def _plays(self, b, dice):
+        """
+        Returns
+        -------
+        plays: list of [(src, dst, d), ..]
+            legal plays in pip
+        """
+        plays = {}
+        for order in self.dice_orders(dice):
+            self._gen(b, order, 0, [], plays, self.PIP_BAR)
+
+        n = max([len(m) for m in plays.values()])
+        ret = [m for m in plays.values() if len(m) == n]
+        if n == 1 and len(set(dice)) == 2:
+            # only one die can be played: the larger one if possible
+            d_max = max([m[0][2] for m in ret])
+            ret = [m for m in ret if m[0][2] == d_max]
+        return ret
+
+    def legal_plays(self, st, player, dice=None):
+        """
+        all legal plays
+
+        Parameters
+        ----------
+        st: dict or ytBackgammonState
+            gameinfo
+        player: int
+        dice: list of int
+            None: active dice in st
+
+        Returns
+        -------
+        plays: list of play
+            [] : no dice, [[]]: no legal move
+        """
+        if dice is None:
+            dice = self.dice(st, player)
+        if len(dice) == 0:
+            return []
+
+        pip2p = self.PIP2POINT[player]
+        return [[(pip2p[src], pip2p[dst]) for (src, dst, d) in m]
+                for m in self._plays(self.board(st, player), dice)]
+
+    def dst_points(self, st, player, point, dice=None):
+        """
+        points where the checker on `point` can be put
+        as the first move(s) of a legal play
+
+        Parameters
+        ----------
+        st: dict or ytBackgammonState
+            gameinfo
+        player: int
+        point: int
+        dice: list of int
+            None: active dice in st
+
+        Returns
+        -------
+        points: set of int
+        """
+        if dice is None:
+            dice = self.dice(st, player)
+        src0 = self.POINT2PIP[player][point]
+        if len(dice) == 0 or src0 <= 0:
+            return set()
+
+        b = self.board(st, player)
+        plays = self._plays(b, dice)
+        n = len(plays[0])
+        if n == 1:
+            return set([self.PIP2POINT[player][m[0][1]] for m in plays
+                        if m[0][0] == src0])
+
+        # the same checker moved k steps, then the other dice must
+        # still be playable for n - k steps
+        pips = set()
+        for order in self.dice_orders(dice):
+            moved = []
+            src = src0
+            for k in range(n):
+                if src == self.PIP_OFF or src not in self._srcs(b, src):
+                    break
+                dst = self._step(b, src, order[k])
+                if dst is None:
+                    break
+                moved.append((src, dst, self._move(b, src, dst)))
+                if (k + 1 == n or
+                        self._can_play(b, order[k + 1:], n - k - 1)):
+                    pips.add(dst)
+                src = dst
+            for (s, d, hit) in moved[::-1]:
+                self._unmove(b, s, d, hit)
+
+        return set([self.PIP2POINT[player][pip] for pip in pips])
+
+    def _can_play(self, b, order, n):
+        """
+        Returns
+        -------
+        result: bool
+            n moves can be played with the dice in order (any order)
+        """
+        for o in self.dice_orders(list(order)):
+            if self._depth(b, o, 0, n):
+                return True
+        return False
+
+    def _depth(self, b, order, i, n):
+        if i >= n:
+            return True
+        for src in self._srcs(b, self.PIP_BAR):
+            dst = self._step(b, src, order[i])
+            if dst is None:
+                continue
+            hit = self._move(b, src, dst)
+            ok = self._depth(b, order, i + 1, n)
+            self._unmove(b, src, dst, hit)
+            if ok:
+                return True
+        return False
+
+    def check_put_checker(self, st, ch_id, p):
+        """
+        check a put_checker message against the rules
+
+        Parameters
+        ----------
+        st: dict or ytBackgammonState
+            gameinfo before the move
+        ch_id: int
+            checker ID number (ex. 012, 101 ..)
+        p: int
+            point index
+
+        Returns
+        -------
+        result: bool
+        """
+        player = int(ch_id / 100)
+        ch_i = ch_id % 100
+        if isinstance(st, ytBackgammonState):
+            turn = st._a[ytBackgammonState.I_TURN]
+            i = ytBackgammonState.I_CHECKER + (
+                player * ytBackgammonState.N_CHECKER + ch_i) * 2
+            src = st._a[i]
+        else:
+            turn = st['turn']
+            src = st['board']['checker'][player][ch_i][0]
+
+        if turn not in (0, 1):
+            # free move
+            return True
+
+        if player != turn:
+            # hit: only a blot can go to the bar
+            if p != self.BAR_POINT[player] or not 1 <= src <= 24:
+                return False
+            return self.board(st, turn)[self.POINT2PIP[turn][src]] == -1
+
+        return p in self.dst_points(st, player, src)
+
 
 class ytBackgammon:
     _log = get_logger(__name__, False)
 
-    def __init__(self, svr_ver='', debug=False):
+    def __init__(self, svr_ver='', compact=False, debug=False):
+        """
+        Parameters
+        ----------
+        svr_ver: str
+        compact: bool
+            keep the state as ytBackgammonState instead of a dict
+        """
         self._dbg = debug
         __class__._log = get_logger(__class__.__name__, self._dbg)
-        self._log.debug('svr_ver=%a', svr_ver)
+        self._log.debug('svr_ver=%a, compact=%s', svr_ver, compact)
 
         self.svr_ver = svr_ver
+        self._compact = compact
 
         self._gameinfo = None
+        self._state = None
         self.init_gameinfo()
 
         self.player = None
@@ -68,10 +661,46 @@ class ytBackgammon:
                 ],
             }
         }
-        self._log.debug('_gameinfo=%s', self._gameinfo)
-        
+        # not the dict itself: it is changed before the record is written
+        self._log.debug('server_version=%s', self.svr_ver)
+
+        if self._compact:
+            self._state = ytBackgammonState.from_gameinfo(self._gameinfo)
+            self._gameinfo = None
+
+    @property
+    def state(self):
+        """
+        live state object: ytBackgammonState (compact) or gameinfo dict
+        """
+        if self._compact:
+            return self._state
+        return self._gameinfo
+
+    @property
+    def gameinfo(self):
+        """
+        gameinfo dict (a new object in compact mode)
+        """
+        if self._compact:
+            return self._state.to_gameinfo()
+        return self._gameinfo
+
+    @gameinfo.setter
+    def gameinfo(self, gameinfo):
+        if self._compact:
+            self._state = ytBackgammonState.from_gameinfo(gameinfo)
+        else:
+            self._gameinfo = gameinfo
+
     def set_gameinfo(self, gameinfo):
         self._log.debug('gameinfo=%s', gameinfo)
+        if self._compact:
+            try:
+                self._state = ytBackgammonState.from_gameinfo(gameinfo)
+            except (KeyError, IndexError, TypeError, ValueError) as e:
+                self._log.warning('%s:%s: ignored', type(e).__name__, e)
+            return
         self._gameinfo = copy.deepcopy(gameinfo)
 
     def put_checker(self, ch_id, p, idx):
@@ -85,17 +714,27 @@ class ytBackgammon:
         idx: int
             position index
         """
-        self._log.debug('ch_id=%d, p=%s, idx=%s', ch_id, p, idx)
+        self._log.debug('ch_id=%d, p=%s, idx=%s', ch_id, p, idx,
+                        extra=sample_key('put_checker'))
         player = int(ch_id / 100)
         ch_i = ch_id % 100
+        if self._compact:
+            self._state.put_checker(player, ch_i, p, idx)
+            return
         self._gameinfo['board']['checker'][player][ch_i] = [p, idx]
         self._log.debug('_gameinfo[board][point][%d][%d]=[%d,%d]',
-                        player, ch_i, p, idx);
+                        player, ch_i, p, idx,
+                        extra=sample_key('put_checker'))
 
     def cube(self, data):
         self._log.debug('data=%s', data)
 
-        self._gameinfo['board']['cube'] = data
+        if self._compact:
+            self._state.set_cube(data['side'], data['value'],
+                                 data['accepted'])
+            return
+        # copies: data is the logged message
+        self._gameinfo['board']['cube'] = dict(data)
 
         self._log.debug('_gameinfo[board][cube]=%a',
                         self._gameinfo['board']['cube'])
@@ -108,13 +747,19 @@ class ytBackgammon:
         }
         """
         self._log.debug('data=%s', data)
-        self._gameinfo['board']['dice'][data['player']] = data['dice']
+        if self._compact:
+            self._state.set_dice(data['player'], data['dice'])
+            return
+        self._gameinfo['board']['dice'][data['player']] = list(data['dice'])
 
     def set_turn(self, data):
         """
         data = {'turn': int, resign: int}
         """
         self._log.debug('data=%s', data)
+        if self._compact:
+            self._state.set_turn(data['turn'], data['resign'])
+            return
         self._gameinfo['turn'] = data['turn']
         self._gameinfo['resign'] = data['resign']
 
@@ -123,6 +768,9 @@ class ytBackgammon:
         data = {'player': int, 'name': str}
         """
         self._log.debug('data=%s', data)
+        if self._compact:
+            self._state.playername[data['player']] = data['name']
+            return
         self._gameinfo['board']['playername'][data['player']] = data['name']
 
     def set_score(self, data):
@@ -130,8 +778,21 @@ class ytBackgammon:
         data = {'player': int, 'score': int}
         """
         self._log.debug('data=%s', data)
+        if self._compact:
+            self._state.set_score(data['player'], data['score'])
+            return
         self._gameinfo['score'][data['player']] = data['score']
 
+    def set_game_num(self, game_num):
+        """
+        game_num: int
+        """
+        self._log.debug('game_num=%s', game_num)
+        if self._compact:
+            self._state.set_game_num(game_num)
+            return
+        self._gameinfo['game_num'] = game_num
+
     def resign(self, data):
         """
         resign game
@@ -141,6 +802,9 @@ class ytBackgammon:
         data: {'player': int}
         """
         self._log.debug('data=%s', data)
+        if self._compact:
+            self._state.set_resign(data['player'])
+            return
         self._gameinfo['resign'] = data['player']
         self._log.debug('gameinfo.resign=%s', self._gameinfo['resign'])
 
@@ -149,6 +813,9 @@ class ytBackgammon:
         data = {'index': int, 'clock_limit': int}
         """
         self._log.debug('data=%s', data)
+        if self._compact:
+            self._state.set_clock_limit(data['index'], data['clock_limit'])
+            return
         self._gameinfo['clock_limit'][data['index']] = data['clock_limit']
 
     def set_player_clock(self, data):
@@ -156,5 +823,8 @@ class ytBackgammon:
         data = {'player': int, 'clock': [int(sec), int(sec)]}
         """
         self._log.debug('data=%s', data)
-        self._gameinfo['board']['clock'][data['player']] = data['clock']
+        if self._compact:
+            self._state.set_player_clock(data['player'], data['clock'])
+            return
+        self._gameinfo['board']['clock'][data['player']] = list(data['clock'])
 ###
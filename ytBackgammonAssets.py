@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+#
+# (c) Yoichi Tanibayashi
+#
+"""
+ytBackgammonAssets.py
+
+Content-hashed, precompressed static files.
+
+URL (see url()):
+  file under static/:   /assets/ytbg.<hash>.js
+  directory of static/: /assets/images2.<hash>/bg.png
+                        (one hash for all the files of the directory,
+                         so that the client can make file names in it)
+
+Variants are made once per content hash in out_dir:
+  <hash>.gz, <hash>.br   text files (brotli: if installed)
+  <hash>.webp            images (if Pillow is installed, lossless)
+and served by Accept-Encoding / Accept, with ETag and
+'Cache-Control: immutable'.
+
+Build ahead of time (optional, the server builds the missing ones):
+
+  ytBackgammonAssets.py static ~/.ytbg-assets
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__   = '2020/05'
+
+from flask import Response
+import gzip
+import hashlib
+import os
+from MyLogger import get_logger
+import click
+CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+class ytBackgammonAssets:
+    URL_PREFIX = '/assets/'
+    STATIC_PREFIX = '/static/'
+
+    # served files: ext -> mimetype
+    MIMETYPE = {
+        '.js': 'application/javascript',
+        '.css': 'text/css',
+        '.svg': 'image/svg+xml',
+        '.png': 'image/png',
+        '.jpg': 'image/jpeg',
+        '.gif': 'image/gif',
+        '.ico': 'image/x-icon',
+        '.mp3': 'audio/mpeg',
+    }
+    COMPRESS_EXT = ['.js', '.css', '.svg']
+    WEBP_EXT = ['.png', '.jpg']
+
+    HASH_LEN = 12
+    CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+    _log = get_logger(__name__, False)
+
+    def __init__(self, static_dir, out_dir=None, debug=False):
+        """
+        Parameters
+        ----------
+        static_dir: str
+        out_dir: str
+            directory of the variants (None: no variants)
+        """
+        self._dbg = debug
+        __class__._log = get_logger(__class__.__name__, self._dbg)
+        self._log.debug('static_dir=%s, out_dir=%s', static_dir, out_dir)
+
+        self._static_dir = static_dir
+        self._out_dir = out_dir
+        if self._out_dir is not None:
+            try:
+                os.makedirs(self._out_dir, exist_ok=True)
+            except OSError as e:
+                self._log.warning('%s:%s.', type(e).__name__, e)
+                self._out_dir = None
+
+        # static path -> URL
+        self._url = {}
+        # URL name (after URL_PREFIX) -> asset
+        #   asset := {'path': str, 'hash': str, 'type': mimetype,
+        #             'gzip': str, 'br': str, 'webp': str (if any)}
+        self._assets = {}
+
+        self.build()
+
+    @classmethod
+    def file_hash(cls, path_name):
+        h = hashlib.sha1()
+        with open(path_name, 'rb') as f:
+            for b in iter(lambda: f.read(1 << 16), b''):
+                h.update(b)
+        return h.hexdigest()[:cls.HASH_LEN]
+
+    def build(self):
+        """
+        hash the files of static_dir (and one level of directories)
+        and make the missing variants
+        """
+        for name in sorted(os.listdir(self._static_dir)):
+            path_name = os.path.join(self._static_dir, name)
+
+            if os.path.isdir(path_name):
+                files = []
+                for f in sorted(os.listdir(path_name)):
+                    p = os.path.join(path_name, f)
+                    if os.path.isfile(p) and self.is_served(f):
+                        files.append((f, self.file_hash(p)))
+                if len(files) == 0:
+                    continue
+
+                d_hash = hashlib.sha1(''.join(
+                    ['%s %s\n' % (f, h) for (f, h) in files]).encode(
+                        'utf-8')).hexdigest()[:self.HASH_LEN]
+                prefix = '%s.%s/' % (name, d_hash)
+                self._url[name + '/'] = self.URL_PREFIX + prefix
+                for (f, h) in files:
+                    self._assets[prefix + f] = self.make_asset(
+                        os.path.join(path_name, f), h)
+                continue
+
+            if not self.is_served(name):
+                continue
+            h = self.file_hash(path_name)
+            [base, ext] = os.path.splitext(name)
+            hashed = '%s.%s%s' % (base, h, ext)
+            self._url[name] = self.URL_PREFIX + hashed
+            self._assets[hashed] = self.make_asset(path_name, h)
+
+        self._log.info('%d files in %d groups',
+                       len(self._assets), len(self._url))
+
+    def is_served(self, name):
+        return os.path.splitext(name)[1].lower() in self.MIMETYPE
+
+    def make_asset(self, path_name, h):
+        """
+        Parameters
+        ----------
+        path_name: str
+            original file
+        h: str
+            content hash
+
+        Returns
+        -------
+        asset: dict
+        """
+        ext = os.path.splitext(path_name)[1].lower()
+        asset = {'path': path_name, 'hash': h, 'type': self.MIMETYPE[ext]}
+        if self._out_dir is None:
+            return asset
+
+        variants = []
+        if ext in self.COMPRESS_EXT:
+            variants.append(('gzip', '.gz', self.make_gzip))
+            if brotli is not None:
+                variants.append(('br', '.br', self.make_brotli))
+        if ext in self.WEBP_EXT and Image is not None:
+            variants.append(('webp', '.webp', self.make_webp))
+
+        size = os.path.getsize(path_name)
+        for (key, suffix, make) in variants:
+            out = os.path.join(self._out_dir, h + suffix)
+            try:
+                if not os.path.exists(out):
+                    make(path_name, out)
+            except Exception as e:
+                self._log.warning('%s: %s:%s.',
+                                  path_name, type(e).__name__, e)
+                continue
+
+            # not worth it
+            if os.path.getsize(out) < size:
+                asset[key] = out
+        return asset
+
+    def make_gzip(self, src, dst):
+        with open(src, 'rb') as f:
+            # mtime=0: same output for the same content
+            self.write_file(dst, gzip.compress(f.read(), 9, mtime=0))
+
+    def make_brotli(self, src, dst):
+        with open(src, 'rb') as f:
+            self.write_file(dst, brotli.compress(f.read()))
+
+    def make_webp(self, src, dst):
+        tmp = dst + '.tmp'
+        with Image.open(src) as img:
+            img.save(tmp, 'WEBP', lossless=True, method=6)
+        os.replace(tmp, dst)
+
+    def write_file(self, path_name, b):
+        tmp = path_name + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(b)
+        os.replace(tmp, path_name)
+
+    def url(self, path):
+        """
+        Parameters
+        ----------
+        path: str
+            relative to static_dir: 'ytbg.js', 'images2/bg.png',
+            'images2/' (directory)
+
+        Returns
+        -------
+        url: str
+            '/static/..' for the files not managed here
+        """
+        if path in self._url:
+            return self._url[path]
+        [d, _, f] = path.partition('/')
+        if f and d + '/' in self._url:
+            return self._url[d + '/'] + f
+        return self.STATIC_PREFIX + path
+
+    def response(self, name, request):
+        """
+        Parameters
+        ----------
+        name: str
+            URL path after URL_PREFIX
+        request: flask.Request
+
+        Returns
+        -------
+        resp: flask.Response
+            None: not found
+        """
+        asset = self._assets.get(name)
+        if asset is None:
+            return None
+
+        path_name = asset['path']
+        mimetype = asset['type']
+        encoding = None
+        etag = asset['hash']
+        vary = None
+
+        if mimetype.startswith('image/') and 'webp' in asset:
+            vary = 'Accept'
+            # not accept_mimetypes: 'image/*' doesn't mean WebP
+            if 'image/webp' in request.headers.get('Accept', ''):
+                path_name = asset['webp']
+                mimetype = 'image/webp'
+                etag += '-webp'
+        elif 'gzip' in asset:
+            vary = 'Accept-Encoding'
+            for enc in ['br', 'gzip']:
+                if enc in asset and enc in request.accept_encodings:
+                    path_name = asset[enc]
+                    encoding = enc
+                    etag += '-' + enc
+                    break
+
+        with open(path_name, 'rb') as f:
+            resp = Response(f.read(), mimetype=mimetype)
+        if encoding is not None:
+            resp.headers['Content-Encoding'] = encoding
+        if vary is not None:
+            resp.headers['Vary'] = vary
+        resp.headers['Cache-Control'] = self.CACHE_CONTROL
+        resp.set_etag(etag)
+        return resp.make_conditional(request)
+
+
+@click.command(context_settings=CONTEXT_SETTINGS)
+@click.argument('static_dir', type=click.Path(exists=True, file_okay=False))
+@click.argument('out_dir', type=click.Path(file_okay=False))
+@click.option('--debug', '-d', 'debug', is_flag=True, default=False,
+              help='debug flag')
+def main(static_dir, out_dir, debug):
+    """
+    make the variants of the static files (and print the URLs)
+    """
+    _log = get_logger(__name__, debug)
+    _log.debug('static_dir=%s, out_dir=%s', static_dir, out_dir)
+    _log.info('brotli=%s, webp=%s', brotli is not None, Image is not None)
+
+    assets = ytBackgammonAssets(static_dir, out_dir, debug=debug)
+    for path in sorted(assets._url):
+        print('%s %s' % (path, assets.url(path)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+#
+# (c) Yoichi Tanibayashi
+#
+"""
+ytBackgammonBench.py
+
+Micro-benchmarks of the game model and the persistence layer.
+No browser or network is needed.
+
+  model:   ytBackgammon.put_checker(), dice(), set_gameinfo()
+  history: ytBackgammonServer.add_history(), hist_rec2str(),
+           save_data(), load_data()  (for each history size)
+
+Results are written as JSON, so that runs can be compared.
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__   = '2020/05'
+
+from ytBackgammon import ytBackgammon, ytBackgammonState, N_CHECKER
+from ytBackgammonServer import ytBackgammonServer
+import json
+import os
+import platform
+import random
+import tempfile
+import time
+from MyLogger import get_logger
+import click
+CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
+
+SIZES = [100, 1000, 10000, 100000, 1000000]
+
+
+def random_args(rnd, n):
+    """
+    random mutations: list of (method name, args)
+    """
+    args = []
+    for i in range(n):
+        player = rnd.randrange(2)
+        if rnd.random() < 0.8:
+            ch_id = player * 100 + rnd.randrange(N_CHECKER)
+            args.append(('put_checker', (ch_id, rnd.randrange(1, 25),
+                                         rnd.randrange(5))))
+        else:
+            args.append(('dice', ({'player': player,
+                                   'dice': [rnd.randint(1, 6),
+                                            rnd.randint(1, 6), 0, 0]},)))
+    return args
+
+
+def result(name, n, sec, size=None, **kwargs):
+    """
+    Returns
+    -------
+    result: dict
+    """
+    ret = {
+        'name': name,
+        'size': size,
+        'n': n,
+        'sec': round(sec, 6),
+        'usec_per_op': round(sec / n * 1e6, 3),
+        'ops_per_sec': round(n / sec, 1) if sec > 0 else None
+    }
+    ret.update(kwargs)
+    return ret
+
+
+class ytBackgammonBench:
+    _log = get_logger(__name__, False)
+
+    def __init__(self, work_dir, storage=ytBackgammonServer.STORAGE_JSON,
+                 compact=False, repeat=3, seed=0, debug=False):
+        """
+        Parameters
+        ----------
+        work_dir: str
+            directory for data files
+        storage: str
+            ytBackgammonServer.STORAGE_LIST
+        compact: bool
+        repeat: int
+            best of `repeat` runs
+        """
+        self._dbg = debug
+        __class__._log = get_logger(__class__.__name__, self._dbg)
+        self._log.debug('work_dir=%s, storage=%s, compact=%s, repeat=%s',
+                        work_dir, storage, compact, repeat)
+
+        self._work_dir = work_dir
+        self._storage = storage
+        self._compact = compact
+        self._repeat = repeat
+        self._rnd = random.Random(seed)
+
+    def best(self, func):
+        """
+        Returns
+        -------
+        sec: float
+            shortest time of `repeat` runs
+        """
+        sec = None
+        for r in range(self._repeat):
+            t0 = time.perf_counter()
+            func()
+            t = time.perf_counter() - t0
+            if sec is None or t < sec:
+                sec = t
+        return sec
+
+    def bench_model(self, n):
+        """
+        Parameters
+        ----------
+        n: int
+            number of operations
+
+        Returns
+        -------
+        results: list of dict
+        """
+        self._log.debug('n=%s', n)
+        bg = ytBackgammon(compact=self._compact)
+
+        ch_args = [a for (m, a) in random_args(self._rnd, n)
+                   if m == 'put_checker']
+        dice_args = [{'player': self._rnd.randrange(2),
+                      'dice': [self._rnd.randint(1, 6),
+                               self._rnd.randint(1, 6), 0, 0]}
+                     for i in range(n)]
+        gameinfo = bg.gameinfo
+        n_gi = max(n // 10, 1)
+
+        def put_checker():
+            for a in ch_args:
+                bg.put_checker(*a)
+
+        def dice():
+            for d in dice_args:
+                bg.dice(d)
+
+        def set_gameinfo():
+            for i in range(n_gi):
+                bg.set_gameinfo(gameinfo)
+
+        return [
+            result('put_checker', len(ch_args), self.best(put_checker)),
+            result('dice', n, self.best(dice)),
+            result('set_gameinfo', n_gi, self.best(set_gameinfo))
+        ]
+
+    def new_server(self, size):
+        """
+        server with `size` history entries, without persisting them
+
+        Returns
+        -------
+        svr: ytBackgammonServer
+        """
+        svr_id = 'bench%d' % (size)
+        for ext in ['json', ytBackgammonServer.JOURNAL_EXT]:
+            path = '%s/%s-%s.%s' % (self._work_dir,
+                                    ytBackgammonServer.DATAFILE_NAME,
+                                    svr_id, ext)
+            if os.path.exists(path):
+                os.remove(path)
+
+        svr = ytBackgammonServer('bench', 'bench', svr_id, 'images1',
+                                 storage=self._storage,
+                                 compact=self._compact)
+        bg = svr._bg
+        for sn, (m, a) in enumerate(random_args(self._rnd, size - 1), 2):
+            getattr(bg, m)(*a)
+            state = bg.state
+            if isinstance(state, ytBackgammonState):
+                state.sn = sn
+            else:
+                state['sn'] = sn
+            svr._hist.add(state)
+        return svr
+
+    def bench_history(self, size, n_add):
+        """
+        Parameters
+        ----------
+        size: int
+            number of history entries
+        n_add: int
+            number of add_history() calls
+
+        Returns
+        -------
+        results: list of dict
+        """
+        self._log.debug('size=%s, n_add=%s', size, n_add)
+        results = []
+
+        t0 = time.perf_counter()
+        svr = self.new_server(size)
+        results.append(result('build_history', size,
+                              time.perf_counter() - t0, size))
+
+        path = svr._datafile_path
+        ents = svr._hist.entries()
+
+        def rec2str():
+            for ent in ents:
+                svr.hist_rec2str(ent)
+
+        results.append(result('hist_rec2str', len(ents), self.best(rec2str),
+                              size))
+
+        sec = self.best(lambda: svr.save_data(path))
+        results.append(result('save_data', 1, sec, size,
+                              bytes=os.path.getsize(path)))
+
+        sec = self.best(lambda: svr.load_data(path))
+        results.append(result('load_data', 1, sec, size))
+
+        # add_history() persists the whole history (json storage)
+        # or appends one record (journal storage) on each call
+        mutations = random_args(self._rnd, n_add)
+        t0 = time.perf_counter()
+        for (m, a) in mutations:
+            getattr(svr._bg, m)(*a)
+            svr.add_history(svr._bg.state)
+        results.append(result('add_history', n_add,
+                              time.perf_counter() - t0, size,
+                              storage=self._storage))
+        return results
+
+    def run(self, sizes, n_ops, add_budget):
+        """
+        Parameters
+        ----------
+        sizes: list of int
+            history sizes
+        n_ops: int
+            operations for the model benchmarks
+        add_budget: int
+            add_history() calls x history size, per history size
+
+        Returns
+        -------
+        report: dict
+        """
+        results = self.bench_model(n_ops)
+        for r in results:
+            self._log.info('%-14s %12.3f usec/op', r['name'],
+                           r['usec_per_op'])
+
+        for size in sizes:
+            n_add = min(max(add_budget // size, 1), 1000)
+            for r in self.bench_history(size, n_add):
+                self._log.info('%-14s size=%-8d %12.3f usec/op', r['name'],
+                               size, r['usec_per_op'])
+                results.append(r)
+
+        return {
+            'meta': {
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'python': platform.python_version(),
+                'implementation': platform.python_implementation(),
+                'machine': platform.machine(),
+                'storage': self._storage,
+                'compact': self._compact,
+                'repeat': self._repeat,
+                'sizes': sizes,
+                'n_ops': n_ops
+            },
+            'results': results
+        }
+
+
+@click.command(context_settings=CONTEXT_SETTINGS)
+@click.option('--sizes', '-n', 'sizes', type=str,
+              default=','.join([str(s) for s in SIZES]),
+              help='history sizes (comma separated)')
+@click.option('--ops', 'n_ops', type=int, default=100000,
+              help='operations for the model benchmarks')
+@click.option('--add_budget', 'add_budget', type=int, default=100000,
+              help='add_history() calls x history size')
+@click.option('--repeat', '-r', 'repeat', type=int, default=3,
+              help='best of N runs')
+@click.option('--storage', '-s', 'storage', type=click.Choice(
+    ytBackgammonServer.STORAGE_LIST), default=ytBackgammonServer.STORAGE_JSON,
+              help='history storage')
+@click.option('--compact', '-c', 'compact', is_flag=True, default=False,
+              help='compact state encoding')
+@click.option('--out', '-o', 'out', type=str, default=None,
+              help='write JSON report to file')
+@click.option('--debug', '-d', 'debug', is_flag=True, default=False,
+              help='debug flag')
+def main(sizes, n_ops, add_budget, repeat, storage, compact, out, debug):
+    """
+    ex. ytBackgammonBench.py -n 100,1000,10000 -o bench-json.json
+        ytBackgammonBench.py -n 100,1000,10000 -s journal -c -o bench-j.json
+    """
+    _log = get_logger(__name__, debug)
+    sizes = [int(s) for s in sizes.split(',')]
+    _log.info('sizes=%s, storage=%s, compact=%s', sizes, storage, compact)
+
+    with tempfile.TemporaryDirectory(prefix='ytbg-bench-') as work_dir:
+        ytBackgammonServer.DATAFILE_DIR = work_dir
+        bench = ytBackgammonBench(work_dir, storage, compact, repeat,
+                                  debug=debug)
+        report = bench.run(sizes, n_ops, add_budget)
+
+    j_str = json.dumps(report, indent=2)
+    if out is not None:
+        with open(out, 'w') as f:
+            f.write(j_str + '\n')
+    else:
+        print(j_str)
+
+
+if __name__ == "__main__":
+    main()
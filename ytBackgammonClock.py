@@ -0,0 +1,330 @@
+#
+# (c) Yoichi Tanibayashi
+#
+"""
+ytBackgammonClock.py
+
+Server side game clock.
+
+ClockScheduler: one timer task for the deadlines of all boards
+ytBackgammonClock: player clocks of one board
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__   = '2020/05'
+
+import heapq
+import threading
+import time
+from MyLogger import get_logger
+
+
+class ClockScheduler:
+    """
+    single timer task shared by all boards
+
+    timer entry := [time, seq, callback, args]
+    (callback is None: cancelled)
+    """
+    _log = get_logger(__name__, False)
+
+    def __init__(self, socketio=None, debug=False):
+        """
+        Parameters
+        ----------
+        socketio: flask_socketio.SocketIO
+            None or threading mode: use a daemon threading.Thread
+        """
+        self._dbg = debug
+        __class__._log = get_logger(__class__.__name__, self._dbg)
+        self._log.debug('')
+
+        self._sio = socketio
+
+        self._heap = []
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._task = None
+
+    def start(self):
+        with self._cond:
+            if self._task is not None:
+                return
+
+            self._log.debug('start')
+            if self._sio is not None and self._sio.async_mode != 'threading':
+                self._task = self._sio.start_background_task(self.run)
+            else:
+                # daemon: don't block the process exit
+                self._task = threading.Thread(target=self.run, daemon=True)
+                self._task.start()
+
+    def schedule(self, t, callback, *args):
+        """
+        Parameters
+        ----------
+        t: float
+            time.monotonic() based
+        callback: function
+            called as callback(*args) in the timer task
+
+        Returns
+        -------
+        timer: list
+            for cancel()
+        """
+        self.start()
+
+        with self._cond:
+            self._seq += 1
+            timer = [t, self._seq, callback, args]
+            heapq.heappush(self._heap, timer)
+            if self._heap[0] is timer:
+                self._cond.notify()
+        return timer
+
+    def cancel(self, timer):
+        """
+        Parameters
+        ----------
+        timer: list
+            return value of schedule()
+        """
+        with self._cond:
+            timer[2] = None
+
+    def run(self):
+        self._log.debug('')
+
+        while True:
+            with self._cond:
+                while len(self._heap) > 0 and self._heap[0][2] is None:
+                    heapq.heappop(self._heap)
+
+                if len(self._heap) == 0:
+                    self._cond.wait()
+                    continue
+
+                delay = self._heap[0][0] - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+
+                [t, seq, callback, args] = heapq.heappop(self._heap)
+
+            try:
+                callback(*args)
+            except Exception as e:
+                self._log.error('%s:%s', type(e).__name__, e)
+
+
+class ytBackgammonClock:
+    """
+    player clocks of one board
+
+    clock := [main(sec), delay(sec)]
+
+    The delay is used up first, then the main time.
+    Clock values are kept in the board's gameinfo while stopped.
+    """
+    EV_DELAY_END = 'delay_end'
+    EV_TIMEOUT = 'timeout'
+
+    _log = get_logger(__name__, False)
+
+    def __init__(self, bg, scheduler=None, on_event=None, debug=False):
+        """
+        Parameters
+        ----------
+        bg: ytBackgammon
+        scheduler: ClockScheduler
+            None: no timer events
+        on_event: function
+            on_event(event, player, gen), called in the timer task.
+            pass gen to is_current().
+        """
+        self._dbg = debug
+        __class__._log = get_logger(__class__.__name__, self._dbg)
+        self._log.debug('')
+
+        self._bg = bg
+        self._sch = scheduler
+        self._on_event = on_event
+
+        self.clock_sw = False
+        self.active = [False, False]
+
+        self._t0 = [None, None]       # counting since (time.monotonic())
+        self._start = [None, None]    # clock value at _t0
+        self._timer = [[], []]
+        self._gen = [0, 0]
+
+    def get_state(self):
+        """
+        for the shared store (cluster mode)
+
+        Returns
+        -------
+        state: dict
+            times are time.monotonic() based (system wide on Linux)
+        """
+        return {'clock_sw': self.clock_sw, 'active': list(self.active),
+                't0': list(self._t0),
+                'start': [None if s is None else list(s)
+                          for s in self._start],
+                'gen': list(self._gen)}
+
+    def set_state(self, state):
+        """
+        restore get_state() of another process,
+        and schedule the timers of the running clocks
+        """
+        for p in range(2):
+            for timer in self._timer[p]:
+                self._sch.cancel(timer)
+            self._timer[p] = []
+
+        self.clock_sw = state['clock_sw']
+        self.active = list(state['active'])
+        self._t0 = list(state['t0'])
+        self._start = [None if s is None else list(s)
+                       for s in state['start']]
+        self._gen = list(state['gen'])
+
+        for p in range(2):
+            if self.counting(p):
+                self._schedule(p)
+
+    def counting(self, player):
+        return self._t0[player] is not None
+
+    def is_current(self, player, gen):
+        return self._gen[player] == gen
+
+    def get(self, player, now=None):
+        """
+        Returns
+        -------
+        clock: [float, float]
+        """
+        if not self.counting(player):
+            return list(self._bg.gameinfo['board']['clock'][player])
+
+        if now is None:
+            now = time.monotonic()
+
+        [c0, c1] = self._start[player]
+        c1 -= now - self._t0[player]
+        if c1 < 0:
+            c0 = max(c0 + c1, 0)
+            c1 = 0
+        return [c0, c1]
+
+    def sync(self):
+        """
+        write current values of running clocks to gameinfo
+        """
+        for p in range(2):
+            if self.counting(p):
+                self._bg.set_player_clock({'player': p, 'clock': self.get(p)})
+
+    def set(self, player, clock):
+        """
+        set clock value from client (ignored while counting)
+
+        Returns
+        -------
+        clock: [float, float]
+            authoritative value
+        """
+        if self.counting(player):
+            return self.get(player)
+
+        self._bg.set_player_clock({'player': player, 'clock': clock})
+        return list(clock)
+
+    def start(self, player):
+        """
+        reset the delay and resume
+        """
+        self._log.debug('player=%s', player)
+        self._pause(player)
+
+        clock = self.get(player)
+        clock[1] = self._bg.gameinfo['clock_limit'][1]
+        self._bg.set_player_clock({'player': player, 'clock': clock})
+        self.resume(player)
+
+    def resume(self, player):
+        self._log.debug('player=%s', player)
+        self.active[player] = True
+        if self.clock_sw:
+            self._run(player)
+
+    def stop(self, player):
+        self._log.debug('player=%s', player)
+        self._pause(player)
+        self.active[player] = False
+
+    def reset(self, player):
+        self._log.debug('player=%s', player)
+        self.stop(player)
+        limit = list(self._bg.gameinfo['clock_limit'])
+        self._bg.set_player_clock({'player': player, 'clock': limit})
+
+    def stop_all(self):
+        for p in range(2):
+            self.stop(p)
+
+    def set_switch(self, sw):
+        self._log.debug('sw=%s', sw)
+        self.clock_sw = sw
+        for p in range(2):
+            if sw and self.active[p]:
+                self._run(p)
+            else:
+                self._pause(p)
+
+    def timeout(self, player):
+        """
+        time is up
+        """
+        self._log.info('player=%s', player)
+        self.stop(player)
+        self._bg.set_player_clock({'player': player, 'clock': [0, 0]})
+
+    def _run(self, player):
+        if self.counting(player):
+            return
+
+        self._t0[player] = time.monotonic()
+        self._start[player] = list(self._bg.gameinfo['board']['clock'][player])
+        self._gen[player] += 1
+        self._schedule(player)
+
+    def _schedule(self, player):
+        if self._sch is None or self._on_event is None:
+            return
+
+        t0 = self._t0[player]
+        [c0, c1] = self._start[player]
+        if c1 > 0:
+            self._timer[player].append(self._sch.schedule(
+                t0 + c1, self._on_event,
+                self.EV_DELAY_END, player, self._gen[player]))
+        self._timer[player].append(self._sch.schedule(
+            t0 + c0 + max(c1, 0), self._on_event,
+            self.EV_TIMEOUT, player, self._gen[player]))
+
+    def _pause(self, player):
+        if not self.counting(player):
+            return
+
+        clock = self.get(player)
+        self._t0[player] = None
+        self._start[player] = None
+        self._gen[player] += 1
+        for timer in self._timer[player]:
+            self._sch.cancel(timer)
+        self._timer[player] = []
+
+        self._bg.set_player_clock({'player': player, 'clock': clock})
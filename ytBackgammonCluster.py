@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+#
+# (c) Yoichi Tanibayashi
+#
+"""
+ytBackgammonCluster.py
+
+Clustered mode: several ytbg.py worker processes serve the same boards.
+
+  broadcasts: Socket.IO message queue (python-socketio client manager)
+  board state and history: shared SQLite database (see ytBackgammonServer)
+
+ytBackgammonBroker is a small pub/sub broker (stand-in for Redis etc.),
+ytBackgammonBrokerManager is the client manager for it:
+
+  ytBackgammonCluster.py -p 5100 &
+  ytbg.py -s sqlite -C ytbg+tcp://localhost:5100 -p 5001 1 &
+  ytbg.py -s sqlite -C ytbg+tcp://localhost:5100 -p 5002 1 &
+
+protocol (TCP):
+  hello := role(b'P': publisher, b'S': subscriber) channel b'\\n'
+  frame := length(4 bytes, big endian) data
+
+Frames are forwarded to all the subscribers of the channel as they are
+(pickled by python-socketio): use it only on a trusted network.
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__   = '2020/05'
+
+import pickle
+import queue
+import socket
+import struct
+import threading
+import time
+from socketio import PubSubManager
+from MyLogger import get_logger
+import click
+CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
+
+BROKER_SCHEME = 'ytbg+tcp://'
+DEF_BROKER_PORT = 5100
+
+ROLE_PUB = b'P'
+ROLE_SUB = b'S'
+
+
+def parse_url(url):
+    """
+    Parameters
+    ----------
+    url: str
+        'ytbg+tcp://host:port'
+
+    Returns
+    -------
+    (host, port): (str, int)
+    """
+    if not url.startswith(BROKER_SCHEME):
+        raise ValueError('url=%s: must start with %s' % (url, BROKER_SCHEME))
+    [host, _, port] = url[len(BROKER_SCHEME):].rstrip('/').partition(':')
+    return host or 'localhost', int(port or DEF_BROKER_PORT)
+
+
+def recv_exact(sock, n):
+    """
+    Returns
+    -------
+    data: bytes
+        None: closed
+    """
+    buf = b''
+    while len(buf) < n:
+        b = sock.recv(n - len(buf))
+        if not b:
+            return None
+        buf += b
+    return buf
+
+
+def recv_frame(sock):
+    head = recv_exact(sock, 4)
+    if head is None:
+        return None
+    return recv_exact(sock, struct.unpack('>I', head)[0])
+
+
+def send_frame(sock, data):
+    sock.sendall(struct.pack('>I', len(data)) + data)
+
+
+def recv_hello(sock):
+    """
+    Returns
+    -------
+    (role, channel): (bytes, str)
+        None: closed
+    """
+    buf = b''
+    while not buf.endswith(b'\n'):
+        b = sock.recv(1)
+        if not b:
+            return None
+        buf += b
+    return buf[:1], buf[1:-1].decode('utf-8')
+
+
+class ytBackgammonBroker:
+    """
+    pub/sub broker: forwards the frames of the publishers
+    to all the subscribers of the channel
+    """
+    _log = get_logger(__name__, False)
+
+    def __init__(self, host='localhost', port=DEF_BROKER_PORT, debug=False):
+        self._dbg = debug
+        __class__._log = get_logger(__class__.__name__, self._dbg)
+        self._log.debug('host=%s, port=%s', host, port)
+
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind((host, port))
+        self._sock.listen()
+        self.port = self._sock.getsockname()[1]
+
+        # channel -> set of queues (one per subscriber)
+        self._subs = {}
+        self._lock = threading.Lock()
+        self._th = None
+
+    def start(self):
+        """
+        serve in a daemon thread
+        """
+        self._th = threading.Thread(target=self.serve, daemon=True,
+                                    name='ytbg-broker')
+        self._th.start()
+
+    def close(self):
+        self._sock.close()
+
+    def serve(self):
+        self._log.info('port=%s', self.port)
+        while True:
+            try:
+                [conn, addr] = self._sock.accept()
+            except OSError:
+                break
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self._handle, args=(conn, addr),
+                             daemon=True).start()
+
+    def _handle(self, conn, addr):
+        try:
+            hello = recv_hello(conn)
+            if hello is None:
+                return
+            [role, channel] = hello
+            self._log.debug('addr=%s, role=%s, channel=%s',
+                            addr, role, channel)
+            if role == ROLE_SUB:
+                self._subscriber(conn, channel)
+            else:
+                self._publisher(conn, channel)
+        except OSError as e:
+            self._log.debug('%s:%s.', type(e).__name__, e)
+        finally:
+            conn.close()
+
+    def _publisher(self, conn, channel):
+        while True:
+            data = recv_frame(conn)
+            if data is None:
+                return
+            with self._lock:
+                subs = list(self._subs.get(channel, []))
+            for q in subs:
+                q.put(data)
+
+    def _subscriber(self, conn, channel):
+        """
+        a slow subscriber doesn't block the others
+        """
+        q = queue.Queue()
+        with self._lock:
+            self._subs.setdefault(channel, set()).add(q)
+
+        # detect close
+        def reader():
+            while conn.recv(1):
+                pass
+            q.put(None)
+        threading.Thread(target=reader, daemon=True).start()
+
+        try:
+            while True:
+                data = q.get()
+                if data is None:
+                    return
+                send_frame(conn, data)
+        finally:
+            with self._lock:
+                self._subs[channel].discard(q)
+
+
+class ytBackgammonBrokerManager(PubSubManager):
+    """
+    python-socketio client manager for ytBackgammonBroker
+
+    ex. SocketIO(app, client_manager=ytBackgammonBrokerManager(url))
+    """
+    name = 'ytbg'
+    RETRY_SEC = 1
+
+    def __init__(self, url='%slocalhost:%d' % (BROKER_SCHEME,
+                                                DEF_BROKER_PORT),
+                 channel='socketio', write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only,
+                         logger=logger)
+        [self._host, self._port] = parse_url(url)
+        self._pub = None
+        self._pub_lock = threading.Lock()
+
+    def _connect(self, role):
+        sock = socket.create_connection((self._host, self._port))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.sendall(role + self.channel.encode('utf-8') + b'\n')
+        return sock
+
+    def _publish(self, data):
+        data = pickle.dumps(data)
+        with self._pub_lock:
+            # retry once with a new connection
+            for retry in [True, False]:
+                try:
+                    if self._pub is None:
+                        self._pub = self._connect(ROLE_PUB)
+                    send_frame(self._pub, data)
+                    return
+                except OSError as e:
+                    self._get_logger().error('publish: %s:%s.',
+                                             type(e).__name__, e)
+                    if self._pub is not None:
+                        self._pub.close()
+                    self._pub = None
+                    if not retry:
+                        raise
+
+    def _listen(self):
+        while True:
+            try:
+                sock = self._connect(ROLE_SUB)
+            except OSError as e:
+                self._get_logger().error('listen: %s:%s.',
+                                         type(e).__name__, e)
+                time.sleep(self.RETRY_SEC)
+                continue
+
+            try:
+                while True:
+                    data = recv_frame(sock)
+                    if data is None:
+                        break
+                    yield data
+            except OSError as e:
+                self._get_logger().error('listen: %s:%s.',
+                                         type(e).__name__, e)
+            finally:
+                sock.close()
+            time.sleep(self.RETRY_SEC)
+
+
+@click.command(context_settings=CONTEXT_SETTINGS)
+@click.option('--host', '-H', 'host', type=str, default='localhost',
+              help='address to listen')
+@click.option('--port', '-p', 'port', type=int, default=DEF_BROKER_PORT,
+              help='port number')
+@click.option('--debug', '-d', 'debug', is_flag=True, default=False,
+              help='debug flag')
+def main(host, port, debug):
+    """
+    run the broker for 'ytbg.py -C ytbg+tcp://HOST:PORT'
+    """
+    _log = get_logger(__name__, debug)
+    _log.info('host=%s, port=%s', host, port)
+
+    broker = ytBackgammonBroker(host, port, debug=debug)
+    try:
+        broker.serve()
+    finally:
+        broker.close()
+        _log.info('end')
+
+
+if __name__ == "__main__":
+    main()
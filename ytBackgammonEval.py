@@ -0,0 +1,455 @@
+#!/usr/bin/env python3
+#
+# (c) Yoichi Tanibayashi
+#
+"""
+ytBackgammonEval.py
+
+Position evaluator for move hints and post-game analysis.
+
+Each candidate play (ytBackgammonRule.legal_plays()) is scored by
+batched Monte Carlo rollouts of a race model:
+the opponent's first roll may hit a blot (sent back to the bar),
+then both sides race their pip counts to zero.
+Rollouts are vectorized with NumPy (pure Python without NumPy),
+and the candidates are spread over a process pool.
+
+Offline analysis:
+  ytBackgammonEval.py ~/ytbg-1.json
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__   = '2020/05'
+
+from ytBackgammon import ytBackgammonState, ytBackgammonRule
+from ytBackgammonHistory import ytBackgammonHistory
+from concurrent.futures import ProcessPoolExecutor
+import json
+import os
+import random
+import threading
+import time
+from MyLogger import get_logger
+import click
+CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# 36 rolls
+ROLLS = [(d1, d2) for d1 in range(1, 7) for d2 in range(1, 7)]
+# pips moved by each roll
+ROLL_PIPS = [d1 * 4 if d1 == d2 else d1 + d2 for (d1, d2) in ROLLS]
+# distances a single checker can reach with each roll (blocks ignored)
+ROLL_REACH = [frozenset([d1 * k for k in range(1, 5)]) if d1 == d2
+              else frozenset([d1, d2, d1 + d2]) for (d1, d2) in ROLLS]
+
+
+def race_rollout(pip_me, pip_opp, pen36, n, seed):
+    """
+    race rollouts, the opponent to move first
+
+    Parameters
+    ----------
+    pip_me: int
+    pip_opp: int
+    pen36: list of int
+        pips lost by 'me' for each opponent's first roll (hit)
+    n: int
+        number of rollouts
+    seed: int
+
+    Returns
+    -------
+    win: float
+        probability that 'me' wins
+    """
+    if np is None:
+        return _race_rollout_py(pip_me, pip_opp, pen36, n, seed)
+
+    rng = np.random.default_rng(seed)
+    roll_pips = np.array(ROLL_PIPS)
+
+    r = rng.integers(0, 36, n)
+    me = pip_me + np.array(pen36)[r]
+    opp = pip_opp - roll_pips[r]
+    # 1: 'me' wins, -1: opponent wins, 0: not yet
+    result = np.where(opp <= 0, -1, 0)
+
+    while (result == 0).any():
+        me -= roll_pips[rng.integers(0, 36, n)]
+        result = np.where((result == 0) & (me <= 0), 1, result)
+        opp -= roll_pips[rng.integers(0, 36, n)]
+        result = np.where((result == 0) & (opp <= 0), -1, result)
+
+    return float((result == 1).mean())
+
+
+def _race_rollout_py(pip_me, pip_opp, pen36, n, seed):
+    rnd = random.Random(seed)
+    win = 0
+    for i in range(n):
+        r = rnd.randrange(36)
+        me = pip_me + pen36[r]
+        opp = pip_opp - ROLL_PIPS[r]
+        while opp > 0:
+            me -= ROLL_PIPS[rnd.randrange(36)]
+            if me <= 0:
+                win += 1
+                break
+            opp -= ROLL_PIPS[rnd.randrange(36)]
+    return win / n
+
+
+def _rollout_task(args):
+    """
+    for ProcessPoolExecutor.map()
+    """
+    return race_rollout(*args)
+
+
+class ytBackgammonEval:
+    """
+    points := [[point of each checker of player 0], [.. player 1]]
+    """
+    N_ROLLOUTS = 2000
+
+    _log = get_logger(__name__, False)
+
+    def __init__(self, n_rollouts=N_ROLLOUTS, n_proc=None, seed=0,
+                 debug=False):
+        """
+        Parameters
+        ----------
+        n_rollouts: int
+            rollouts per candidate
+        n_proc: int
+            processes, None: os.cpu_count(), 0: no process pool
+        seed: int
+        """
+        self._dbg = debug
+        __class__._log = get_logger(__class__.__name__, self._dbg)
+        self._log.debug('n_rollouts=%s, n_proc=%s, numpy=%s',
+                        n_rollouts, n_proc, np is not None)
+
+        self._n_rollouts = n_rollouts
+        self._n_proc = os.cpu_count() if n_proc is None else n_proc
+        self._seed = seed
+
+        self._rule = ytBackgammonRule(debug=self._dbg)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def close(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+    @staticmethod
+    def points(st):
+        """
+        Returns
+        -------
+        points: list of list of int
+        """
+        if isinstance(st, ytBackgammonState):
+            i = ytBackgammonState.I_CHECKER
+            n = ytBackgammonState.N_CHECKER * 2
+            return [st._a[i:i + n:2].tolist(),
+                    st._a[i + n:i + 2 * n:2].tolist()]
+        return [[c[0] for c in st['board']['checker'][p]] for p in range(2)]
+
+    def apply_play(self, points, player, play):
+        """
+        Parameters
+        ----------
+        points: list of list of int
+        player: int
+        play: list of (from_point, to_point)
+
+        Returns
+        -------
+        points: list of list of int
+            new object
+        """
+        points = [list(points[0]), list(points[1])]
+        opp = 1 - player
+        for (src, dst) in play:
+            points[player].remove(src)
+            points[player].append(dst)
+            if 1 <= dst <= 24 and points[opp].count(dst) == 1:
+                points[opp].remove(dst)
+                points[opp].append(ytBackgammonRule.BAR_POINT[opp])
+        return points
+
+    def features(self, points, player):
+        """
+        Parameters
+        ----------
+        points: list of list of int
+            after the play of `player`
+
+        Returns
+        -------
+        pip_me: int
+        pip_opp: int
+        pen36: list of int
+            pips lost by `player` for each opponent's roll
+        """
+        opp = 1 - player
+        p2p = ytBackgammonRule.POINT2PIP
+        pip_me = sum([p2p[player][pt] for pt in points[player]])
+        pip_opp = sum([p2p[opp][pt] for pt in points[opp]])
+
+        # blots and opponent's checkers in the pip of `player`:
+        # the opponent moves toward larger pips, the bar is pip 0
+        mine = [p2p[player][pt] for pt in points[player]]
+        blots = [pip for pip in set(mine)
+                 if 1 <= pip <= 24 and mine.count(pip) == 1]
+        opps = set([0 if pt == ytBackgammonRule.BAR_POINT[opp]
+                    else p2p[player][pt]
+                    for pt in points[opp] if 1 <= pt <= 24
+                    or pt == ytBackgammonRule.BAR_POINT[opp]])
+
+        pen36 = [0] * 36
+        for blot in blots:
+            dists = set([blot - q for q in opps if q < blot])
+            if len(dists) == 0:
+                continue
+            loss = ytBackgammonRule.PIP_BAR - blot
+            for r in range(36):
+                if loss > pen36[r] and not dists.isdisjoint(ROLL_REACH[r]):
+                    pen36[r] = loss
+        return pip_me, pip_opp, pen36
+
+    def _map(self, tasks):
+        if self._n_proc <= 1 or len(tasks) <= 1:
+            return [_rollout_task(t) for t in tasks]
+
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self._n_proc)
+        chunk = max(len(tasks) // (self._n_proc * 4), 1)
+        return list(self._pool.map(_rollout_task, tasks, chunksize=chunk))
+
+    def evaluate_many(self, jobs):
+        """
+        evaluate candidate plays of many positions in one batch
+
+        Parameters
+        ----------
+        jobs: list of (st, player, dice)
+            dice: None: active dice in st
+
+        Returns
+        -------
+        results: list of list of dict
+            [{'play': play, 'win': float, 'equity': float}, ..]
+            sorted by equity, for each job
+        """
+        tasks = []
+        cands = []
+        for (j, (st, player, dice)) in enumerate(jobs):
+            points = self.points(st)
+            plays = self._rule.legal_plays(st, player, dice)
+            cands.append(plays)
+            for play in plays:
+                f = self.features(self.apply_play(points, player, play),
+                                  player)
+                # same seed for the candidates of a position:
+                # common random numbers make them comparable
+                tasks.append(f + (self._n_rollouts, self._seed + j))
+
+        wins = self._map(tasks)
+
+        results = []
+        i = 0
+        for plays in cands:
+            res = []
+            for play in plays:
+                res.append({'play': [list(m) for m in play],
+                            'win': round(wins[i], 4),
+                            'equity': round(2 * wins[i] - 1, 4)})
+                i += 1
+            res.sort(key=lambda r: -r['equity'])
+            results.append(res)
+        return results
+
+    def evaluate(self, st, player, dice=None, n_best=None):
+        """
+        Parameters
+        ----------
+        st: dict or ytBackgammonState
+            gameinfo
+        player: int
+        dice: list of int
+            None: active dice in st
+        n_best: int
+            None: all
+
+        Returns
+        -------
+        results: list of dict
+            [{'play': play, 'win': float, 'equity': float}, ..]
+        """
+        res = self.evaluate_many([(st, player, dice)])[0]
+        return res if n_best is None else res[:n_best]
+
+    def equity(self, points, player, seed):
+        """
+        equity of a position after the play of `player`
+        """
+        win = race_rollout(*self.features(points, player),
+                           self._n_rollouts, seed)
+        return round(2 * win - 1, 4)
+
+    def analyze(self, hist):
+        """
+        annotate the plays in a history
+
+        Parameters
+        ----------
+        hist: ytBackgammonHistory
+
+        Returns
+        -------
+        notes: list of dict
+        """
+        moves = self.find_moves(hist)
+        jobs = [(gi, player, dice) for (i, j, gi, player, dice, after)
+                in moves]
+        results = self.evaluate_many(jobs)
+
+        notes = []
+        for (k, ((i, j, gi, player, dice, after), res)) in enumerate(
+                zip(moves, results)):
+            if len(res) == 0:
+                continue
+            played = self.equity(after, player, self._seed + k)
+            best = res[0]
+            notes.append({
+                'hist_i': i + 1,
+                'sn': gi['sn'],
+                'game_num': gi['game_num'],
+                'player': player,
+                'dice': dice,
+                'best': best['play'],
+                'best_equity': best['equity'],
+                'played_equity': played,
+                'error': round(max(best['equity'] - played, 0), 4)
+            })
+        return notes
+
+    def find_moves(self, hist):
+        """
+        find the turns in a history:
+        a fresh roll, then the last entry before the turn changes
+
+        Returns
+        -------
+        moves: list of (i, j, gameinfo, player, dice, points after)
+        """
+        moves = []
+        start = None
+        prev_dice = None
+        n = len(hist)
+        nxt = hist.get(0) if n > 0 else None
+        for i in range(n):
+            gi = nxt
+            nxt = hist.get(i + 1) if i + 1 < n else None
+
+            player = gi['turn']
+            if player not in (0, 1):
+                start = None
+                prev_dice = None
+                continue
+
+            dice = self._rule.dice(gi, player)
+            full = (len(dice) == 4 and len(set(dice)) == 1 or
+                    len(dice) == 2 and dice[0] != dice[1])
+            if full and (start is None or start[2] != player or
+                         dice != prev_dice):
+                start = (i, gi, player, dice)
+            prev_dice = dice
+
+            if start is None:
+                continue
+            if (nxt is not None and nxt['turn'] == start[2] and
+                    nxt['game_num'] == gi['game_num']):
+                continue
+
+            # end of the turn
+            (i0, gi0, p0, d0) = start
+            before = self.points(gi0)
+            after = self.points(gi)
+            if sorted(before[p0]) != sorted(after[p0]):
+                moves.append((i0, i, gi0, p0, d0, after))
+            start = None
+        return moves
+
+
+def load_history(path_name):
+    """
+    Parameters
+    ----------
+    path_name: str
+        ~/ytbg-<id>.json (version 1 or 2)
+
+    Returns
+    -------
+    hist: ytBackgammonHistory
+    """
+    with open(path_name) as f:
+        data = json.load(f)
+
+    hist = ytBackgammonHistory()
+    if data.get('version', 1) < 2:
+        for h in data['history'] + data['fwd_hist'][::-1]:
+            hist.add(h)
+    else:
+        for ent in data['entries']:
+            hist.add_entry(ent)
+    return hist
+
+
+@click.command(context_settings=CONTEXT_SETTINGS)
+@click.argument('path_name', type=click.Path(exists=True))
+@click.option('--rollouts', '-n', 'n_rollouts', type=int,
+              default=ytBackgammonEval.N_ROLLOUTS,
+              help='rollouts per candidate play')
+@click.option('--proc', '-P', 'n_proc', type=int, default=None,
+              help='processes (default: number of CPUs, 0: no pool)')
+@click.option('--out', '-o', 'out', type=str, default=None,
+              help='write JSON lines to file')
+@click.option('--debug', '-d', 'debug', is_flag=True, default=False,
+              help='debug flag')
+def main(path_name, n_rollouts, n_proc, out, debug):
+    """
+    annotate the plays in a saved history
+
+    ex. ytBackgammonEval.py ~/ytbg-1.json -o ytbg-1.notes.jsonl
+    """
+    _log = get_logger(__name__, debug)
+    _log.info('path_name=%s, n_rollouts=%s, n_proc=%s, numpy=%s',
+              path_name, n_rollouts, n_proc, np is not None)
+
+    ev = ytBackgammonEval(n_rollouts, n_proc, debug=debug)
+    t0 = time.perf_counter()
+    try:
+        notes = ev.analyze(load_history(path_name))
+    finally:
+        ev.close()
+    _log.info('%d plays: %.2f sec', len(notes), time.perf_counter() - t0)
+
+    lines = ''.join([json.dumps(n) + '\n' for n in notes])
+    if out is not None:
+        with open(out, 'w') as f:
+            f.write(lines)
+    else:
+        print(lines, end='')
+
+
+if __name__ == "__main__":
+    main()
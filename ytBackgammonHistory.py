@@ -0,0 +1,1188 @@
+#
+# (c) Yoichi Tanibayashi
+#
+"""
+ytBackgammonHistory.py
+
+History of gameinfo, stored as periodic keyframes plus compact diffs.
+
+entry := {'sn': int, 'key': gameinfo}
+       | {'sn': int, 'diff': [[path, value], ..]}
+
+path := [key_or_index, ..]  (ex. ['board', 'checker', 0, 3])
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__   = '2020/05'
+
+import bisect
+import collections
+import copy
+import json
+import random
+import sqlite3
+import tempfile
+from ytBackgammon import ytBackgammonState, N_CHECKER
+from MyLogger import get_logger
+
+
+def gameinfo_diff(old, new, path=None, diff=None):
+    """
+    make diff between two gameinfo
+
+    Parameters
+    ----------
+    old: object
+    new: object
+
+    Returns
+    -------
+    diff: list
+        [[path, value], ..]
+    """
+    if path is None:
+        path = []
+    if diff is None:
+        diff = []
+
+    if type(old) == dict and type(new) == dict and old.keys() == new.keys():
+        for k in new:
+            gameinfo_diff(old[k], new[k], path + [k], diff)
+        return diff
+
+    if type(old) == list and type(new) == list and len(old) == len(new):
+        for i in range(len(new)):
+            gameinfo_diff(old[i], new[i], path + [i], diff)
+        return diff
+
+    if type(old) != type(new) or old != new:
+        diff.append([path, copy.deepcopy(new)])
+    return diff
+
+
+def gameinfo_patch(gameinfo, diff):
+    """
+    apply diff to gameinfo (in place)
+
+    Parameters
+    ----------
+    gameinfo: dict
+    diff: list
+        [[path, value], ..]
+
+    Returns
+    -------
+    gameinfo: dict
+    """
+    for path, value in diff:
+        if len(path) == 0:
+            return copy.deepcopy(value)
+
+        obj = gameinfo
+        for k in path[:-1]:
+            obj = obj[k]
+        obj[path[-1]] = copy.deepcopy(value)
+    return gameinfo
+
+
+def _random_keys(rnd, shape):
+    """
+    nested list of random 64 bit numbers
+    """
+    if len(shape) == 1:
+        return [rnd.getrandbits(64) for i in range(shape[0])]
+    return [_random_keys(rnd, shape[1:]) for i in range(shape[0])]
+
+
+class ytBackgammonZobrist:
+    """
+    incremental Zobrist hash of a position:
+    checker positions, dice, cube and turn
+    (not scores, clocks and player names)
+
+    Keys are generated from a fixed seed,
+    so that hashes are the same after restart.
+    """
+    SEED = 0x79746267
+    N_POINT = 28
+    N_DICE_VAL = 20     # 0: none, 1..6: active, 11..16: used
+    N_CUBE_VAL = 16     # by bit length
+    N_TURN = 5          # -1 .. 3 (clamped)
+
+    _rnd = random.Random(SEED)
+    K_CHECKER = _random_keys(_rnd, [2, N_POINT, N_CHECKER + 1])
+    K_DICE = _random_keys(_rnd, [2, 4, N_DICE_VAL])
+    K_CUBE_SIDE = _random_keys(_rnd, [3])
+    K_CUBE_VALUE = _random_keys(_rnd, [N_CUBE_VAL])
+    K_TURN = _random_keys(_rnd, [N_TURN])
+    del _rnd
+
+    __slots__ = ('hash', '_point', '_count', '_dice', '_cube', '_turn')
+
+    def __init__(self, gameinfo):
+        """
+        Parameters
+        ----------
+        gameinfo: dict
+        """
+        self.hash = 0
+        self._point = [[c[0] for c in gameinfo['board']['checker'][p]]
+                       for p in range(2)]
+        self._count = [[0] * self.N_POINT for p in range(2)]
+        for p in range(2):
+            for pt in self._point[p]:
+                self._count[p][pt] += 1
+            for pt in range(self.N_POINT):
+                self.hash ^= self.K_CHECKER[p][pt][self._count[p][pt]]
+
+        self._dice = [[0] * 4, [0] * 4]
+        for p in range(2):
+            for i in range(4):
+                self.hash ^= self.K_DICE[p][i][0]
+                self._set_dice(p, i, gameinfo['board']['dice'][p][i])
+
+        cube = gameinfo['board']['cube']
+        self._cube = [cube['side'], cube['value']]
+        self.hash ^= self._cube_key()
+
+        self._turn = gameinfo['turn']
+        self.hash ^= self.K_TURN[self._turn_i(self._turn)]
+
+    def _turn_i(self, turn):
+        return min(max(turn, -1), self.N_TURN - 2) + 1
+
+    def _cube_key(self):
+        [side, value] = self._cube
+        return (self.K_CUBE_SIDE[min(max(side, -1), 1) + 1] ^
+                self.K_CUBE_VALUE[min(int(value).bit_length(),
+                                      self.N_CUBE_VAL - 1)])
+
+    def _set_dice(self, player, i, v):
+        k = self.K_DICE[player][i]
+        v = v if 0 <= v < self.N_DICE_VAL else 0
+        self.hash ^= k[self._dice[player][i]] ^ k[v]
+        self._dice[player][i] = v
+
+    def _move_checker(self, player, ch_i, pt):
+        k = self.K_CHECKER[player]
+        cnt = self._count[player]
+        old = self._point[player][ch_i]
+        if old == pt:
+            return
+        self.hash ^= k[old][cnt[old]] ^ k[old][cnt[old] - 1]
+        cnt[old] -= 1
+        self.hash ^= k[pt][cnt[pt]] ^ k[pt][cnt[pt] + 1]
+        cnt[pt] += 1
+        self._point[player][ch_i] = pt
+
+    def apply_diff(self, diff):
+        """
+        Parameters
+        ----------
+        diff: list
+            [[path, value], ..] (see gameinfo_diff())
+
+        Returns
+        -------
+        result: bool
+            False: can't be applied incrementally
+        """
+        for path, value in diff:
+            n = len(path)
+            if n < 2:
+                if n == 0 or path[0] == 'board':
+                    return False
+                if path[0] == 'turn':
+                    self.hash ^= (self.K_TURN[self._turn_i(self._turn)] ^
+                                  self.K_TURN[self._turn_i(value)])
+                    self._turn = value
+                continue
+
+            if path[0] != 'board':
+                continue
+
+            if path[1] == 'checker':
+                if n == 5:
+                    if path[4] == 0:
+                        self._move_checker(path[2], path[3], value)
+                elif n == 4:
+                    self._move_checker(path[2], path[3], value[0])
+                elif n == 3:
+                    for ch_i, c in enumerate(value):
+                        self._move_checker(path[2], ch_i, c[0])
+                else:
+                    return False
+
+            elif path[1] == 'dice':
+                if n == 4:
+                    self._set_dice(path[2], path[3], value)
+                elif n == 3 and len(value) == 4:
+                    for i in range(4):
+                        self._set_dice(path[2], i, value[i])
+                else:
+                    return False
+
+            elif path[1] == 'cube':
+                self.hash ^= self._cube_key()
+                if n == 3:
+                    if path[2] == 'side':
+                        self._cube[0] = value
+                    elif path[2] == 'value':
+                        self._cube[1] = value
+                else:
+                    self._cube = [value['side'], value['value']]
+                self.hash ^= self._cube_key()
+
+        return True
+
+
+class ytBackgammonZIndex:
+    """
+    Zobrist hash -> entry indexes (in memory)
+    """
+    def __init__(self):
+        # hash -> [entry index, ..] in ascending order
+        self._d = {}
+
+    def add(self, zh, i):
+        idx = self._d.setdefault(zh, [])
+        if len(idx) == 0 or idx[-1] < i:
+            idx.append(i)
+        else:
+            bisect.insort(idx, i)
+
+    def truncate(self, n, zhashes):
+        """
+        remove the entries from n
+
+        Parameters
+        ----------
+        n: int
+        zhashes: iterable
+            hashes of the entries, from the last one down to n
+        """
+        for zh in zhashes:
+            idx = self._d[zh]
+            idx.pop()
+            if len(idx) == 0:
+                del self._d[zh]
+
+    def find(self, zh):
+        """
+        Returns
+        -------
+        indexes: list of int
+            in ascending order
+        """
+        return list(self._d.get(zh, []))
+
+    def last_before(self, zh, i):
+        """
+        Returns
+        -------
+        index: int
+            the last one before i (None: not found)
+        """
+        idx = self._d.get(zh, [])
+        k = bisect.bisect_left(idx, i)
+        if k == 0:
+            return None
+        return idx[k - 1]
+
+
+class ytBackgammonZIndexDB(ytBackgammonZIndex):
+    """
+    Zobrist hash -> entry indexes, in a temporary SQLite database
+    (the memory doesn't grow with the history)
+    """
+    SCHEMA = [
+        '''CREATE TABLE zindex (
+             zh INTEGER NOT NULL,
+             i INTEGER NOT NULL,
+             PRIMARY KEY (zh, i)) WITHOUT ROWID''',
+        '''CREATE INDEX zindex_i ON zindex (i)''',
+    ]
+
+    def __init__(self):
+        # '': private temporary file, deleted on close
+        self._db = sqlite3.connect('', isolation_level=None,
+                                   check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=OFF')
+        self._db.execute('PRAGMA synchronous=OFF')
+        for sql in self.SCHEMA:
+            self._db.execute(sql)
+
+    @staticmethod
+    def _signed(zh):
+        """
+        unsigned 64 bit to SQLite INTEGER
+        """
+        return zh - (1 << 64) if zh >= (1 << 63) else zh
+
+    def add(self, zh, i):
+        self._db.execute('INSERT OR REPLACE INTO zindex (zh, i) VALUES (?, ?)',
+                         (self._signed(zh), i))
+
+    def truncate(self, n, zhashes):
+        self._db.execute('DELETE FROM zindex WHERE i >= ?', (n,))
+
+    def find(self, zh):
+        return [i for (i,) in self._db.execute(
+            'SELECT i FROM zindex WHERE zh = ? ORDER BY i',
+            (self._signed(zh),))]
+
+    def last_before(self, zh, i):
+        return self._db.execute(
+            'SELECT MAX(i) FROM zindex WHERE zh = ? AND i < ?',
+            (self._signed(zh), i)).fetchone()[0]
+
+
+class ytBackgammonSpill:
+    """
+    on-disk store of history segments (a temporary file)
+
+    A blob is overwritten in its slot if it fits,
+    the slots of the others are reused (free list),
+    and the file is compacted when most of it is free.
+    """
+    # compact when free bytes > max(live bytes, COMPACT_BYTES)
+    COMPACT_BYTES = 1 << 20
+
+    _log = get_logger(__name__, False)
+
+    def __init__(self, dir_name=None, debug=False):
+        """
+        Parameters
+        ----------
+        dir_name: str
+            directory of the temporary file (None: default)
+        """
+        self._dbg = debug
+        __class__._log = get_logger(__class__.__name__, self._dbg)
+        self._log.debug('dir_name=%s', dir_name)
+
+        self._dir_name = dir_name
+        self._f = self._new_file()
+        # segment number -> (offset, length, size of the slot)
+        self._index = {}
+        # free slots: [(offset, size), ..]
+        self._free = []
+        self._n_free = 0
+        self._end = 0
+
+    def _new_file(self):
+        return tempfile.TemporaryFile(prefix='ytbg-spill-',
+                                      dir=self._dir_name)
+
+    def __contains__(self, s):
+        return s in self._index
+
+    def _alloc(self, length):
+        """
+        Returns
+        -------
+        off: int
+        size: int
+            of the slot (>= length)
+        """
+        for k, (off, size) in enumerate(self._free):
+            if size >= length:
+                del self._free[k]
+                self._n_free -= size
+                return off, size
+
+        off = self._end
+        self._end += length
+        return off, length
+
+    def _release(self, s):
+        slot = self._index.pop(s, None)
+        if slot is not None:
+            self._free.append((slot[0], slot[2]))
+            self._n_free += slot[2]
+
+    def put(self, s, seg):
+        b = json.dumps(seg, separators=(',', ':')).encode('utf-8')
+        slot = self._index.get(s)
+        if slot is not None and len(b) <= slot[2]:
+            [off, size] = [slot[0], slot[2]]
+        else:
+            self._release(s)
+            if self._n_free > max(self._end - self._n_free,
+                                  self.COMPACT_BYTES):
+                self.compact()
+            [off, size] = self._alloc(len(b))
+
+        self._f.seek(off)
+        self._f.write(b)
+        self._index[s] = (off, len(b), size)
+
+    def get(self, s):
+        [off, length, _] = self._index[s]
+        self._f.seek(off)
+        return json.loads(self._f.read(length))
+
+    def discard(self, s):
+        self._release(s)
+
+    def size(self):
+        """
+        Returns
+        -------
+        size: int
+            bytes of the file
+        """
+        return self._end
+
+    def compact(self):
+        """
+        copy the blobs to a new file, without the free slots
+        """
+        self._log.debug('end=%s, free=%s', self._end, self._n_free)
+        f = self._new_file()
+        index = {}
+        end = 0
+        for s, (off, length, _) in self._index.items():
+            self._f.seek(off)
+            f.write(self._f.read(length))
+            index[s] = (end, length, length)
+            end += length
+
+        self._f.close()
+        self._f = f
+        self._index = index
+        self._free = []
+        self._n_free = 0
+        self._end = end
+
+    def close(self):
+        self._f.close()
+
+
+class ytBackgammonHistory:
+    """
+    timeline of gameinfo with a cursor
+
+    entries[:hist_i] are the history (entries[hist_i - 1] is current),
+    entries[hist_i:] are the forward history
+
+    add() accepts a gameinfo dict or a ytBackgammonState.
+    get() and set_cursor() always return a gameinfo dict.
+
+    Each entry has a Zobrist hash of its position (zhash()),
+    indexed over the whole history (all games):
+    in memory, or in a temporary SQLite database with max_entries.
+
+    Old entries can be left on disk at startup (set_loader()):
+    they are loaded, from a keyframe, when they are first accessed.
+
+    Entries are kept in segments of SEG_SIZE. With max_entries,
+    only the recently used segments are kept in memory,
+    the others are spilled to ytBackgammonSpill.
+
+    add() after backward starts a new variation: the forward history
+    is kept as another variation, which shares the entries before
+    the fork. Only the current variation is in entries,
+    the others are kept as their entries after the fork:
+
+      var := {'id': int, 'parent': var_id, 'fork': int,
+              'n': int, 'sn': int}
+
+    (entries[:fork] of var are the ones of its parent,
+    n: number of its own entries, sn: of the last one)
+
+    The entries of a variation are in memory, in ytBackgammonSpill
+    with max_entries, or left in the storage (set_variations()).
+    The changes of the variations to be saved are taken by
+    take_var_changes().
+    """
+    KEYFRAME_INTERVAL = 32
+    SEG_SIZE = 256
+
+    # changes of a variation (see take_var_changes())
+    VAR_NEW = 'var'
+    VAR_PARENT = 'var_parent'
+    VAR_DEL = 'var_del'
+
+    _log = get_logger(__name__, False)
+
+    def __init__(self, keyframe_interval=KEYFRAME_INTERVAL, max_entries=0,
+                 spill=None, debug=False):
+        """
+        Parameters
+        ----------
+        keyframe_interval: int
+        max_entries: int
+            > 0: about max entries in memory
+        spill: ytBackgammonSpill
+            for max_entries (None: a new one in the default directory)
+        """
+        self._dbg = debug
+        __class__._log = get_logger(__class__.__name__, self._dbg)
+        self._log.debug('keyframe_interval=%s, max_entries=%s',
+                        keyframe_interval, max_entries)
+
+        self._keyframe_interval = keyframe_interval
+
+        self._n = 0
+        self.hist_i = 0
+
+        # private copy of the state at (hist_i - 1):
+        # gameinfo dict or ytBackgammonState
+        self._cur_state = None
+
+        # segment s := [entries, Zobrist hashes]
+        #   of entries[s * SEG_SIZE:(s + 1) * SEG_SIZE],
+        #   None: not in memory
+        self._segs = []
+
+        # segments in memory, in LRU order (max_entries only)
+        self._max_segs = 0
+        if max_entries > 0:
+            self._max_segs = max(-(-max_entries // self.SEG_SIZE), 2)
+            if spill is None:
+                spill = ytBackgammonSpill(debug=self._dbg)
+        self._spill = spill
+        self._lru = collections.OrderedDict()
+        # segments changed after spilled
+        self._dirty = set()
+
+        # hash -> entry indexes
+        if max_entries > 0:
+            self._zindex = ytBackgammonZIndexDB()
+        else:
+            self._zindex = ytBackgammonZIndex()
+        # ytBackgammonZobrist of the last entry (None: to be rebuilt)
+        self._zs = None
+
+        # entries[:_lazy_n] are not loaded yet (None)
+        self._lazy_n = 0
+        self._loader = None
+        # hash lookup of the entries not loaded yet (see set_loader())
+        self._zfind = None
+
+        # current variation, and the other ones: var_id -> var
+        self.var_id = 0
+        self._vars = {}
+        self._next_var_id = 1
+        # entries of the variations (without max_entries): var_id -> list
+        self._var_ents = {}
+        # var_loader(var_id) -> entries, of the ones in the storage
+        self._var_loader = None
+        # changed variations: var_id -> VAR_NEW | VAR_PARENT | VAR_DEL
+        self._var_changes = {}
+
+    def __len__(self):
+        return self._n
+
+    @property
+    def lazy_n(self):
+        """
+        number of entries not loaded yet
+        """
+        return self._lazy_n
+
+    def _seg(self, s):
+        """
+        segment s, paged in if needed
+        """
+        seg = self._segs[s]
+        if seg is None:
+            if self._spill is not None and s in self._spill:
+                seg = self._spill.get(s)
+            else:
+                seg = [[None] * self.SEG_SIZE, [None] * self.SEG_SIZE]
+            self._segs[s] = seg
+
+        if self._max_segs > 0:
+            self._lru[s] = None
+            self._lru.move_to_end(s)
+            while len(self._lru) > self._max_segs:
+                self._page_out(self._lru.popitem(last=False)[0])
+        return seg
+
+    def _page_out(self, s):
+        if s in self._dirty:
+            self._spill.put(s, self._segs[s])
+            self._dirty.discard(s)
+        self._segs[s] = None
+
+    def _set(self, i, ent, zh):
+        [s, j] = divmod(i, self.SEG_SIZE)
+        seg = self._seg(s)
+        seg[0][j] = ent
+        seg[1][j] = zh
+        if self._max_segs > 0:
+            self._dirty.add(s)
+
+    def _entry(self, i):
+        if i < self._lazy_n:
+            self._load(i)
+        [s, j] = divmod(i, self.SEG_SIZE)
+        return self._seg(s)[0][j]
+
+    def iter_entries(self, load=True):
+        """
+        encoded entries (for saving)
+
+        Parameters
+        ----------
+        load: bool
+            False: entries not loaded yet are None
+        """
+        if load:
+            self.load_all()
+        for i in range(self._n):
+            yield None if i < self._lazy_n else self._entry(i)
+
+    def entries(self, load=True):
+        """
+        list of encoded entries (see iter_entries())
+        """
+        return list(self.iter_entries(load))
+
+    def set_loader(self, n, loader, zfind=None):
+        """
+        start with `n` entries that are not loaded yet
+        (then add the rest with add_entry())
+
+        Parameters
+        ----------
+        n: int
+        loader: function
+            loader(i, n) -> (i0, entries[i0:n]),
+            where entry i0 (<= i) is a keyframe
+        zfind: function
+            zfind(zh, n) -> indexes (< n) of the entries with hash zh,
+            in ascending order, or None: not known.
+            None: the entries are loaded to find a position
+        """
+        self._log.debug('n=%s', n)
+        if self._n > 0:
+            raise ValueError('history is not empty')
+
+        self._segs = [None] * -(-n // self.SEG_SIZE)
+        self._n = n
+        self.hist_i = n
+        self._lazy_n = n
+        self._loader = loader if n > 0 else None
+        self._zfind = zfind if n > 0 else None
+
+    def _load(self, i):
+        """
+        load the entries from (the keyframe before) i to _lazy_n
+        """
+        [i0, ents] = self._loader(i, self._lazy_n)
+        self._log.debug('i=%s: [%s:%s]', i, i0, self._lazy_n)
+        if i0 > i or len(ents) != self._lazy_n - i0 or 'key' not in ents[0]:
+            raise ValueError('i=%s: loader returned [%s:%s]' % (
+                i, i0, i0 + len(ents)))
+
+        for k, ent in enumerate(ents, i0):
+            self._set(k, ent, None)
+        self._lazy_n = i0
+        if i0 == 0:
+            self._loader = None
+            self._zfind = None
+
+        for k, ent in enumerate(ents, i0):
+            if 'key' in ent:
+                zs = ytBackgammonZobrist(ent['key'])
+            elif not zs.apply_diff(ent['diff']):
+                zs = ytBackgammonZobrist(self.get(k))
+            self._set(k, ent, zs.hash)
+            self._zindex.add(zs.hash, k)
+
+    def load_all(self):
+        """
+        load all entries not loaded yet
+        """
+        if self._lazy_n > 0:
+            self._load(0)
+
+    def entry(self, i):
+        """
+        Parameters
+        ----------
+        i: int
+            entry index
+
+        Returns
+        -------
+        entry: dict
+            encoded entry (not to be modified)
+        """
+        return self._entry(i)
+
+    def sn(self, i):
+        """
+        Parameters
+        ----------
+        i: int
+            entry index
+
+        Returns
+        -------
+        sn: int
+        """
+        return self._entry(i)['sn']
+
+    def get(self, i):
+        """
+        reconstruct gameinfo of entry i
+
+        Parameters
+        ----------
+        i: int
+            entry index (< 0: from the end)
+
+        Returns
+        -------
+        gameinfo: dict
+            new object
+        """
+        if i < 0:
+            i += self._n
+        if i < 0 or i >= self._n:
+            raise IndexError('i=%s: out of range' % (i))
+
+        if i == self.hist_i - 1 and self._cur_state is not None:
+            return self._cur_gameinfo()
+
+        k = i
+        while 'key' not in self._entry(k):
+            k -= 1
+        gameinfo = copy.deepcopy(self._entry(k)['key'])
+        for j in range(k + 1, i + 1):
+            gameinfo = gameinfo_patch(gameinfo, self._entry(j)['diff'])
+        return gameinfo
+
+    def zhash(self, i):
+        """
+        Parameters
+        ----------
+        i: int
+            entry index
+
+        Returns
+        -------
+        zh: int
+            Zobrist hash of the position
+        """
+        if i < self._lazy_n:
+            self._load(i)
+        [s, j] = divmod(i, self.SEG_SIZE)
+        return self._seg(s)[1][j]
+
+    def _zfind_lazy(self, zh, n):
+        """
+        entries (< n) with hash zh, in the ones not loaded yet
+
+        Returns
+        -------
+        indexes: list of int
+            in ascending order
+        """
+        n = min(n, self._lazy_n)
+        if n <= 0:
+            return []
+        if self._zfind is not None:
+            idx = self._zfind(zh, n)
+            if idx is not None:
+                return idx
+        # the hashes are not known: load them
+        self._log.debug('zh=%s: load all', zh)
+        self.load_all()
+        return []
+
+    def find_position(self, zh):
+        """
+        Parameters
+        ----------
+        zh: int
+            Zobrist hash
+
+        Returns
+        -------
+        indexes: list of int
+            entry indexes with the position, in ascending order
+        """
+        idx = self._zfind_lazy(zh, self._lazy_n)
+        return idx + self._zindex.find(zh)
+
+    def last_position(self, i):
+        """
+        the last time the position of entry i occurred before it
+
+        Parameters
+        ----------
+        i: int
+            entry index
+
+        Returns
+        -------
+        index: int
+            None: not found
+        """
+        zh = self.zhash(i)
+        k = self._zindex.last_before(zh, i)
+        if k is None:
+            idx = self._zfind_lazy(zh, i)
+            if len(idx) > 0:
+                k = idx[-1]
+            else:
+                # may have been loaded
+                k = self._zindex.last_before(zh, i)
+        return k
+
+    def _truncate(self):
+        """
+        discard the forward history
+        """
+        if self.hist_i >= self._n:
+            return
+
+        self._zindex.truncate(self.hist_i,
+                              (self.zhash(i) for i in
+                               range(self._n - 1, self.hist_i - 1, -1)))
+
+        n_seg = -(-self.hist_i // self.SEG_SIZE)
+        for s in range(n_seg, len(self._segs)):
+            self._lru.pop(s, None)
+            self._dirty.discard(s)
+            if self._spill is not None:
+                self._spill.discard(s)
+        del self._segs[n_seg:]
+
+        j = self.hist_i % self.SEG_SIZE
+        if j > 0:
+            seg = self._seg(n_seg - 1)
+            seg[0][j:] = [None] * (self.SEG_SIZE - j)
+            seg[1][j:] = [None] * (self.SEG_SIZE - j)
+            if self._max_segs > 0:
+                self._dirty.add(n_seg - 1)
+
+        self._n = self.hist_i
+        # it was of the discarded last entry
+        self._zs = None
+
+    def _var_key(self, var_id):
+        """
+        key in ytBackgammonSpill
+        """
+        return 'v%d' % (var_id)
+
+    def _put_var_entries(self, var_id, ents):
+        if self._max_segs > 0:
+            self._spill.put(self._var_key(var_id), ents)
+        else:
+            self._var_ents[var_id] = ents
+
+    def _var_entries(self, var_id, take=False):
+        """
+        entries of variation var_id
+
+        Parameters
+        ----------
+        take: bool
+            True: remove them from memory or the spill
+        """
+        if var_id in self._var_ents:
+            if take:
+                return self._var_ents.pop(var_id)
+            return self._var_ents[var_id]
+
+        key = self._var_key(var_id)
+        if self._spill is not None and key in self._spill:
+            ents = self._spill.get(key)
+            if take:
+                self._spill.discard(key)
+            return ents
+
+        return self._var_loader(var_id)
+
+    def _var_changed(self, var_id, change):
+        """
+        VAR_NEW and VAR_DEL replace the earlier changes
+        """
+        if change != self.VAR_PARENT or var_id not in self._var_changes:
+            self._var_changes[var_id] = change
+
+    def _stash(self, parent):
+        """
+        move the forward history to the current variation,
+        which becomes a child of `parent`
+        """
+        fork = self.hist_i
+        self._log.debug('var_id=%s, fork=%s, parent=%s',
+                        self.var_id, fork, parent)
+        for v in self._vars.values():
+            if v['parent'] == self.var_id and v['fork'] <= fork:
+                v['parent'] = parent
+                self._var_changed(v['id'], self.VAR_PARENT)
+
+        ents = [self._entry(i) for i in range(fork, self._n)]
+        self._vars[self.var_id] = {
+            'id': self.var_id, 'parent': parent, 'fork': fork,
+            'n': len(ents), 'sn': ents[-1]['sn'] if len(ents) > 0 else 0}
+        self._put_var_entries(self.var_id, ents)
+        self._var_changed(self.var_id, self.VAR_NEW)
+        self._truncate()
+        self.var_id = parent
+
+    def _new_variation(self):
+        """
+        keep the forward history as a variation (for add at the cursor)
+        """
+        parent = self._next_var_id
+        self._next_var_id += 1
+        self._stash(parent)
+
+    def variations(self):
+        """
+        Returns
+        -------
+        vars: list of dict
+            {'id': int, 'parent': int, 'fork': int, 'n': int, 'sn': int,
+             'current': bool}, in the order of id
+            n: number of entries, sn: of the last entry
+        """
+        ret = [{'id': self.var_id, 'parent': None, 'fork': None,
+                'n': self._n,
+                'sn': self.sn(self._n - 1) if self._n > 0 else 0,
+                'current': True}]
+        for v in self._vars.values():
+            ret.append({'id': v['id'], 'parent': v['parent'],
+                        'fork': v['fork'], 'n': v['fork'] + v['n'],
+                        'sn': v['sn'], 'current': False})
+        return sorted(ret, key=lambda v: v['id'])
+
+    def switch_variation(self, var_id):
+        """
+        make variation `var_id` the current one,
+        the cursor is set to its first entry after the fork
+
+        Parameters
+        ----------
+        var_id: int
+
+        Returns
+        -------
+        fork: int
+            entries[fork:] have been replaced
+        """
+        self._log.debug('var_id=%s', var_id)
+        if var_id == self.var_id:
+            return self._n
+        if var_id not in self._vars:
+            raise KeyError('var_id=%s: no such variation' % (var_id))
+
+        path = []
+        while var_id != self.var_id:
+            path.append(var_id)
+            var_id = self._vars[var_id]['parent']
+
+        fork = self._vars[path[-1]]['fork']
+        for var_id in path[::-1]:
+            v = self._vars.pop(var_id)
+            ents = self._var_entries(var_id, take=True)
+            self._var_changed(var_id, self.VAR_DEL)
+            self.hist_i = v['fork']
+            self._zs = None
+            self._stash(var_id)
+            for ent in ents:
+                self._append(ent)
+
+        self._cur_state = None
+        self.set_cursor(fork + 1)
+        return fork
+
+    def take_var_changes(self):
+        """
+        changes of the variations since the last call, to be saved
+
+        Returns
+        -------
+        changes: list of tuple
+            (VAR_NEW, var, entries) | (VAR_PARENT, var_id, parent)
+            | (VAR_DEL, var_id),
+            and the last one: ('var_id', var_id, next_var_id)
+            ([]: no changes)
+        """
+        if len(self._var_changes) == 0:
+            return []
+
+        changes = []
+        for var_id, change in sorted(self._var_changes.items()):
+            if change == self.VAR_DEL:
+                changes.append((change, var_id))
+            elif change == self.VAR_PARENT:
+                changes.append((change, var_id,
+                                self._vars[var_id]['parent']))
+            else:
+                changes.append((change, dict(self._vars[var_id]),
+                                self._var_entries(var_id)))
+        self._var_changes = {}
+        changes.append(('var_id', self.var_id, self._next_var_id))
+        return changes
+
+    def dump_variations(self):
+        """
+        Returns
+        -------
+        data: dict
+            {'current': var_id, 'next': next var_id,
+             'vars': [var with 'entries', ..]}
+            (see set_variations())
+        """
+        return {'current': self.var_id, 'next': self._next_var_id,
+                'vars': [dict(v, entries=self._var_entries(v['id']))
+                         for v in sorted(self._vars.values(),
+                                         key=lambda v: v['id'])]}
+
+    def set_variations(self, data, loader=None):
+        """
+        restore the variations (for loading, before the entries)
+
+        Parameters
+        ----------
+        data: dict
+            dump_variations(), 'entries' of a var can be left out
+        loader: function
+            loader(var_id) -> entries, for the ones left out
+        """
+        self._log.debug('current=%s, next=%s, len(vars)=%s',
+                        data['current'], data['next'], len(data['vars']))
+        self.var_id = data['current']
+        self._next_var_id = data['next']
+        self._var_loader = loader
+        for v in data['vars']:
+            self._vars[v['id']] = {k: v[k] for k in
+                                   ['id', 'parent', 'fork', 'n', 'sn']}
+            if 'entries' in v:
+                self._put_var_entries(v['id'], v['entries'])
+
+    def _append(self, ent):
+        """
+        append an entry and its hash,
+        incrementally from the previous one
+        """
+        i = self._n
+        if i // self.SEG_SIZE == len(self._segs):
+            self._segs.append(None)
+        self._n += 1
+        self._set(i, ent, None)
+
+        if 'key' in ent:
+            self._zs = ytBackgammonZobrist(ent['key'])
+        elif self._zs is None or not self._zs.apply_diff(ent['diff']):
+            self._zs = ytBackgammonZobrist(self.get(i))
+
+        zh = self._zs.hash
+        self._set(i, ent, zh)
+        self._zindex.add(zh, i)
+
+    def add(self, gameinfo):
+        """
+        add gameinfo at the cursor,
+        the forward history is kept as a variation
+
+        Parameters
+        ----------
+        gameinfo: dict or ytBackgammonState
+
+        Returns
+        -------
+        entry: dict
+            encoded entry
+        """
+        if self.hist_i < self._n:
+            self._new_variation()
+
+        i = self._n
+        compact = isinstance(gameinfo, ytBackgammonState)
+        if i % self._keyframe_interval == 0 or self._cur_state is None:
+            if compact:
+                ent = {'sn': gameinfo.sn, 'key': gameinfo.to_gameinfo()}
+                self._cur_state = gameinfo.copy()
+            else:
+                ent = {'sn': gameinfo['sn'], 'key': copy.deepcopy(gameinfo)}
+                self._cur_state = copy.deepcopy(gameinfo)
+        elif compact:
+            if not isinstance(self._cur_state, ytBackgammonState):
+                self._cur_state = ytBackgammonState.from_gameinfo(
+                    self._cur_state)
+            ent = {'sn': gameinfo.sn, 'diff': gameinfo.diff(self._cur_state)}
+            self._cur_state = gameinfo.copy()
+        else:
+            if isinstance(self._cur_state, ytBackgammonState):
+                self._cur_state = self._cur_state.to_gameinfo()
+            diff = gameinfo_diff(self._cur_state, gameinfo)
+            ent = {'sn': gameinfo['sn'], 'diff': diff}
+            self._cur_state = gameinfo_patch(self._cur_state, diff)
+
+        self._append(ent)
+        self.hist_i = self._n
+        return ent
+
+    def add_entry(self, ent):
+        """
+        add encoded entry at the cursor (for loading),
+        the forward history is kept as a variation as add() does
+
+        Parameters
+        ----------
+        ent: dict
+            encoded entry
+        """
+        if self.hist_i == self._lazy_n and 'key' not in ent:
+            raise ValueError('first entry must be a keyframe')
+        if self.hist_i < self._n:
+            self._new_variation()
+
+        self._cur_state = None
+        self._append(ent)
+        self.hist_i = self._n
+
+    def set_cursor(self, hist_i):
+        """
+        Parameters
+        ----------
+        hist_i: int
+            number of entries before the cursor
+
+        Returns
+        -------
+        gameinfo: dict
+            new object of current gameinfo
+        """
+        hist_i = min(max(hist_i, 1), self._n)
+        if hist_i != self.hist_i or self._cur_state is None:
+            if hist_i != self.hist_i:
+                self._zs = None
+            self.hist_i = hist_i
+            self._cur_state = None
+            self._cur_state = self.get(self.hist_i - 1)
+        return self._cur_gameinfo()
+
+    def _cur_gameinfo(self):
+        if isinstance(self._cur_state, ytBackgammonState):
+            return self._cur_state.to_gameinfo()
+        return copy.deepcopy(self._cur_state)
+
+    def backward(self):
+        """
+        Returns
+        -------
+        gameinfo: dict
+            new object of current gameinfo
+        """
+        return self.set_cursor(self.hist_i - 1)
+
+    def forward(self):
+        """
+        Returns
+        -------
+        gameinfo: dict
+            new object of current gameinfo
+        """
+        return self.set_cursor(self.hist_i + 1)
@@ -0,0 +1,478 @@
+#!/usr/bin/env python3
+#
+# (c) Yoichi Tanibayashi
+#
+"""
+ytBackgammonLoadTest.py
+
+Load generator for ytbg.py:
+simulated players and spectators over Socket.IO.
+
+Players send realistic message streams
+(put_checker, dice, cube, set_turn, back/fwd),
+spectators only receive (as '?role=spectator' clients by default,
+so only the players' latency is measured).
+Each player message carries a timestamp,
+so every client measures the broadcast round trip.
+
+Runtime comparison (-M): runs ytbg.py with each async mode
+(see ytBackgammonRuntime) in turn and reports,
+per mode, connected clients, transports, messages/sec,
+latency and messages per server CPU second.
+
+Requires: pip install "python-socketio[client]"
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__   = '2020/05'
+
+import json
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from MyLogger import get_logger
+import click
+CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
+
+
+def percentile(values, p):
+    """
+    Parameters
+    ----------
+    values: list
+        sorted
+    p: float
+        0 .. 100
+    """
+    if len(values) == 0:
+        return None
+    i = min(int(len(values) * p / 100), len(values) - 1)
+    return values[i]
+
+
+class SimClient:
+    """
+    one simulated browser
+    """
+    _log = get_logger(__name__, False)
+
+    def __init__(self, url, board_id, name, stats, role=None, debug=False):
+        """
+        Parameters
+        ----------
+        role: str
+            None: player, 'spectator'
+        """
+        self._dbg = debug
+        __class__._log = get_logger(__class__.__name__, self._dbg)
+        self._log.debug('url=%s, board_id=%s, name=%s, role=%s',
+                        url, board_id, name, role)
+
+        import socketio
+
+        self.url = url
+        self.board_id = board_id
+        self.name = name
+        self.role = role
+        self._stats = stats
+
+        self.sio = socketio.Client(reconnection=False)
+        self.sio.on('json', self.on_json)
+
+    def connect(self):
+        url = '%s?board=%s' % (self.url, self.board_id)
+        if self.role is not None:
+            url += '&role=%s' % (self.role)
+        self.sio.connect(url)
+
+    def disconnect(self):
+        self.sio.disconnect()
+
+    def transport(self):
+        return self.sio.transport()
+
+    def on_json(self, msg):
+        now = time.monotonic()
+        lt = msg.get('lt') if isinstance(msg, dict) else None
+        self._stats.recv(msg.get('type'),
+                         None if lt is None else now - lt['t'],
+                         lt is not None and lt['from'] == self.name)
+
+    def emit(self, mtype, data, history=False):
+        self.sio.emit('json', {
+            'src': 'client', 'type': mtype, 'data': data,
+            'history': history,
+            'lt': {'from': self.name, 't': time.monotonic()}
+        })
+        self._stats.sent(mtype)
+
+
+class SimPlayer(SimClient):
+    """
+    simulated player: sends a message stream at a given rate
+    """
+    # (weight, type)
+    MSG_MIX = [(60, 'put_checker'), (15, 'dice'), (10, 'set_turn'),
+               (5, 'cube'), (5, 'back'), (5, 'fwd')]
+
+    def __init__(self, url, board_id, name, player, rate, stats,
+                 debug=False):
+        super().__init__(url, board_id, name, stats, debug=debug)
+        self.player = player
+        self.rate = rate
+        self._types = [t for w, t in self.MSG_MIX]
+        self._weights = [w for w, t in self.MSG_MIX]
+
+    def send_one(self):
+        mtype = random.choices(self._types, self._weights)[0]
+        p = self.player
+
+        if mtype == 'put_checker':
+            self.emit(mtype, {'ch': p * 100 + random.randrange(15),
+                              'p': random.randrange(1, 25),
+                              'idx': random.randrange(5)}, True)
+        elif mtype == 'dice':
+            self.emit(mtype, {'player': p,
+                              'dice': [random.randint(1, 6),
+                                       random.randint(1, 6), 0, 0]}, True)
+        elif mtype == 'set_turn':
+            self.emit(mtype, {'turn': 1 - p, 'resign': -1}, True)
+        elif mtype == 'cube':
+            self.emit(mtype, {'side': p, 'value': 2, 'accepted': True}, True)
+        elif mtype == 'back':
+            self.emit(mtype, {'n': 1})
+        else:
+            self.emit(mtype, {'n': 1})
+
+    def run(self, stop_ev):
+        interval = 1.0 / self.rate
+        t_next = time.monotonic()
+        while not stop_ev.is_set():
+            self.send_one()
+            t_next += interval
+            stop_ev.wait(max(t_next - time.monotonic(), 0))
+
+
+class LoadStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.n_sent = {}
+        self.n_recv = {}
+        self.latency = []
+        self.echo_latency = []
+
+    def sent(self, mtype):
+        with self._lock:
+            self.n_sent[mtype] = self.n_sent.get(mtype, 0) + 1
+
+    def recv(self, mtype, latency, echo):
+        with self._lock:
+            self.n_recv[mtype] = self.n_recv.get(mtype, 0) + 1
+            if latency is not None:
+                self.latency.append(latency)
+                if echo:
+                    self.echo_latency.append(latency)
+
+    def report(self, sec, n_clients):
+        with self._lock:
+            lat = sorted(self.latency)
+            echo = sorted(self.echo_latency)
+            n_sent = sum(self.n_sent.values())
+            n_recv = sum(self.n_recv.values())
+
+            def ms(v):
+                return None if v is None else round(v * 1000, 3)
+
+            return {
+                'sec': round(sec, 3),
+                'clients': n_clients,
+                'sent': n_sent,
+                'recv': n_recv,
+                'sent_per_sec': round(n_sent / sec, 1),
+                'recv_per_sec': round(n_recv / sec, 1),
+                'sent_by_type': dict(self.n_sent),
+                'recv_by_type': dict(self.n_recv),
+                'latency_ms': {
+                    'p50': ms(percentile(lat, 50)),
+                    'p95': ms(percentile(lat, 95)),
+                    'p99': ms(percentile(lat, 99)),
+                    'max': ms(lat[-1] if lat else None)
+                },
+                'echo_latency_ms': {
+                    'p50': ms(percentile(echo, 50)),
+                    'p95': ms(percentile(echo, 95)),
+                    'p99': ms(percentile(echo, 99))
+                }
+            }
+
+
+def run_load(url, board_ids, watchers, rate, sec, watch_role='spectator',
+             debug=False):
+    """
+    Parameters
+    ----------
+    url: str
+        ex. 'http://localhost:5001/'
+    board_ids: list of str
+    watchers: int
+        spectators per board
+    rate: float
+        messages/sec per player
+    sec: float
+        duration
+    watch_role: str
+        role of the spectators ('player': get every message)
+
+    Returns
+    -------
+    report: dict
+    """
+    _log = get_logger(__name__, debug)
+
+    stats = LoadStats()
+    players = []
+    clients = []
+    for b_id in board_ids:
+        for p in range(2):
+            pl = SimPlayer(url, b_id, '%s-p%d' % (b_id, p), p, rate, stats,
+                           debug=debug)
+            players.append(pl)
+            clients.append(pl)
+        for w in range(watchers):
+            clients.append(SimClient(url, b_id, '%s-w%d' % (b_id, w), stats,
+                                     role=watch_role, debug=debug))
+
+    _log.info('connecting %d clients ..', len(clients))
+    connected = []
+    for c in clients:
+        try:
+            c.connect()
+            connected.append(c)
+        except Exception as e:
+            _log.warning('%s: %s:%s.', c.name, type(e).__name__, e)
+    players = [pl for pl in players if pl in connected]
+
+    transports = {}
+    for c in connected:
+        t = c.transport()
+        transports[t] = transports.get(t, 0) + 1
+
+    stop_ev = threading.Event()
+    threads = [threading.Thread(target=pl.run, args=(stop_ev,), daemon=True)
+               for pl in players]
+
+    # count only the steady state
+    stats.reset()
+    t0 = time.monotonic()
+    for th in threads:
+        th.start()
+    stop_ev.wait(sec)
+    stop_ev.set()
+    for th in threads:
+        th.join()
+    t1 = time.monotonic()
+    # drain
+    time.sleep(0.5)
+    report = stats.report(t1 - t0, len(connected))
+    report['connect_failed'] = len(clients) - len(connected)
+    report['transports'] = transports
+
+    for c in connected:
+        c.disconnect()
+    return report
+
+
+def start_server(async_mode, port, board_ids, data_dir, asset_dir,
+                 timeout=60, options=()):
+    """
+    run ytbg.py (next to this file) in a subprocess
+
+    Parameters
+    ----------
+    data_dir: str
+        as $HOME of the server (history files)
+    options: list of str
+        other options of ytbg.py
+
+    Returns
+    -------
+    proc: subprocess.Popen
+    """
+    cmd = [sys.executable,
+           os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'ytbg.py'),
+           '-M', async_mode, '-p', str(port), '-a', asset_dir,
+           '-D', 'shutdown'] + list(options) + list(board_ids)
+    proc = subprocess.Popen(cmd, env=dict(os.environ, HOME=data_dir),
+                            stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL)
+
+    t_end = time.monotonic() + timeout
+    while time.monotonic() < t_end:
+        if proc.poll() is not None:
+            raise RuntimeError('%s: exit %s' % (cmd, proc.returncode))
+        try:
+            socket.create_connection(('localhost', port), 1).close()
+            return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    proc.wait()
+    raise RuntimeError('%s: not started' % (cmd))
+
+
+def stop_server(proc):
+    """
+    Returns
+    -------
+    cpu_sec: float
+        CPU time (user + sys) of the server
+    """
+    ru0 = resource.getrusage(resource.RUSAGE_CHILDREN)
+    proc.terminate()
+    try:
+        proc.wait(10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+    ru1 = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return (ru1.ru_utime - ru0.ru_utime) + (ru1.ru_stime - ru0.ru_stime)
+
+
+def compare_modes(async_modes, port, board_ids, watchers, rate, sec,
+                  watch_role='spectator', debug=False):
+    """
+    run the same load against ytbg.py in each async mode
+
+    Returns
+    -------
+    reports: list of dict
+    """
+    _log = get_logger(__name__, debug)
+
+    reports = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # built once, reused by the following servers
+        asset_dir = os.path.join(tmp_dir, 'assets')
+
+        for mode in async_modes:
+            data_dir = os.path.join(tmp_dir, mode)
+            os.makedirs(data_dir)
+            _log.info('async_mode=%s', mode)
+
+            proc = start_server(mode, port, board_ids, data_dir, asset_dir)
+            try:
+                report = run_load('http://localhost:%d/' % (port),
+                                  board_ids, watchers, rate, sec,
+                                  watch_role=watch_role, debug=debug)
+            finally:
+                cpu_sec = stop_server(proc)
+
+            report['async_mode'] = mode
+            report['server_cpu_sec'] = round(cpu_sec, 3)
+            # messages delivered per server CPU second (~ per core)
+            report['recv_per_cpu_sec'] = (
+                round(report['recv'] / cpu_sec, 1) if cpu_sec > 0 else None)
+            reports.append(report)
+    return reports
+
+
+def format_comparison(reports):
+    """
+    Returns
+    -------
+    table: str
+    """
+    head = ['async_mode', 'clients', 'failed', 'websocket', 'sent/s',
+            'recv/s', 'p50 ms', 'p99 ms', 'cpu sec', 'recv/cpu s']
+    rows = [head]
+    for r in reports:
+        rows.append([str(v) for v in [
+            r['async_mode'], r['clients'], r['connect_failed'],
+            r['transports'].get('websocket', 0), r['sent_per_sec'],
+            r['recv_per_sec'], r['latency_ms']['p50'],
+            r['latency_ms']['p99'], r['server_cpu_sec'],
+            r['recv_per_cpu_sec']]])
+    width = [max([len(row[i]) for row in rows]) for i in range(len(head))]
+    return '\n'.join(['  '.join([v.rjust(w) for (v, w) in zip(row, width)])
+                      for row in rows])
+
+
+@click.command(context_settings=CONTEXT_SETTINGS)
+@click.option('--url', '-u', 'url', type=str,
+              default='http://localhost:5001/', help='server URL')
+@click.option('--boards', '-b', 'boards', type=int, default=1,
+              help='number of boards (board ids: 1 .. N)')
+@click.option('--board_ids', '-B', 'board_ids', type=str, default=None,
+              help='board ids (comma separated, overrides --boards)')
+@click.option('--watchers', '-w', 'watchers', type=int, default=4,
+              help='spectators per board')
+@click.option('--watch_role', '-R', 'watch_role',
+              type=click.Choice(['spectator', 'player']),
+              default='spectator', help='role of the spectators')
+@click.option('--rate', '-r', 'rate', type=float, default=2.0,
+              help='messages/sec per player')
+@click.option('--sec', '-s', 'sec', type=float, default=10.0,
+              help='duration (sec)')
+@click.option('--out', '-o', 'out', type=str, default=None,
+              help='write JSON report to file')
+@click.option('--async_modes', '-M', 'async_modes', type=str, default=None,
+              help='compare the runtimes: run ytbg.py with each of '
+              'these async modes (comma separated, ex. '
+              '\'threading,eventlet,gevent\'), --url is not used')
+@click.option('--port', '-p', 'port', type=int, default=5099,
+              help='port number of ytbg.py for --async_modes')
+@click.option('--debug', '-d', 'debug', is_flag=True, default=False,
+              help='debug flag')
+def main(url, boards, board_ids, watchers, watch_role, rate, sec, out,
+         async_modes, port, debug):
+    """
+    ex. ytbg.py -p 5001 1 2 3 4 &
+        ytBackgammonLoadTest.py -b 4 -w 20 -r 2
+
+    ex. ytBackgammonLoadTest.py -M threading,eventlet,gevent -b 4 -w 20
+    """
+    _log = get_logger(__name__, debug)
+    _log.info('url=%s, boards=%s, watchers=%s, rate=%s, sec=%s',
+              url, boards, watchers, rate, sec)
+
+    if board_ids is not None:
+        board_ids = board_ids.split(',')
+    else:
+        board_ids = [str(i) for i in range(1, boards + 1)]
+
+    if async_modes is not None:
+        reports = compare_modes(async_modes.split(','), port, board_ids,
+                                watchers, rate, sec, watch_role=watch_role,
+                                debug=debug)
+        report = {'boards': len(board_ids),
+                  'watchers_per_board': watchers,
+                  'watch_role': watch_role,
+                  'rate_per_player': rate,
+                  'modes': reports}
+        print(format_comparison(reports), file=sys.stderr)
+    else:
+        report = run_load(url, board_ids, watchers, rate, sec,
+                          watch_role=watch_role, debug=debug)
+        report['boards'] = len(board_ids)
+        report['watchers_per_board'] = watchers
+        report['watch_role'] = watch_role
+        report['rate_per_player'] = rate
+
+    j_str = json.dumps(report, indent=2)
+    print(j_str)
+    if out is not None:
+        with open(out, 'w') as f:
+            f.write(j_str + '\n')
+
+
+if __name__ == "__main__":
+    main()
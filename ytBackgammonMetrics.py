@@ -0,0 +1,193 @@
+#
+# (c) Yoichi Tanibayashi
+#
+"""
+ytBackgammonMetrics.py
+
+Counters, gauges and histograms in Prometheus text format.
+
+Usage:
+--
+from ytBackgammonMetrics import metrics
+
+metrics.inc('ytbg_xxx_total', {'board': '1'})
+metrics.observe('ytbg_xxx_seconds', sec, {'board': '1'})
+text = metrics.render()
+--
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__   = '2020/05'
+
+import bisect
+import threading
+import time
+
+SEC_BUCKETS = (.0001, .00025, .0005, .001, .0025, .005, .01,
+               .025, .05, .1, .25, .5, 1, 2.5, 5)
+FANOUT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144,
+                 1048576, 4194304, 16777216)
+
+
+class Metrics:
+    """
+    metric := {labels(tuple): value}
+    """
+    COUNTER = 'counter'
+    GAUGE = 'gauge'
+    HISTOGRAM = 'histogram'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._type = {}
+        self._help = {}
+        self._buckets = {}
+        self._value = {}
+
+    def define(self, name, mtype, help_str, buckets=None):
+        """
+        Parameters
+        ----------
+        name: str
+        mtype: str
+            COUNTER | GAUGE | HISTOGRAM
+        help_str: str
+        buckets: tuple
+            upper bounds for HISTOGRAM
+        """
+        with self._lock:
+            self._type[name] = mtype
+            self._help[name] = help_str
+            self._value.setdefault(name, {})
+            if mtype == self.HISTOGRAM:
+                self._buckets[name] = tuple(buckets or SEC_BUCKETS)
+
+    @staticmethod
+    def _key(labels):
+        if not labels:
+            return ()
+        return tuple(sorted(labels.items()))
+
+    def inc(self, name, labels=None, value=1):
+        key = self._key(labels)
+        with self._lock:
+            v = self._value[name]
+            v[key] = v.get(key, 0) + value
+
+    def set(self, name, value, labels=None):
+        key = self._key(labels)
+        with self._lock:
+            self._value[name][key] = value
+
+    def observe(self, name, value, labels=None):
+        key = self._key(labels)
+        with self._lock:
+            v = self._value[name]
+            if key not in v:
+                # [counts per bucket, sum, count]
+                v[key] = [[0] * len(self._buckets[name]), 0, 0]
+            h = v[key]
+            i = bisect.bisect_left(self._buckets[name], value)
+            if i < len(h[0]):
+                h[0][i] += 1
+            h[1] += value
+            h[2] += 1
+
+    def timer(self, name, labels=None):
+        """
+        with metrics.timer('ytbg_xxx_seconds', {..}):
+            ...
+        """
+        return _Timer(self, name, labels)
+
+    @staticmethod
+    def _labels_str(key, extra=None):
+        items = list(key)
+        if extra is not None:
+            items.append(extra)
+        if len(items) == 0:
+            return ''
+        return '{%s}' % ','.join(
+            '%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+            for k, v in items)
+
+    def render(self):
+        """
+        Returns
+        -------
+        text: str
+            Prometheus text exposition format
+        """
+        lines = []
+        with self._lock:
+            for name in sorted(self._type):
+                lines.append('# HELP %s %s' % (name, self._help[name]))
+                lines.append('# TYPE %s %s' % (name, self._type[name]))
+                values = self._value[name]
+
+                if self._type[name] != self.HISTOGRAM:
+                    for key in sorted(values):
+                        lines.append('%s%s %s' % (
+                            name, self._labels_str(key), values[key]))
+                    continue
+
+                for key in sorted(values):
+                    [counts, h_sum, h_count] = values[key]
+                    acc = 0
+                    for le, c in zip(self._buckets[name], counts):
+                        acc += c
+                        lines.append('%s_bucket%s %d' % (
+                            name, self._labels_str(key, ('le', le)), acc))
+                    lines.append('%s_bucket%s %d' % (
+                        name, self._labels_str(key, ('le', '+Inf')),
+                        h_count))
+                    lines.append('%s_sum%s %s' % (
+                        name, self._labels_str(key), h_sum))
+                    lines.append('%s_count%s %d' % (
+                        name, self._labels_str(key), h_count))
+        return '\n'.join(lines) + '\n'
+
+
+class _Timer:
+    def __init__(self, m, name, labels):
+        self._m = m
+        self._name = name
+        self._labels = labels
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self._m.observe(self._name, time.perf_counter() - self._t0,
+                        self._labels)
+        return False
+
+
+metrics = Metrics()
+
+metrics.define('ytbg_messages_total', Metrics.COUNTER,
+               'Socket.IO json messages handled, by board and type')
+metrics.define('ytbg_message_seconds', Metrics.HISTOGRAM,
+               'Handling time of json messages, by type', SEC_BUCKETS)
+metrics.define('ytbg_save_seconds', Metrics.HISTOGRAM,
+               'Time to persist history (save_data / journal append)',
+               SEC_BUCKETS)
+metrics.define('ytbg_save_bytes', Metrics.HISTOGRAM,
+               'Bytes written per persist operation', BYTES_BUCKETS)
+metrics.define('ytbg_save_bytes_total', Metrics.COUNTER,
+               'Bytes written to history storage')
+metrics.define('ytbg_load_seconds', Metrics.HISTOGRAM,
+               'Time to load history at startup', SEC_BUCKETS)
+metrics.define('ytbg_broadcast_total', Metrics.COUNTER,
+               'Messages broadcast to the clients of a board')
+metrics.define('ytbg_broadcast_fanout', Metrics.HISTOGRAM,
+               'Number of clients per broadcast', FANOUT_BUCKETS)
+metrics.define('ytbg_spectator_flush_total', Metrics.COUNTER,
+               'Coalesced updates sent to the spectators of a board')
+metrics.define('ytbg_spectator_fanout', Metrics.HISTOGRAM,
+               'Number of spectators per coalesced update', FANOUT_BUCKETS)
+metrics.define('ytbg_clients', Metrics.GAUGE,
+               'Connected clients')
+metrics.define('ytbg_history_entries', Metrics.GAUGE,
+               'History entries (hist_n)')
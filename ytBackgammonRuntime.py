@@ -0,0 +1,140 @@
+#
+# (c) Yoichi Tanibayashi
+#
+"""
+ytBackgammonRuntime.py
+
+Server runtime (async mode of Flask-SocketIO):
+
+  threading  Werkzeug threaded server (long polling only)
+  eventlet   green threads, WebSocket
+  gevent     green threads, WebSocket (with gevent-websocket)
+
+For eventlet and gevent, the blocking calls of the standard library
+(socket, time.sleep, threading ..) are monkey patched, so the boards
+(locks, writer thread, clock scheduler ..) run as they are.
+The patch must come before any other import:
+
+  import sys
+  from ytBackgammonRuntime import monkey_patch, arg_async_mode
+  if __name__ == "__main__":
+      monkey_patch(arg_async_mode(sys.argv[1:]))
+
+This module imports nothing else for that reason.
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__   = '2020/05'
+
+ASYNC_MODE_AUTO = 'auto'
+ASYNC_MODE_THREADING = 'threading'
+ASYNC_MODE_EVENTLET = 'eventlet'
+ASYNC_MODE_GEVENT = 'gevent'
+ASYNC_MODE_LIST = [ASYNC_MODE_AUTO, ASYNC_MODE_THREADING,
+                   ASYNC_MODE_EVENTLET, ASYNC_MODE_GEVENT]
+
+ARG_ASYNC_MODE = ['-M', '--async_mode']
+
+# async mode already patched (None: not yet)
+_patched = None
+
+
+def arg_async_mode(argv):
+    """
+    async mode in the command line, before click parses it
+
+    Parameters
+    ----------
+    argv: list of str
+
+    Returns
+    -------
+    async_mode: str
+    """
+    for (i, arg) in enumerate(argv):
+        if arg == '--':
+            break
+        if arg in ARG_ASYNC_MODE and i + 1 < len(argv):
+            return argv[i + 1]
+        if arg.startswith('--async_mode='):
+            return arg.partition('=')[2]
+        if arg.startswith('-M') and len(arg) > 2:
+            return arg[2:]
+    return ASYNC_MODE_AUTO
+
+
+def select_async_mode(async_mode):
+    """
+    Parameters
+    ----------
+    async_mode: str
+        ASYNC_MODE_LIST
+
+    Returns
+    -------
+    async_mode: str
+        for 'auto', the one Flask-SocketIO would pick
+        (eventlet, gevent or threading, whichever is installed first)
+    """
+    if async_mode != ASYNC_MODE_AUTO:
+        return async_mode
+    for mode in [ASYNC_MODE_EVENTLET, ASYNC_MODE_GEVENT]:
+        try:
+            __import__(mode)
+            return mode
+        except ImportError:
+            pass
+    return ASYNC_MODE_THREADING
+
+
+def monkey_patch(async_mode):
+    """
+    make the blocking calls cooperative for eventlet / gevent
+    (once per process)
+
+    Parameters
+    ----------
+    async_mode: str
+        ASYNC_MODE_LIST
+
+    Returns
+    -------
+    async_mode: str
+        selected one
+    """
+    global _patched
+
+    async_mode = select_async_mode(async_mode)
+    if _patched is not None or async_mode not in ASYNC_MODE_LIST:
+        # click will reject an unknown one
+        return async_mode
+
+    if async_mode == ASYNC_MODE_EVENTLET:
+        import eventlet
+        eventlet.monkey_patch()
+    elif async_mode == ASYNC_MODE_GEVENT:
+        from gevent import monkey
+        monkey.patch_all()
+    _patched = async_mode
+    return async_mode
+
+
+def run_native(func, *args, **kwargs):
+    """
+    run a blocking call (CPU bound, process pool, fsync ..)
+    in a native thread for eventlet / gevent,
+    not to stop the other green threads; as it is for threading.
+
+    `func` must not take the locks of the green threads.
+
+    Returns
+    -------
+    result: object
+        of func(*args, **kwargs)
+    """
+    if _patched == ASYNC_MODE_EVENTLET:
+        from eventlet import tpool
+        return tpool.execute(func, *args, **kwargs)
+    if _patched == ASYNC_MODE_GEVENT:
+        import gevent
+        return gevent.get_hub().threadpool.apply(func, args, kwargs)
+    return func(*args, **kwargs)
@@ -8,50 +8,459 @@ ytBackgammon.py
 __author__ = 'Yoichi Tanibayashi'
 __date__   = '2020/05'
 
-from ytBackgammon import ytBackgammon
-from flask import render_template
-from flask_socketio import emit
+from ytBackgammon import ytBackgammon, ytBackgammonState, ytBackgammonRule
+from ytBackgammonHistory import ytBackgammonHistory, ytBackgammonSpill
+from ytBackgammonHistory import gameinfo_diff, gameinfo_patch
+from ytBackgammonClock import ytBackgammonClock
+from ytBackgammonMetrics import metrics
+from ytBackgammonSqlite import ytBackgammonSqlite
+from ytBackgammonRuntime import run_native
+from flask import render_template, Response
+from flask_socketio import emit, join_room
+from array import array
 import os
+import bisect
+import contextlib
 import copy
-import time
+import hashlib
 import json
-from MyLogger import get_logger
+import re
+import sqlite3
+import threading
+import time
+from MyLogger import get_logger, sample_key
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class ytBackgammonDataIndex:
+    """
+    byte offsets of the entries in a data file (version 2),
+    found without parsing JSON (see ytBackgammonServer.save_data())
+
+    Entries are parsed on demand by load_entries().
+    The Zobrist hashes ("zh") are read without parsing too,
+    for find_zhash().
+    The variations after the entries are parsed (variations).
+    """
+    RE_HEADER = re.compile(
+        rb'{\s*"version": (\d+),\s*"hist_i": (\d+),\s*"entries": \[')
+    RE_ENTRY = re.compile(rb'^    { ?"sn": ', re.M)
+    RE_ZHASH = re.compile(rb'    { ?"sn": \d+, "zh": (\d+),')
+    # keyframe: '    { "sn": ..', diff: '    {"sn": ..'
+    KEY_PREFIX = b'    { '
+    RE_VARIATIONS = re.compile(rb'\s*,\s*"variations": ')
+
+    _log = get_logger(__name__, False)
+
+    def __init__(self, path_name, debug=False):
+        """
+        Parameters
+        ----------
+        path_name: str
+            full path name of json data file
+        """
+        self._dbg = debug
+        __class__._log = get_logger(__class__.__name__, self._dbg)
+        self._log.debug('path_name=%s', path_name)
+
+        with open(path_name, 'rb') as f:
+            self._data = f.read()
+
+        m = self.RE_HEADER.match(self._data)
+        if m is None or int(m.group(1)) != 2:
+            raise ValueError('%s: not a version 2 data file' % (path_name))
+        self.hist_i = int(m.group(2))
+
+        self._off = array('q', [m_ent.start() for m_ent in
+                                self.RE_ENTRY.finditer(self._data, m.end())])
+        end = self._data.rfind(b'\n  ]')
+        if len(self._off) == 0 or end < self._off[-1]:
+            raise ValueError('%s: no entries' % (path_name))
+        self._off.append(end)
+        self._log.debug('hist_i=%s, n=%s', self.hist_i, len(self))
+
+        # see ytBackgammonHistory.dump_variations() (None: no variations)
+        self.variations = None
+        m = self.RE_VARIATIONS.match(self._data, end + len(b'\n  ]'))
+        if m is not None:
+            self.variations = json.JSONDecoder().raw_decode(
+                self._data[m.end():].decode('utf-8'))[0]
+
+        # hash -> [entry index, ..] (see find_zhash())
+        self._zindex = None
+
+    def __len__(self):
+        return len(self._off) - 1
+
+    def is_keyframe(self, i):
+        return self._data.startswith(self.KEY_PREFIX, self._off[i])
+
+    def keyframe(self, i):
+        """
+        Returns
+        -------
+        k: int
+            index of the keyframe at or before entry i
+        """
+        while i > 0 and not self.is_keyframe(i):
+            i -= 1
+        return i
+
+    def raw(self, i):
+        """
+        Returns
+        -------
+        j_str: str
+            text of entry i, as written by hist_rec2str()
+        """
+        b = self._data[self._off[i]:self._off[i + 1]]
+        return b.decode('utf-8').rstrip(',\n ') + ',\n'
+
+    def load_entries(self, i, n):
+        """
+        loader of ytBackgammonHistory.set_loader()
+
+        Parameters
+        ----------
+        i: int
+            first entry needed
+        n: int
+            end of entries
+
+        Returns
+        -------
+        i0: int
+            keyframe at or before i
+        entries: list of dict
+            entries[i0:n]
+        """
+        i0 = self.keyframe(i)
+        self._log.debug('i=%s, n=%s: i0=%s', i, n, i0)
+        entries = [json.loads(self.raw(k).rstrip(',\n'))
+                   for k in range(i0, n)]
+        for ent in entries:
+            ent.pop('zh', None)
+        return i0, entries
+
+    def find_zhash(self, zh, n):
+        """
+        hash lookup of ytBackgammonHistory.set_loader()
+
+        Parameters
+        ----------
+        zh: int
+            Zobrist hash
+        n: int
+            end of entries
+
+        Returns
+        -------
+        indexes: list of int
+            entries (< n) with the hash, in ascending order.
+            None: some entries have no hash (written by an old version)
+        """
+        if self._zindex is None:
+            self._zindex = {}
+            for i in range(len(self)):
+                m = self.RE_ZHASH.match(self._data, self._off[i])
+                if m is None:
+                    self._log.debug('%s: no hash', i)
+                    self._zindex = False
+                    break
+                self._zindex.setdefault(int(m.group(1)), []).append(i)
+        if self._zindex is False:
+            return None
+
+        idx = self._zindex.get(zh, [])
+        return idx[:bisect.bisect_left(idx, n)]
 
 
 class ytBackgammonServer:
     DATAFILE_DIR = os.getenv('HOME')
     DATAFILE_NAME = 'ytbg'
+    DATAFILE_VERSION = 2
+    JOURNAL_EXT = 'jsonl'
+    SQLITE_EXT = 'sqlite3'
     SEC_CHECKER_MOVE = 0.2
 
+    STORAGE_JSON = 'json'
+    STORAGE_JOURNAL = 'journal'
+    STORAGE_SQLITE = 'sqlite'
+    STORAGE_LIST = [STORAGE_JSON, STORAGE_JOURNAL, STORAGE_SQLITE]
+
+    # message format, selected by each client on connect (?fmt=..)
+    FMT_JSON = 'json'
+    FMT_MSGPACK = 'msgpack'
+    # room of the msgpack clients: svr_id + ROOM_MSGPACK
+    ROOM_MSGPACK = '/msgpack'
+
+    # client role, selected on connect (?role=..)
+    ROLE_PLAYER = 'player'
+    ROLE_SPECTATOR = 'spectator'
+    # room of the spectators: svr_id + ROOM_SPECTATOR (+ ROOM_MSGPACK)
+    ROOM_SPECTATOR = '/watch'
+    # updates/sec to spectators
+    DEF_SPECTATOR_RATE = 4.0
+    # broadcast messages sent to spectators as they are
+    # (the latest one per type and player),
+    # the others are covered by a gameinfo snapshot
+    SPECTATOR_MSG_TYPES = ['set_clock_switch', 'set_clock_limit',
+                           'set_player_clock', 'resume_clock', 'start_clock',
+                           'stop_clock', 'reset_clock', 'clock_timeout']
+
+    REPLAY_MSG_TYPES = ['back', 'back2', 'back_all', 'fwd', 'fwd2', 'fwd_all']
+    PASSIVE_MSG_TYPES = ['resync', 'hint', 'branches']
+    N_HINT = 3
+
     _log = get_logger(__name__, False)
 
-    def __init__(self, svr_name, svr_ver, svr_id, image_dir, debug=False):
+    def __init__(self, svr_name, svr_ver, svr_id, image_dir,
+                 storage=STORAGE_JSON, compact=False, rule=False,
+                 lazy=0, max_hist=0, writer=None, socketio=None,
+                 clock_scheduler=None, evaluator=None,
+                 fanout_scheduler=None, spectator_rate=DEF_SPECTATOR_RATE,
+                 cluster=False, debug=False):
         self._dbg = debug
         __class__._log = get_logger(__class__.__name__, self._dbg)
         self._log.debug('svr_name=%s, svr_ver=%s, svr_id=%s, image_dir=%s',
                         svr_name, svr_ver, svr_id, image_dir)
+        self._log.debug('storage=%s, compact=%s, rule=%s, lazy=%s',
+                        storage, compact, rule, lazy)
+        self._log.debug('max_hist=%s, spectator_rate=%s, cluster=%s',
+                        max_hist, spectator_rate, cluster)
+
+        if storage not in self.STORAGE_LIST:
+            raise ValueError('storage=%s: must be one of %s' % (
+                storage, self.STORAGE_LIST))
+        if cluster and storage != self.STORAGE_SQLITE:
+            raise ValueError('cluster: storage must be %s' % (
+                self.STORAGE_SQLITE))
 
         self._svr_name = svr_name
         self._svr_ver = svr_ver
         self._svr_id = svr_id
         self._image_dir = image_dir
+        self._storage = storage
+        self._sio = socketio
 
         self._datafile_path = '%s/%s-%s.json' % (
             self.DATAFILE_DIR, self.DATAFILE_NAME, self._svr_id)
         self._log.debug('_datafile_path=%s', self._datafile_path)
+        self._journal_path = '%s/%s-%s.%s' % (
+            self.DATAFILE_DIR, self.DATAFILE_NAME, self._svr_id,
+            self.JOURNAL_EXT)
+        self._log.debug('_journal_path=%s', self._journal_path)
+        # shared by all boards
+        self._sqlite_path = '%s/%s.%s' % (
+            self.DATAFILE_DIR, self.DATAFILE_NAME, self.SQLITE_EXT)
+        self._log.debug('_sqlite_path=%s', self._sqlite_path)
+        self._db = None
 
         self._client_sid = []
-        self._history = []
-        self._fwd_hist = []
+        # sids of the msgpack clients
+        self._msgpack_sid = set()
+        # sids whose last move was rejected (see handle_json())
+        self._rejected_sid = set()
+
+        # spectators: coalesced updates by the fan-out task
+        # (fanout_scheduler is None or spectator_rate <= 0: immediate)
+        self._spectator_sid = set()
+        self._fanout = fanout_scheduler
+        self._spectator_rate = spectator_rate
+        self._spec_lock = threading.Lock()
+        # a gameinfo snapshot is to be sent
+        self._spec_dirty = False
+        # (type, player) -> latest message, in the order of arrival
+        self._spec_msgs = {}
+        self._spec_timer = None
+        self._spec_t = 0
+
+        # rendered index.html (see app_index())
+        self._index_html = None
+        self._index_etag = None
+
+        # > 0: history entries in memory, the others are spilled to disk
+        self._max_hist = max_hist
+        self._spill = None
+        self._hist = self.new_history()
+
+        # > 0: load only the last `lazy` entries before the cursor
+        # at startup, the older ones on demand
+        self._lazy = lazy
+        # ytBackgammonDataIndex of entries not loaded yet
+        self._data_index = None
+
+        # ytBackgammonWriter (None: write in the handler)
+        self._writer = writer
+        # records not written yet (journal, sqlite)
+        self._pending = []
+        self._flush_lock = threading.Lock()
         self._cur_sn = 0
 
-        self._bg = ytBackgammon(self._svr_ver, debug=self._dbg)
-        self._repeat_flag = False
+        self._bg = ytBackgammon(self._svr_ver, compact=compact,
+                                debug=self._dbg)
+        self._clock = ytBackgammonClock(self._bg, clock_scheduler,
+                                        self.on_clock_event,
+                                        debug=self._dbg)
+        self._lock = threading.RLock()
+        self._replay_cancel = None
+
+        # cluster mode: the board is shared with the other workers
+        # through the database, see board_lock()
+        self._cluster = cluster
+        self._lock_depth = 0
+        # revision of the shared state, and of the history in it
+        self._rev = 0
+        self._hist_rev = None
+        self._hist_changed = False
+
+        # server side move check (None: accept any move)
+        self._rule = None
+        if rule:
+            self._rule = ytBackgammonRule(debug=self._dbg)
+
+        # ytBackgammonEval for move hints (None: disabled)
+        self._eval = evaluator
+
+        # last broadcast gameinfo and its sequence number
+        self._bcast_seq = 0
+        self._bcast_gameinfo = None
+
+        self._m_labels = {'board': self._svr_id}
+        t0 = time.perf_counter()
+
+        if self._storage == self.STORAGE_JOURNAL:
+            [hist_len, fwd_hist_len] = self.load_journal(self._journal_path)
+            if hist_len < 1:
+                # migrate from JSON data file, if any
+                [hist_len, fwd_hist_len] = self.load_data(
+                    self._datafile_path)
+            if hist_len > 0:
+                self.compact_journal(self._journal_path)
+        elif self._storage == self.STORAGE_SQLITE:
+            self._db = ytBackgammonSqlite(self._sqlite_path, self._svr_id,
+                                          debug=self._dbg)
+            [hist_len, fwd_hist_len] = self.load_sqlite()
+            if hist_len < 1:
+                # migrate from JSON data file, if any
+                [hist_len, fwd_hist_len] = self.load_data(
+                    self._datafile_path)
+                if hist_len > 0:
+                    self._db.replace(self._hist)
+        else:
+            [hist_len, fwd_hist_len] = self.load_data(self._datafile_path)
+
+        metrics.observe('ytbg_load_seconds', time.perf_counter() - t0,
+                        self._m_labels)
 
-        [hist_len, fwd_hist_len] = self.load_data(self._datafile_path)
         if hist_len < 1:
-            self._log.warning('load_data(%s): error', self._datafile_path)
-            self.add_history(self._bg._gameinfo)
+            self._log.warning('load data: error')
+            self.add_history(self._bg.state)
+
+        if self._cluster:
+            # take over the shared state, or start it
+            with self.board_lock():
+                pass
+
+    @contextlib.contextmanager
+    def board_lock(self, write=True):
+        """
+        lock the board (self._lock).
+
+        In cluster mode, the outermost one is also a transaction
+        of the shared database: the state of the board is brought
+        up to date before, and saved after (see load_state()).
+
+        Parameters
+        ----------
+        write: bool
+            False: only bring the state up to date
+        """
+        with self._lock:
+            if not self._cluster or self._lock_depth > 0:
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                return
+
+            self._lock_depth += 1
+            try:
+                if write:
+                    self._db.begin()
+                self.load_state()
+                yield
+                if write:
+                    self.save_state()
+                    self._db.commit()
+            except BaseException:
+                if write:
+                    self._db.rollback()
+                # to be reloaded, with the history
+                self._rev = -1
+                self._hist_rev = None
+                self._hist_changed = False
+                raise
+            finally:
+                self._lock_depth -= 1
+
+    def load_state(self):
+        """
+        load the state of the board written by another worker (cluster)
+        """
+        [rev, state] = self._db.get_state()
+        if rev == self._rev:
+            return
+        self._log.debug('rev=%s -> %s', self._rev, rev)
+
+        if state is not None:
+            if state['hist_rev'] != self._hist_rev:
+                self.load_sqlite()
+                self._hist_rev = state['hist_rev']
+            self._bg.gameinfo = state['gameinfo']
+            self._cur_sn = state['cur_sn']
+            self._bcast_seq = state['bcast_seq']
+            self._bcast_gameinfo = state['bcast_gameinfo']
+            self._clock.set_state(state['clock'])
+        self._rev = rev
+
+    def save_state(self):
+        """
+        save the state of the board for the other workers (cluster)
+        """
+        if self._hist_changed or self._hist_rev is None:
+            self._hist_rev = (self._hist_rev or 0) + 1
+            self._hist_changed = False
+        self._rev += 1
+        self._db.put_state(self._rev, {
+            'hist_rev': self._hist_rev,
+            'gameinfo': self._bg.gameinfo,
+            'cur_sn': self._cur_sn,
+            'bcast_seq': self._bcast_seq,
+            'bcast_gameinfo': self._bcast_gameinfo,
+            'clock': self._clock.get_state()
+        })
+
+    def new_history(self):
+        """
+        Returns
+        -------
+        hist: ytBackgammonHistory
+            empty
+        """
+        if self._max_hist <= 0:
+            return ytBackgammonHistory(debug=self._dbg)
+
+        if self._spill is not None:
+            self._spill.close()
+        self._spill = ytBackgammonSpill(self.DATAFILE_DIR, debug=self._dbg)
+        return ytBackgammonHistory(max_entries=self._max_hist,
+                                   spill=self._spill, debug=self._dbg)
 
     def new_game(self):
         """
@@ -59,143 +468,507 @@ class ytBackgammonServer:
         """
         self._log.debug('')
 
-        score0 = self._bg._gameinfo['score'][0]
-        score1 = self._bg._gameinfo['score'][1]
-        player0_name = self._bg._gameinfo['board']['playername'][0]
-        player1_name = self._bg._gameinfo['board']['playername'][1]
-        clock_limit0 = self._bg._gameinfo['clock_limit'][0]
-        clock_limit1 = self._bg._gameinfo['clock_limit'][1]
+        gameinfo = self._bg.gameinfo
+        score = list(gameinfo['score'])
+        playername = list(gameinfo['board']['playername'])
+        clock_limit = list(gameinfo['clock_limit'])
 
+        self._clock.stop_all()
         self._bg.init_gameinfo()
+        self._bg.set_game_num(gameinfo['game_num'] + 1)
 
-        self._bg._gameinfo['score'][0] = score0;
-        self._bg._gameinfo['score'][1] = score1;
-        self._bg._gameinfo['clock_limit'][0] = clock_limit0
-        self._bg._gameinfo['clock_limit'][1] = clock_limit1
-        self._bg._gameinfo['board']['playername'][0] = player0_name
-        self._bg._gameinfo['board']['playername'][1] = player1_name
-        
-        self.add_history(self._bg._gameinfo)
+        for i in range(2):
+            self._bg.set_score({'player': i, 'score': score[i]})
+            self._bg.set_clock_limit({'index': i,
+                                      'clock_limit': clock_limit[i]})
+            self._bg.set_playername({'player': i, 'name': playername[i]})
 
-    def add_history(self, gameinfo=None):
-        self._log.debug('gameinfo=%s', gameinfo)
+        self.add_history(self._bg.state)
 
+    def add_history(self, gameinfo=None):
         if gameinfo is not None:
-            self._fwd_hist = []
-            if len(self._history) == 0:
+            self._clock.sync()
+            if self._hist.hist_i == 0:
                 self._cur_sn = 1
             else:
-                self._cur_sn = self._history[-1]['sn'] + 1
+                self._cur_sn = self._hist.sn(self._hist.hist_i - 1) + 1
+
+            if isinstance(gameinfo, ytBackgammonState):
+                gameinfo.sn = self._cur_sn
+            else:
+                gameinfo['sn'] = self._cur_sn
+            ent = self._hist.add(gameinfo)
+            self.save_variations()
+            if self._storage == self.STORAGE_JOURNAL:
+                rec = {'op': 'add'}
+                rec.update(ent)
+                self._pending.append(rec)
+            elif self._storage == self.STORAGE_SQLITE:
+                i = self._hist.hist_i - 1
+                self._pending.append(('add', i, ent, self._hist.zhash(i)))
+            self.persist()
+            # not gameinfo: the live state, changed by the next message
+            self._log.debug('sn=%d, history=(%d)',
+                            self._cur_sn, len(self._hist))
+            metrics.set('ytbg_history_entries', len(self._hist),
+                        self._m_labels)
+
+    def save_cursor(self):
+        """
+        save the history cursor after backward/forward
+        """
+        if self._storage == self.STORAGE_JOURNAL:
+            self._pending.append({'op': 'cursor',
+                                  'hist_i': self._hist.hist_i})
+        elif self._storage == self.STORAGE_SQLITE:
+            self._pending.append(('cursor', self._hist.hist_i))
+        self.persist()
+
+    def save_variations(self):
+        """
+        save the changes of the variations (SQLite),
+        the journal replays them from the records of the entries
+        and the JSON data file has all of them
+        """
+        changes = self._hist.take_var_changes()
+        if self._storage == self.STORAGE_SQLITE:
+            self._pending.extend(changes)
+
+    def persist(self):
+        """
+        write the changes now, or let the writer thread write them
+        """
+        if self._writer is None:
+            self.flush()
+        else:
+            self._writer.mark(self)
+
+    def flush(self):
+        """
+        write the pending changes (called by ytBackgammonWriter)
+        """
+        with self._flush_lock:
+            with self._lock:
+                if self._storage == self.STORAGE_JSON:
+                    j_str = self.dump_data()
+                else:
+                    pending = self._pending
+                    self._pending = []
+
+            if self._storage == self.STORAGE_JSON:
+                self.write_data(self._datafile_path, j_str)
+            elif len(pending) == 0:
+                return
+            elif self._storage == self.STORAGE_JOURNAL:
+                self.append_journal(self._journal_path, pending)
+            else:
+                self.save_sqlite(pending)
+
+    def emit_json(self, msg, room=None):
+        """
+        send message to the clients of this board
+
+        Parameters
+        ----------
+        msg: dict
+        room: str
+            None: all clients of this board, sid: one client
+        """
+        if room is None or room == self._svr_id:
+            metrics.inc('ytbg_broadcast_total', self._m_labels)
+            metrics.observe('ytbg_broadcast_fanout',
+                            len(self._client_sid) - len(self._spectator_sid),
+                            self._m_labels)
+
+            # encoded once for all msgpack clients
+            self.emit_event('json', msg, self._svr_id)
+            # cluster: the clients may be in the other workers
+            if len(self._msgpack_sid) > 0 or self._cluster:
+                self.emit_event(self.FMT_MSGPACK, self.pack(msg),
+                                self._svr_id + self.ROOM_MSGPACK)
+
+            if len(self._spectator_sid) > 0 or self._cluster:
+                self.queue_spectator(msg)
+            return
+
+        if room in self._msgpack_sid:
+            self.emit_event(self.FMT_MSGPACK, self.pack(msg), room)
+        else:
+            self.emit_event('json', msg, room)
+
+    def queue_spectator(self, msg):
+        """
+        coalesce a broadcast message for the spectators,
+        sent by flush_spectator() at most spectator_rate times/sec
+
+        Parameters
+        ----------
+        msg: dict
+        """
+        with self._spec_lock:
+            if msg['type'] in self.SPECTATOR_MSG_TYPES:
+                data = msg.get('data')
+                key = (msg['type'],
+                       data.get('player') if isinstance(data, dict) else None)
+                # move to the end
+                self._spec_msgs.pop(key, None)
+                self._spec_msgs[key] = msg
+            else:
+                self._spec_dirty = True
+
+            if self._spec_timer is not None:
+                return
+
+            if self._fanout is not None and self._spectator_rate > 0:
+                t = max(time.monotonic(),
+                        self._spec_t + 1 / self._spectator_rate)
+                self._spec_timer = self._fanout.schedule(
+                    t, self.flush_spectator)
+                return
+
+        self.flush_spectator()
+
+    def flush_spectator(self):
+        """
+        send the coalesced updates to the spectators
+        (called in the fan-out task)
+        """
+        with self._spec_lock:
+            self._spec_timer = None
+            self._spec_t = time.monotonic()
+            dirty = self._spec_dirty
+            msgs = list(self._spec_msgs.values())
+            self._spec_dirty = False
+            self._spec_msgs = {}
+
+        if dirty:
+            # latest state wins
+            with self.board_lock(write=False):
+                msgs.insert(0, {
+                    'src': 'server', 'dst': 'spectator', 'type': 'gameinfo',
+                    'data': {
+                        'gameinfo': copy.deepcopy(self._bg.gameinfo),
+                        'seq': self._bcast_seq,
+                        'sec': 0,
+                        'hist_i': self._hist.hist_i,
+                        'hist_n': len(self._hist),
+                        'history_flag': False
+                    }
+                })
+
+        room = self._svr_id + self.ROOM_SPECTATOR
+        msgpack_n = len(self._spectator_sid & self._msgpack_sid)
+        if self._cluster:
+            msgpack_n = 1
+        metrics.inc('ytbg_spectator_flush_total', self._m_labels)
+        metrics.observe('ytbg_spectator_fanout', len(self._spectator_sid),
+                        self._m_labels)
+        for msg in msgs:
+            self.emit_event('json', msg, room)
+            if msgpack_n > 0:
+                self.emit_event(self.FMT_MSGPACK, self.pack(msg),
+                                room + self.ROOM_MSGPACK)
+
+    def emit_event(self, event, data, room):
+        # a client of this worker: not through the message queue
+        # (cluster mode), which is listened to only after the first
+        # client has connected
+        ignore_queue = room in self._client_sid
+        if self._sio is not None:
+            # works outside of request context (background task)
+            self._sio.emit(event, data, room=room, ignore_queue=ignore_queue)
+        else:
+            emit(event, data, room=room, ignore_queue=ignore_queue)
+
+    @staticmethod
+    def pack(msg):
+        """
+        Parameters
+        ----------
+        msg: dict
 
-            gameinfo['sn'] = self._cur_sn
-            self._history.append(copy.deepcopy(gameinfo))
-            self.save_data(self._datafile_path)
-            self._log.debug('history=(%d)', len(self._history))
+        Returns
+        -------
+        data: bytes
+            MessagePack
+        """
+        return msgpack.packb(msg, use_bin_type=True)
 
     def emit_gameinfo(self, sec=0, history_flag=False):
         """
-        send game information to all clients
+        send game information to all clients,
+        as a patch against the last broadcast
+
+        msg.data := {
+            'base_seq': int, 'seq': int, 'patch': [[path, value], ..],
+            'sec': int, 'hist_i': int, 'hist_n': int, 'history_flag': bool
+        }
+
+        Parameters
+        ----------
+        sec: int
+            for animation
+        """
+        gameinfo = self._bg.gameinfo
+        if self._bcast_gameinfo is None:
+            self._bcast_gameinfo = copy.deepcopy(gameinfo)
+            self._bcast_seq += 1
+            self.emit_gameinfo_full(sec, history_flag, room=self._svr_id)
+            return
+
+        patch = gameinfo_diff(self._bcast_gameinfo, gameinfo)
+        self._bcast_gameinfo = gameinfo_patch(self._bcast_gameinfo, patch)
+        self._bcast_seq += 1
+
+        self.emit_json({
+            'src': 'server', 'dst': 'all', 'type': 'gameinfo_patch',
+            'data': {
+                'base_seq': self._bcast_seq - 1,
+                'seq': self._bcast_seq,
+                'patch': patch,
+                'sec': sec,
+                'hist_i': self._hist.hist_i,
+                'hist_n': len(self._hist),
+                'history_flag': history_flag
+            }
+        })
+
+    def emit_gameinfo_full(self, sec=0, history_flag=False, room=None):
+        """
+        send the whole game information to one client (resync)
+
+        The last broadcast must be up to date, see sync_gameinfo().
 
         Parameters
         ----------
         sec: int
             for animation
+        room: str
+            sid
         """
-        emit('json',
-             {
-                 'src': 'server', 'dst': 'all', 'type': 'gameinfo',
-                 'data': {
-                     'gameinfo': self._bg._gameinfo,
-                     'sec': sec,
-                     'hist_i': len(self._history),
-                     'hist_n': len(self._history) + len(self._fwd_hist),
-                     'history_flag': history_flag
-                 }
-             }, broadcast=True)
+        self.emit_json({
+            'src': 'server', 'dst': room, 'type': 'gameinfo',
+            'data': {
+                'gameinfo': self._bcast_gameinfo,
+                'seq': self._bcast_seq,
+                'sec': sec,
+                'hist_i': self._hist.hist_i,
+                'hist_n': len(self._hist),
+                'history_flag': history_flag
+            }
+        }, room=room)
+
+    def sync_gameinfo(self):
+        """
+        bring the last broadcast up to date with the current gameinfo,
+        broadcasting a patch only when something has changed
+        """
+        if self._bcast_gameinfo is None:
+            self._bcast_gameinfo = copy.deepcopy(self._bg.gameinfo)
+            self._bcast_seq += 1
+            return
+
+        if gameinfo_diff(self._bcast_gameinfo, self._bg.gameinfo):
+            self.emit_gameinfo(0)
 
     def backward_hist(self, n=1, sleep_sec=0.1):
         """
-        backward history
+        backward history (runs in background)
 
         Parameters
         ----------
         n : int
-            < 0: all
+            0: all
         sleep_sec : float
             sleep seconds
         """
         self._log.debug('n=%d, sleep_sec=%s', n, sleep_sec)
+        # self._hist may be reloaded (cluster)
+        self.start_replay(lambda: self._hist.backward(),
+                          lambda: self._hist.hist_i > 1, n, sleep_sec)
 
-        count = 0
-        sec = self.SEC_CHECKER_MOVE
-        if n == 0:
-            sec = 0.1
+    def forward_hist(self, n=1, sleep_sec=0.1):
+        """
+        forward history (runs in background)
 
-        while self._repeat_flag:
-            self._repeat_flag = False
-            time.sleep(.5)
+        Parameters
+        ----------
+        n : int
+            0: all
+        sleep_sec : float
+            sleep seconds
+        """
+        self._log.debug('n=%s, sleep_sec=%s', n, sleep_sec)
+        self.start_replay(lambda: self._hist.forward(),
+                          lambda: self._hist.hist_i < len(self._hist),
+                          n, sleep_sec)
+
+    def seek_hist(self, hist_i, sec=0):
+        """
+        move the history cursor directly and send only the final state
 
-        self._repeat_flag = True
-        while len(self._history) > 1 and self._repeat_flag:
-            self._fwd_hist.append(self._history.pop())
-            self._bg._gameinfo = copy.deepcopy(self._history[-1])
+        Parameters
+        ----------
+        hist_i: int
+            1: first, < 0: from the end (-1: last)
+        sec: float
+            for animation
+        """
+        self._log.debug('hist_i=%s, sec=%s', hist_i, sec)
 
-            self._log.debug('_history=(%d), _fwd_hist=(%d)',
-                            len(self._history), len(self._fwd_hist))
+        if hist_i < 0:
+            hist_i += len(self._hist) + 1
 
-            self.emit_gameinfo(sec, history_flag=True)
+        self._bg.gameinfo = self._hist.set_cursor(hist_i)
+        self._log.debug('hist_i=%d, hist_n=%d',
+                        self._hist.hist_i, len(self._hist))
 
-            count += 1
-            if n > 0 and count >= n:
-                break
+        self.emit_gameinfo(sec, history_flag=True)
+        self.save_cursor()
 
-            time.sleep(sleep_sec)
+    def emit_branches(self, sid):
+        """
+        send the variations of the history to one client
 
-        self._repeat_flag = False
-        self.save_data(self._datafile_path)
-        return
+        Parameters
+        ----------
+        sid: str
+        """
+        self.emit_json({'src': 'server', 'type': 'branches',
+                        'data': {'current': self._hist.var_id,
+                                 'branches': self._hist.variations()},
+                        'history': False}, room=sid)
 
-    def forward_hist(self, n=1, sleep_sec=0.1):
+    def switch_branch(self, var_id, sec=0):
         """
-        forward history
+        make another variation the current history,
+        the cursor is set just after the fork
 
         Parameters
         ----------
+        var_id: int
+        sec: float
+            for animation
+
+        Returns
+        -------
+        result: bool
+            False: no such variation
+        """
+        self._log.debug('var_id=%s', var_id)
+        try:
+            fork = self._hist.switch_variation(var_id)
+        except KeyError as e:
+            self._log.warning('%s:%s.', type(e).__name__, e)
+            return False
+
+        # entries[fork:] have been replaced
+        self.save_variations()
+        if self._storage == self.STORAGE_JOURNAL:
+            self._pending.append({'op': 'switch', 'id': var_id})
+        elif self._storage == self.STORAGE_SQLITE:
+            for i in range(fork, len(self._hist)):
+                self._pending.append(('add', i, self._hist.entry(i),
+                                      self._hist.zhash(i)))
+
+        self.seek_hist(fork + 1, sec)
+        return True
+
+    def seek_same_position(self, sec=0):
+        """
+        jump to the last time the current position occurred
+
+        Parameters
+        ----------
+        sec: float
+            for animation
+
+        Returns
+        -------
+        result: bool
+            False: not found
+        """
+        i = self._hist.last_position(self._hist.hist_i - 1)
+        self._log.debug('i=%s', i)
+        if i is None:
+            return False
+
+        self.seek_hist(i + 1, sec)
+        return True
+
+    def start_replay(self, step, can_step, n, sleep_sec):
+        """
+        cancel the running replay and start a new one
+
+        Without socketio, the replay runs synchronously.
+
+        Parameters
+        ----------
+        step: function
+            move the history cursor, return new gameinfo
+        can_step: function
+            return False at the end of history
         n : int
-            < 0: all
+            0: all
         sleep_sec : float
             sleep seconds
         """
-        self._log.debug('n=%s, sleep_sec=%s', n, sleep_sec)
+        self.cancel_replay()
 
-        count = 0
+        cancel = threading.Event()
+        self._replay_cancel = cancel
+
+        if self._sio is None:
+            self.replay(step, can_step, n, sleep_sec, cancel)
+            return
+
+        self._sio.start_background_task(self.replay, step, can_step,
+                                        n, sleep_sec, cancel)
+
+    def cancel_replay(self):
+        """
+        cancel the running replay, if any
+        """
+        if self._replay_cancel is not None:
+            self._log.debug('cancel')
+            self._replay_cancel.set()
+            self._replay_cancel = None
+
+    def replay(self, step, can_step, n, sleep_sec, cancel):
+        """
+        replay task: see start_replay()
+
+        Parameters
+        ----------
+        cancel: threading.Event
+            set to stop this replay
+        """
         sec = self.SEC_CHECKER_MOVE
         if n == 0:
             sec = 0.1
 
-        while self._repeat_flag:
-            self._repeat_flag = False
-            time.sleep(.5)
-
-        self._repeat_flag = True
-        while len(self._fwd_hist) > 0 and self._repeat_flag:
-            self._history.append(self._fwd_hist.pop())
-            self._bg._gameinfo = copy.deepcopy(self._history[-1])
+        count = 0
+        try:
+            while not cancel.is_set():
+                with self.board_lock():
+                    if cancel.is_set() or not can_step():
+                        break
 
-            self._log.debug('_history=(%d), _fwd_hist=(%d)',
-                            len(self._history), len(self._fwd_hist))
+                    self._bg.gameinfo = step()
 
-            self.emit_gameinfo(sec, history_flag=True)
+                    self._log.debug('hist_i=%d, hist_n=%d',
+                                    self._hist.hist_i, len(self._hist))
 
-            count += 1
-            if n > 0 and count >= n:
-                break
+                    self.emit_gameinfo(sec, history_flag=True)
 
-            time.sleep(sleep_sec)
+                count += 1
+                if n > 0 and count >= n:
+                    break
 
-        self._repeat_flag = False
-        self.save_data(self._datafile_path)
-        return
+                cancel.wait(sleep_sec)
+        finally:
+            with self.board_lock():
+                self.save_cursor()
 
     def hist_ent2str(self, h):
         j_str = ''
@@ -219,6 +992,8 @@ class ytBackgammonServer:
         j_str += '"accepted": %s },\n' % json.dumps(
             h['board']['cube']['accepted'])
         j_str += '        "dice": %s,\n' % h['board']['dice']
+        j_str += '        "roll": %s,\n' % json.dumps(
+            h['board'].get('roll', False))
         j_str += '        "checker": [\n'
         j_str += '          %s,\n' % h['board']['checker'][0]
         j_str += '          %s \n' % h['board']['checker'][1]
@@ -227,6 +1002,28 @@ class ytBackgammonServer:
         j_str += '    },\n'
         return j_str
 
+    def hist_rec2str(self, ent, zh=None):
+        """
+        Parameters
+        ----------
+        ent: dict
+            encoded history entry (keyframe or diff)
+        zh: int
+            Zobrist hash of the entry (None: not written)
+        """
+        if 'diff' in ent:
+            if zh is not None:
+                ent = {'sn': ent['sn'], 'zh': zh, 'diff': ent['diff']}
+            return '    %s,\n' % json.dumps(ent, ensure_ascii=False)
+
+        if zh is None:
+            j_str = '    { "sn": %d, "key":\n' % ent['sn']
+        else:
+            j_str = '    { "sn": %d, "zh": %d, "key":\n' % (ent['sn'], zh)
+        j_str += self.hist_ent2str(ent['key']).rstrip(',\n') + '\n'
+        j_str += '    },\n'
+        return j_str
+
     def save_data(self, path_name):
         """
         Parameters
@@ -235,30 +1032,98 @@ class ytBackgammonServer:
             full path name of json data file
         """
         self._log.debug('path_name=%s', path_name)
+        self.write_data(path_name, self.dump_data())
 
+    def dump_data(self):
+        """
+        Returns
+        -------
+        j_str: str
+            contents of json data file
+        """
         j_str = '{\n'
-        j_str += '  "history": [\n'
+        j_str += '  "version": %d,\n' % self.DATAFILE_VERSION
+        j_str += '  "hist_i": %d,\n' % self._hist.hist_i
+        j_str += '  "entries": [\n'
 
-        for h in self._history:
-            j_str += self.hist_ent2str(h)
+        for i, ent in enumerate(self._hist.iter_entries(load=False)):
+            if ent is None:
+                j_str += self._data_index.raw(i)
+            else:
+                j_str += self.hist_rec2str(ent, self._hist.zhash(i))
+        if self._hist.lazy_n == 0:
+            self._data_index = None
 
         j_str = j_str.rstrip(',\n') + '\n'
         j_str += '  ],\n'
-        j_str += '  "fwd_hist": [\n'
-
-        for h in self._fwd_hist:
-            j_str += self.hist_ent2str(h)
-
-        j_str = j_str.rstrip(',\n') + '\n'
-        j_str += '  ]\n'
+        j_str += '  "variations": %s\n' % json.dumps(
+            self._hist.dump_variations(), ensure_ascii=False)
         j_str += '}\n'
+        return j_str
+
+    def write_data(self, path_name, j_str):
+        """
+        Parameters
+        ----------
+        path_name: str
+            full path name of json data file
+        j_str: str
+            contents
+        """
+        self._log.debug('path_name=%s', path_name)
+        t0 = time.perf_counter()
 
         try:
-            with open(path_name, "w") as f:
-                f.write(j_str)
+            run_native(self.write_file, path_name, j_str)
         except Exception as e:
             self._log.warning('%s:%s.', type(e).__name__, e)
 
+        self.observe_save(t0, j_str)
+
+    def write_file(self, path_name, j_str):
+        """
+        crash safe write: temporary file, fsync and atomic rename
+        (the old file is left as it is, if this fails)
+
+        Parameters
+        ----------
+        path_name: str
+        j_str: str
+        """
+        tmp_path_name = path_name + '.tmp'
+        with open(tmp_path_name, "w") as f:
+            f.write(j_str)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path_name, path_name)
+
+        # make the rename durable
+        try:
+            fd = os.open(os.path.dirname(path_name) or '.', os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        except OSError:
+            pass
+
+    def observe_save(self, t0, j_str):
+        """
+        record time and bytes of a persist operation
+
+        Parameters
+        ----------
+        t0: float
+            time.perf_counter() at start
+        j_str: str
+            written data
+        """
+        sec = time.perf_counter() - t0
+        n_bytes = len(j_str.encode('utf-8'))
+        metrics.observe('ytbg_save_seconds', sec, self._m_labels)
+        metrics.observe('ytbg_save_bytes', n_bytes, self._m_labels)
+        metrics.inc('ytbg_save_bytes_total', self._m_labels, n_bytes)
+
     def load_data(self, path_name):
         """
         Parameters
@@ -269,52 +1134,391 @@ class ytBackgammonServer:
         Returns
         -------
         history_length: int
-            len(self._history)
+            number of entries before the cursor
         fwd_hist_length: int
-            len(self._fwd_hist)
+            number of entries after the cursor
         """
         self._log.debug('path_name=%s', path_name)
 
+        if self._lazy > 0:
+            try:
+                return self.load_data_lazy(path_name)
+            except ValueError as e:
+                self._log.warning('%s:%s: load all', type(e).__name__, e)
+            except Exception as e:
+                self._log.warning('%s:%s.', type(e).__name__, e)
+                return 0, 0
+
         try:
             with open(path_name) as f:
                 data = json.load(f)
         except Exception as e:
             self._log.warning('%s:%s.', type(e).__name__, e)
+            if isinstance(e, ValueError):
+                # don't overwrite it with a new game
+                try:
+                    os.replace(path_name, path_name + '.bad')
+                    self._log.warning('%s: renamed to *.bad', path_name)
+                except OSError as e2:
+                    self._log.warning('%s:%s.', type(e2).__name__, e2)
+            return 0, 0
+
+        self._hist = self.new_history()
+        if data.get('version', 1) < 2:
+            # old format: full gameinfo per entry, re-encoded as diffs
+            for h in data['history'] + data['fwd_hist'][::-1]:
+                self._hist.add(h)
+            hist_i = len(data['history'])
+        else:
+            if 'variations' in data:
+                self._hist.set_variations(data['variations'])
+            for ent in data['entries']:
+                ent.pop('zh', None)
+                self._hist.add_entry(ent)
+            hist_i = data['hist_i']
+
+        return self.load_cursor(hist_i)
+
+    def load_data_lazy(self, path_name):
+        """
+        load the entries from the keyframe before (hist_i - lazy),
+        the older entries are loaded when they are accessed
+
+        Parameters
+        ----------
+        path_name: str
+            full path name of json data file (version 2)
+
+        Returns
+        -------
+        history_length: int
+            number of entries before the cursor
+        fwd_hist_length: int
+            number of entries after the cursor
+        """
+        self._log.debug('path_name=%s', path_name)
+
+        idx = ytBackgammonDataIndex(path_name, debug=self._dbg)
+        hist_i = min(max(idx.hist_i, 1), len(idx))
+        [i0, entries] = idx.load_entries(max(hist_i - self._lazy, 0),
+                                         len(idx))
+
+        self._hist = self.new_history()
+        if idx.variations is not None:
+            self._hist.set_variations(idx.variations)
+        self._hist.set_loader(i0, idx.load_entries, idx.find_zhash)
+        for ent in entries:
+            self._hist.add_entry(ent)
+        self._data_index = idx if i0 > 0 else None
+        self._log.info('%d/%d entries loaded', len(entries), len(idx))
+
+        return self.load_cursor(hist_i)
+
+    def load_cursor(self, hist_i):
+        """
+        set the history cursor after loading
+
+        Parameters
+        ----------
+        hist_i: int
+
+        Returns
+        -------
+        history_length: int
+            number of entries before the cursor
+        fwd_hist_length: int
+            number of entries after the cursor
+        """
+        if len(self._hist) > 0:
+            self._bg.gameinfo = self._hist.set_cursor(hist_i)
+        # already in the storage
+        self._hist.take_var_changes()
+        self._log.debug('hist_i=%d, hist_n=%d',
+                        self._hist.hist_i, len(self._hist))
+        return self._hist.hist_i, len(self._hist) - self._hist.hist_i
+
+    def append_journal(self, path_name, recs):
+        """
+        append records to the journal file
+
+        Parameters
+        ----------
+        path_name: str
+            full path name of journal file
+        recs: list of dict
+            rec := {'op': 'add', 'sn': int, 'key'|'diff': ..}
+                 | {'op': 'cursor', 'hist_i': int}
+                 | {'op': 'switch', 'id': var_id}
+                 | {'op': 'vars', ..}
+                   (ytBackgammonHistory.dump_variations(),
+                    at the top of a compacted journal)
+        """
+        self._log.debug('path_name=%s, len(recs)=%d', path_name, len(recs))
+        t0 = time.perf_counter()
+
+        j_str = ''.join([json.dumps(rec, ensure_ascii=False) + '\n'
+                         for rec in recs])
+        try:
+            run_native(self.append_file, path_name, j_str)
+        except Exception as e:
+            self._log.warning('%s:%s.', type(e).__name__, e)
+
+        self.observe_save(t0, j_str)
+
+    def append_file(self, path_name, j_str):
+        """
+        append and fsync
+
+        Parameters
+        ----------
+        path_name: str
+        j_str: str
+        """
+        with open(path_name, "a") as f:
+            f.write(j_str)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def load_journal(self, path_name):
+        """
+        replay the journal file
+
+        Parameters
+        ----------
+        path_name: str
+            full path name of journal file
+
+        Returns
+        -------
+        history_length: int
+            number of entries before the cursor
+        fwd_hist_length: int
+            number of entries after the cursor
+        """
+        self._log.debug('path_name=%s', path_name)
+
+        self._hist = self.new_history()
+        hist_i = 0
+        try:
+            with open(path_name) as f:
+                for line_n, line in enumerate(f, 1):
+                    try:
+                        rec = json.loads(line)
+                    except ValueError as e:
+                        # e.g. the last line was cut by a crash
+                        self._log.warning('%s:%d: %s:%s.', path_name, line_n,
+                                          type(e).__name__, e)
+                        continue
+
+                    if rec['op'] == 'add':
+                        if 'ent' in rec:
+                            # full gameinfo
+                            rec = {'sn': rec['ent']['sn'], 'key': rec['ent']}
+                        else:
+                            del rec['op']
+                        self._hist.hist_i = hist_i
+                        self._hist.add_entry(rec)
+                        hist_i = self._hist.hist_i
+                    elif rec['op'] == 'cursor':
+                        hist_i = min(max(rec['hist_i'], 0), len(self._hist))
+                    elif rec['op'] == 'switch':
+                        try:
+                            self._hist.switch_variation(rec['id'])
+                        except KeyError as e:
+                            self._log.warning('%s:%d: %s:%s.', path_name,
+                                              line_n, type(e).__name__, e)
+                        hist_i = self._hist.hist_i
+                    elif rec['op'] == 'vars':
+                        self._hist.set_variations(rec)
+                    else:
+                        self._log.warning('%s:%d: op=%s: ignored',
+                                          path_name, line_n, rec['op'])
+        except Exception as e:
+            self._log.warning('%s:%s.', type(e).__name__, e)
+            self._hist = self.new_history()
+            return 0, 0
+
+        return self.load_cursor(hist_i)
+
+    def compact_journal(self, path_name):
+        """
+        rewrite the journal with the current history
+        and the variations, dropping cursor records
+
+        Parameters
+        ----------
+        path_name: str
+            full path name of journal file
+        """
+        self._log.debug('path_name=%s', path_name)
+
+        rec = {'op': 'vars'}
+        rec.update(self._hist.dump_variations())
+        lines = [json.dumps(rec, ensure_ascii=False) + '\n']
+        for ent in self._hist.iter_entries():
+            rec = {'op': 'add'}
+            rec.update(ent)
+            lines.append(json.dumps(rec, ensure_ascii=False) + '\n')
+        lines.append(json.dumps({'op': 'cursor',
+                                 'hist_i': self._hist.hist_i}) + '\n')
+        try:
+            self.write_file(path_name, ''.join(lines))
+        except Exception as e:
+            self._log.warning('%s:%s.', type(e).__name__, e)
+
+    def save_sqlite(self, ops):
+        """
+        store entries and cursor in one transaction
+
+        Parameters
+        ----------
+        ops: list
+            op := ('add', i, entry, zhash) | ('cursor', hist_i)
+                | changes of the variations (see save_variations())
+        """
+        self._log.debug('len(ops)=%d', len(ops))
+        t0 = time.perf_counter()
+
+        try:
+            j_str = self._db.apply(ops)
+            self._hist_changed = True
+        except sqlite3.Error as e:
+            self._log.warning('%s:%s.', type(e).__name__, e)
+            if self._cluster:
+                # roll back the transaction of board_lock(),
+                # not to share a state the history doesn't match
+                raise
+            return
+
+        self.observe_save(t0, j_str)
+
+    def load_sqlite(self):
+        """
+        Returns
+        -------
+        history_length: int
+            number of entries before the cursor
+        fwd_hist_length: int
+            number of entries after the cursor
+        """
+        self._log.debug('')
+
+        self._hist = self.new_history()
+        try:
+            [i0, entries, hist_i] = self._db.load(self._lazy)
+            variations = self._db.load_variations()
+        except (sqlite3.Error, ValueError) as e:
+            self._log.warning('%s:%s.', type(e).__name__, e)
+            if self._cluster and isinstance(e, sqlite3.Error):
+                # not an empty history: a new game would overwrite
+                # the shared one
+                raise
             return 0, 0
 
-        self._history = data['history']
-        self._fwd_hist = data['fwd_hist']
-        self._log.debug('_history=(%d), _fwd_hist=(%d)',
-                        len(self._history), len(self._fwd_hist))
-        if len(self._history) > 0:
-            self._bg._gameinfo = copy.deepcopy(self._history[-1])
-        return len(self._history), len(self._fwd_hist)
+        self._hist.set_variations(variations, self._db.load_var_entries)
+        self._hist.set_loader(i0, self._db.load_entries,
+                              self._db.find_zhash)
+        for ent in entries:
+            self._hist.add_entry(ent)
+        return self.load_cursor(hist_i)
 
     def on_connect(self, request):
         self._log.info('request.sid=%a', request.sid)
         self._log.info('from %s:%s',
-                       request.event['args'][0]['REMOTE_ADDR'],
-                       request.event['args'][0]['REMOTE_PORT'])
+                       request.event['args'][0].get('REMOTE_ADDR'),
+                       request.event['args'][0].get('REMOTE_PORT'))
 
         self._client_sid.append(copy.deepcopy(request.sid))
-
-        self.emit_gameinfo(0)
+        metrics.set('ytbg_clients', len(self._client_sid), self._m_labels)
+
+        fmt = request.args.get('fmt', self.FMT_JSON)
+        if fmt == self.FMT_MSGPACK and msgpack is None:
+            self._log.warning('fmt=%s: msgpack is not installed', fmt)
+            fmt = self.FMT_JSON
+        role = request.args.get('role', self.ROLE_PLAYER)
+        self._log.info('fmt=%s, role=%s', fmt, role)
+
+        room = self._svr_id
+        if role == self.ROLE_SPECTATOR:
+            room += self.ROOM_SPECTATOR
+        if fmt == self.FMT_MSGPACK:
+            room += self.ROOM_MSGPACK
+
+        with self.board_lock():
+            # update the other clients before joining, then send
+            # the whole gameinfo to the new client only
+            self.sync_gameinfo()
+            if fmt == self.FMT_MSGPACK:
+                self._msgpack_sid.add(request.sid)
+            if role == self.ROLE_SPECTATOR:
+                self._spectator_sid.add(request.sid)
+            join_room(room)
+            self.emit_gameinfo_full(0, room=request.sid)
+
+            # running clocks
+            for p in range(2):
+                self.emit_player_clock(p, room=request.sid)
+                if self._clock.active[p]:
+                    self.emit_json({'src': 'server', 'type': 'resume_clock',
+                                    'data': {'player': p},
+                                    'history': False}, room=request.sid)
 
     def on_disconnect(self, request):
         self._log.info('request.sid=%a', request.sid)
         self._client_sid.remove(request.sid)
+        self._msgpack_sid.discard(request.sid)
+        self._spectator_sid.discard(request.sid)
+        self._rejected_sid.discard(request.sid)
+        metrics.set('ytbg_clients', len(self._client_sid), self._m_labels)
 
     def on_error(self, request, e):
         self._log.error('e=%a:%a', type(e).__name__, e)
         self._log.error('event[message]=%a', request.event["message"])
         self._log.error('event[args]=%a', request.event["args"])
 
+    def on_msgpack(self, request, data):
+        """
+        data: MessagePack of msg (see on_json())
+        """
+        try:
+            msg = msgpack.unpackb(data, raw=False)
+        except Exception as e:
+            self._log.warning('%s:%s.', type(e).__name__, e)
+            return
+        self.on_json(request, msg)
+
     def on_json(self, request, msg):
         """
         msg := {'type': str, 'data': object}
         """
-        self._log.info('request.sid=%s', request.sid)
-        self._log.info('msg=%s', msg)
+        # hot path: sampled per type, formatted only if written
+        self._log.debug('request.sid=%s, msg=%s', request.sid, msg,
+                        extra=sample_key(msg['type']))
+
+        labels = {'board': self._svr_id, 'type': msg['type']}
+        metrics.inc('ytbg_messages_total', labels)
+
+        with metrics.timer('ytbg_message_seconds', labels):
+            if msg['type'] not in (self.REPLAY_MSG_TYPES +
+                                   self.PASSIVE_MSG_TYPES):
+                # a move stops the replay
+                self.cancel_replay()
+
+            with self.board_lock():
+                self.handle_json(request, msg)
+
+    def handle_json(self, request, msg):
+        """
+        msg := {'type': str, 'data': object}
+        """
+        if request.sid in self._rejected_sid:
+            self._rejected_sid.discard(request.sid)
+            if msg['type'] == 'dice' and not msg['data'].get('roll'):
+                # the client marks the dice used after its move:
+                # not for the rejected one
+                self._log.warning('dice after the illegal move: %s',
+                                  msg['data'])
+                return
 
         if msg['type'] == 'back':
             # data: {n: n}
@@ -346,6 +1550,38 @@ class ytBackgammonServer:
             self.forward_hist(0)
             return
 
+        if msg['type'] == 'resync':
+            # data: {seq: int}
+            self.sync_gameinfo()
+            self.emit_gameinfo_full(0, room=request.sid)
+            return
+
+        if msg['type'] == 'seek_same':
+            # data: {sec: float}
+            self.seek_same_position(msg['data'].get('sec', 0))
+            return
+
+        if msg['type'] == 'hint':
+            # data: {}
+            self.hint(request.sid)
+            return
+
+        if msg['type'] == 'branches':
+            # data: {}
+            self.emit_branches(request.sid)
+            return
+
+        if msg['type'] == 'switch_branch':
+            # data: {id: int, sec: float}
+            self.switch_branch(msg['data']['id'], msg['data'].get('sec', 0))
+            return
+
+        if msg['type'] == 'seek':
+            # data: {hist_i: int, sec: float}
+            self.seek_hist(msg['data']['hist_i'],
+                           msg['data'].get('sec', 0))
+            return
+
         if msg['type'] == 'new':
             # data: {}
             self.new_game()
@@ -355,7 +1591,7 @@ class ytBackgammonServer:
         if msg['type'] == 'set_gameinfo':
             # data: gameinfo
             self._bg.set_gameinfo(msg['data'])
-            self.add_history(self._bg._gameinfo)
+            self.add_history(self._bg.state)
             self.emit_gameinfo(0)
             return
 
@@ -364,6 +1600,13 @@ class ytBackgammonServer:
         #
         if msg['type'] == 'put_checker':
             # data: {'ch': int, 'p': int, 'idx': int}
+            if not self.check_put_checker(msg):
+                self._log.warning('illegal move: %s', msg['data'])
+                self._rejected_sid.add(request.sid)
+                # put the checker back on the sender's board
+                self.sync_gameinfo()
+                self.emit_gameinfo_full(0, room=request.sid)
+                return
             self._bg.put_checker(msg['data']['ch'],
                                  msg['data']['p'], msg['data']['idx'])
             if msg['data']['p'] >= 26:
@@ -393,40 +1636,161 @@ class ytBackgammonServer:
             # data: {'player': int}
             self._bg.resign(msg['data'])
 
-        if msg['type'] == 'set_clock_swith':
-            # data: {'clock_switch': bool}
-            pass
+        # clocks are counted on the server,
+        # the values are pushed to the clients on each transition
+        push_clock = []
+
+        if msg['type'] == 'set_clock_switch':
+            # data: {'switch': bool}
+            self._clock.set_switch(msg['data']['switch'])
+            push_clock = [0, 1]
 
         if msg['type'] == 'set_clock_limit':
             # data: {'index': int, 'clock_limit': int}
+            #   index: 0: time limit, 1: delay (common to both players)
+            # both clocks are reset to the new limit and stopped,
+            # as the clients do on this message
             self._bg.set_clock_limit(msg['data'])
+            self._clock.reset(0)
+            self._clock.reset(1)
 
         if msg['type'] == 'set_player_clock':
             # data: {'player': int, 'clock': [int(sec), int(sec)]}
-            self._bg.set_player_clock(msg['data'])
+            # broadcast a copy with the accepted values:
+            # the received one may still be in the (async) log queue
+            clock = self._clock.set(msg['data']['player'],
+                                    msg['data']['clock'])
+            msg = dict(msg, data=dict(msg['data'], clock=clock))
 
-        if msg['type'] == 'resume_clcok':
+        if msg['type'] == 'resume_clock':
             # data: {'player': int}
-            pass
+            self._clock.resume(msg['data']['player'])
+            push_clock = [msg['data']['player']]
 
-        if msg['type'] == 'start_clcok':
+        if msg['type'] == 'start_clock':
             # data: {'player': int}
-            pass
+            self._clock.start(msg['data']['player'])
+            push_clock = [msg['data']['player']]
 
-        if msg['type'] == 'stop_clcok':
+        if msg['type'] == 'stop_clock':
             # data: {'player': int}
-            pass
+            self._clock.stop(msg['data']['player'])
+            push_clock = [msg['data']['player']]
 
-        if msg['type'] == 'reset_clcok':
+        if msg['type'] == 'reset_clock':
             # data: {'player': int}}
-            pass
+            self._clock.reset(msg['data']['player'])
 
         # append history or not
         if msg['history']:
-            self.add_history(self._bg._gameinfo)
+            self.add_history(self._bg.state)
+
+        # broadcast to the clients of this board
+        self.emit_json(msg)
+
+        for p in push_clock:
+            self.emit_player_clock(p)
+
+    def check_put_checker(self, msg):
+        """
+        Parameters
+        ----------
+        msg: dict
+            put_checker message
 
-        # broadcast
-        emit('json', msg, broadcast=True)
+        Returns
+        -------
+        result: bool
+            False: illegal move
+        """
+        if self._rule is None or msg['history']:
+            # no check, or free move
+            return True
+
+        return self._rule.check_put_checker(self._bg.state,
+                                            msg['data']['ch'],
+                                            msg['data']['p'])
+
+    def hint(self, sid):
+        """
+        evaluate the candidate plays of the player to move
+        and send the best ones to one client
+
+        Without socketio, the evaluation runs synchronously.
+
+        Parameters
+        ----------
+        sid: str
+        """
+        if self._eval is None:
+            self._log.warning('hint: disabled')
+            return
+
+        gameinfo = copy.deepcopy(self._bg.gameinfo)
+        player = gameinfo['turn']
+        if player not in (0, 1):
+            self._log.warning('turn=%s: no hint', player)
+            return
+
+        if self._sio is None:
+            self.emit_hint(gameinfo, player, sid)
+            return
+
+        # evaluate outside of the board lock
+        self._sio.start_background_task(self.emit_hint, gameinfo, player,
+                                        sid)
+
+    def emit_hint(self, gameinfo, player, sid):
+        # the process pool would stop the green threads (eventlet, gevent)
+        hints = run_native(self._eval.evaluate, gameinfo, player,
+                           n_best=self.N_HINT)
+        self.emit_json({'src': 'server', 'type': 'hint',
+                        'data': {'sn': gameinfo['sn'], 'player': player,
+                                 'hints': hints},
+                        'history': False}, room=sid)
+
+    def emit_player_clock(self, player, room=None):
+        """
+        send the server's clock value
+
+        Parameters
+        ----------
+        player: int
+        room: str
+            None: all clients of this board, sid: one client
+        """
+        self.emit_json({'src': 'server', 'type': 'set_player_clock',
+                        'data': {'player': player,
+                                 'clock': self._clock.get(player)},
+                        'history': False}, room=room)
+
+    def on_clock_event(self, event, player, gen):
+        """
+        called in the clock scheduler's task
+
+        Parameters
+        ----------
+        event: str
+            ytBackgammonClock.EV_*
+        player: int
+        gen: int
+        """
+        self._log.debug('event=%s, player=%s, gen=%s', event, player, gen)
+
+        with self.board_lock():
+            if not self._clock.is_current(player, gen):
+                return
+
+            if event == ytBackgammonClock.EV_TIMEOUT:
+                self._clock.timeout(player)
+                self.emit_player_clock(player)
+                self.emit_json({'src': 'server', 'type': 'clock_timeout',
+                                'data': {'player': player},
+                                'history': False})
+                return
+
+            # delay is over
+            self.emit_player_clock(player)
 
     def app_top(self):
         self._log.debug('')
@@ -435,11 +1799,22 @@ class ytBackgammonServer:
                                version=self._svr_ver,
                                image_dir=self._image_dir)
 
-    def app_index(self):
+    def app_index(self, request):
+        """
+        the page is rendered once, and revalidated by ETag
+        """
         self._log.debug('')
-        return render_template('index.html',
-                               name=self._svr_name,
-                               version=self._svr_ver,
-                               server_id=self._svr_id,
-                               image_dir=self._image_dir)
+        if self._index_html is None:
+            self._index_html = render_template('index.html',
+                                               name=self._svr_name,
+                                               version=self._svr_ver,
+                                               server_id=self._svr_id,
+                                               image_dir=self._image_dir)
+            self._index_etag = hashlib.sha1(
+                self._index_html.encode('utf-8')).hexdigest()
+
+        resp = Response(self._index_html, mimetype='text/html')
+        resp.headers['Cache-Control'] = 'no-cache'
+        resp.set_etag(self._index_etag)
+        return resp.make_conditional(request)
 ##
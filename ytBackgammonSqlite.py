@@ -0,0 +1,638 @@
+#!/usr/bin/env python3
+#
+# (c) Yoichi Tanibayashi
+#
+"""
+ytBackgammonSqlite.py
+
+SQLite storage of the history of all boards (WAL mode).
+
+  board: board_id, hist_i (cursor), var_id (current variation)
+  game:  board_id, game_num, player names, first/last sn
+  entry: board_id, seq (entry index), sn, game_num, zh, key|diff
+  var:   board_id, var_id, parent, fork, n, sn, entries (JSON),
+         the other variations of the history
+  state: board_id, rev, state (JSON, shared by the workers in cluster mode)
+
+Readers (ex. this command) can query while the boards are live:
+
+  ytBackgammonSqlite.py ~/ytbg.sqlite3 --player NAME
+  ytBackgammonSqlite.py ~/ytbg.sqlite3 --board 1 --game 3
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__   = '2020/05'
+
+from ytBackgammonHistory import gameinfo_patch
+import contextlib
+import copy
+import json
+import sqlite3
+from MyLogger import get_logger
+import click
+CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
+
+
+class ytBackgammonSqlite:
+    """
+    storage of one board
+    """
+    SCHEMA = [
+        '''CREATE TABLE IF NOT EXISTS board (
+             board_id TEXT PRIMARY KEY,
+             hist_i INTEGER NOT NULL,
+             var_id INTEGER NOT NULL DEFAULT 0,
+             next_var_id INTEGER NOT NULL DEFAULT 1)''',
+        '''CREATE TABLE IF NOT EXISTS game (
+             board_id TEXT NOT NULL,
+             game_num INTEGER NOT NULL,
+             player0 TEXT NOT NULL DEFAULT '',
+             player1 TEXT NOT NULL DEFAULT '',
+             first_sn INTEGER,
+             last_sn INTEGER,
+             PRIMARY KEY (board_id, game_num))''',
+        '''CREATE INDEX IF NOT EXISTS game_player0 ON game (player0)''',
+        '''CREATE INDEX IF NOT EXISTS game_player1 ON game (player1)''',
+        '''CREATE TABLE IF NOT EXISTS entry (
+             board_id TEXT NOT NULL,
+             seq INTEGER NOT NULL,
+             sn INTEGER NOT NULL,
+             game_num INTEGER NOT NULL,
+             zh INTEGER,
+             key TEXT,
+             diff TEXT,
+             PRIMARY KEY (board_id, seq))''',
+        '''CREATE INDEX IF NOT EXISTS entry_game
+             ON entry (board_id, game_num, sn)''',
+        '''CREATE INDEX IF NOT EXISTS entry_zh ON entry (zh)''',
+        '''CREATE TABLE IF NOT EXISTS var (
+             board_id TEXT NOT NULL,
+             var_id INTEGER NOT NULL,
+             parent INTEGER NOT NULL,
+             fork INTEGER NOT NULL,
+             n INTEGER NOT NULL,
+             sn INTEGER NOT NULL,
+             entries TEXT NOT NULL,
+             PRIMARY KEY (board_id, var_id))''',
+        '''CREATE TABLE IF NOT EXISTS state (
+             board_id TEXT PRIMARY KEY,
+             rev INTEGER NOT NULL,
+             state TEXT NOT NULL)''',
+    ]
+    # columns added to the tables of an old database
+    COLUMNS = {
+        'board': ['var_id INTEGER NOT NULL DEFAULT 0',
+                  'next_var_id INTEGER NOT NULL DEFAULT 1'],
+    }
+
+    _log = get_logger(__name__, False)
+
+    def __init__(self, path_name, board_id, debug=False):
+        """
+        Parameters
+        ----------
+        path_name: str
+            database file (shared by all boards)
+        board_id: str
+        """
+        self._dbg = debug
+        __class__._log = get_logger(__class__.__name__, self._dbg)
+        self._log.debug('path_name=%s, board_id=%s', path_name, board_id)
+
+        self._board_id = board_id
+
+        # autocommit: transactions are started explicitly
+        self._db = sqlite3.connect(path_name, timeout=10,
+                                   isolation_level=None,
+                                   check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        for sql in self.SCHEMA:
+            self._db.execute(sql)
+        for table, columns in self.COLUMNS.items():
+            names = [row[1] for row in self._db.execute(
+                'PRAGMA table_info(%s)' % (table))]
+            for col in columns:
+                if col.split()[0] not in names:
+                    self._db.execute(
+                        'ALTER TABLE %s ADD COLUMN %s' % (table, col))
+
+        # game_num and player names at entry (_n - 1)
+        self._cur = None
+        self._n = 0
+
+    def close(self):
+        self._db.close()
+
+    def begin(self):
+        """
+        start a write transaction, which locks the database
+        for the other processes until commit() or rollback()
+        """
+        self._db.execute('BEGIN IMMEDIATE')
+
+    def commit(self):
+        self._db.execute('COMMIT')
+
+    def rollback(self):
+        if self._db.in_transaction:
+            self._db.execute('ROLLBACK')
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """
+        a transaction, or a part of the one started by begin()
+        """
+        if self._db.in_transaction:
+            yield
+            return
+        with self._db:
+            self._db.execute('BEGIN')
+            yield
+
+    def get_state(self):
+        """
+        Returns
+        -------
+        rev: int
+            0: no state
+        state: dict
+        """
+        row = self._db.execute(
+            'SELECT rev, state FROM state WHERE board_id = ?',
+            (self._board_id,)).fetchone()
+        if row is None:
+            return 0, None
+        return row[0], json.loads(row[1])
+
+    def put_state(self, rev, state):
+        """
+        Parameters
+        ----------
+        rev: int
+        state: dict
+        """
+        self._db.execute(
+            'INSERT INTO state (board_id, rev, state) VALUES (?, ?, ?)'
+            ' ON CONFLICT (board_id) DO UPDATE SET'
+            ' rev = excluded.rev, state = excluded.state',
+            (self._board_id, rev, json.dumps(state, ensure_ascii=False)))
+
+    @staticmethod
+    def signed64(zh):
+        """
+        Zobrist hash (unsigned 64 bit) to SQLite INTEGER
+        """
+        if zh is None or zh < (1 << 63):
+            return zh
+        return zh - (1 << 64)
+
+    @staticmethod
+    def scan_entry(ent, cur):
+        """
+        follow game_num and player names through the entries
+
+        Parameters
+        ----------
+        ent: dict
+            encoded entry
+        cur: dict
+            {'game_num': int, 'playername': [str, str]} or None
+
+        Returns
+        -------
+        cur: dict
+            new object
+        """
+        if 'key' in ent:
+            return {'game_num': ent['key']['game_num'],
+                    'playername': list(ent['key']['board']['playername'])}
+
+        cur = copy.deepcopy(cur)
+        for path, value in ent['diff']:
+            if len(path) == 0:
+                return __class__.scan_entry({'key': value}, None)
+            if path == ['game_num']:
+                cur['game_num'] = value
+            elif path[:2] == ['board', 'playername']:
+                if len(path) == 3:
+                    cur['playername'][path[2]] = value
+                else:
+                    cur['playername'] = list(value)
+            elif path == ['board']:
+                cur['playername'] = list(value['playername'])
+        return cur
+
+    def _insert(self, seq, ent, zh):
+        """
+        Returns
+        -------
+        data: str
+            serialized key or diff
+        """
+        self._cur = self.scan_entry(ent, self._cur)
+        game_num = self._cur['game_num']
+        [p0, p1] = self._cur['playername']
+
+        if 'key' in ent:
+            data = json.dumps(ent['key'], ensure_ascii=False)
+            key, diff = data, None
+        else:
+            data = json.dumps(ent['diff'], ensure_ascii=False)
+            key, diff = None, data
+
+        self._db.execute(
+            'INSERT INTO entry (board_id, seq, sn, game_num, zh, key, diff)'
+            ' VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (self._board_id, seq, ent['sn'], game_num, self.signed64(zh),
+             key, diff))
+        self._db.execute(
+            'INSERT INTO game (board_id, game_num, player0, player1,'
+            ' first_sn, last_sn) VALUES (?, ?, ?, ?, ?, ?)'
+            ' ON CONFLICT (board_id, game_num) DO UPDATE SET'
+            ' player0 = excluded.player0, player1 = excluded.player1,'
+            ' last_sn = excluded.last_sn',
+            (self._board_id, game_num, p0, p1, ent['sn'], ent['sn']))
+        return data
+
+    def _set_cursor(self, hist_i):
+        self._db.execute(
+            'INSERT INTO board (board_id, hist_i) VALUES (?, ?)'
+            ' ON CONFLICT (board_id) DO UPDATE SET hist_i = excluded.hist_i',
+            (self._board_id, hist_i))
+
+    def _put_var(self, var, entries):
+        """
+        Returns
+        -------
+        data: str
+            serialized entries
+        """
+        data = json.dumps(entries, ensure_ascii=False)
+        self._db.execute(
+            'INSERT OR REPLACE INTO var'
+            ' (board_id, var_id, parent, fork, n, sn, entries)'
+            ' VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (self._board_id, var['id'], var['parent'], var['fork'],
+             var['n'], var['sn'], data))
+        return data
+
+    def _set_var_id(self, var_id, next_var_id):
+        self._db.execute(
+            'UPDATE board SET var_id = ?, next_var_id = ?'
+            ' WHERE board_id = ?', (var_id, next_var_id, self._board_id))
+
+    def _add(self, seq, ent, zh):
+        if seq != self._n:
+            # after backward: rescan from the keyframe
+            self._cur = None
+            for e in self.load_entries(seq - 1, seq)[1]:
+                self._cur = self.scan_entry(e, self._cur)
+        self._db.execute(
+            'DELETE FROM entry WHERE board_id = ? AND seq >= ?',
+            (self._board_id, seq))
+        # sn increases with seq
+        self._db.execute(
+            'DELETE FROM game WHERE board_id = ? AND first_sn >= ?',
+            (self._board_id, ent['sn']))
+        self._db.execute(
+            'UPDATE game SET last_sn = ? WHERE board_id = ?'
+            ' AND last_sn >= ?',
+            (ent['sn'] - 1, self._board_id, ent['sn']))
+        data = self._insert(seq, ent, zh)
+        self._set_cursor(seq + 1)
+        self._n = seq + 1
+        return data
+
+    def apply(self, ops):
+        """
+        apply changes in one transaction
+
+        Parameters
+        ----------
+        ops: list
+            op := ('add', seq, entry, zhash)
+                  add an entry, discarding the entries after it
+                | ('cursor', hist_i)
+                | ('var', var, entries) | ('var_parent', var_id, parent)
+                | ('var_del', var_id) | ('var_id', var_id, next_var_id)
+                  (see ytBackgammonHistory.take_var_changes())
+
+        Returns
+        -------
+        data: str
+            serialized keys and diffs
+        """
+        self._log.debug('len(ops)=%s', len(ops))
+        data = []
+        with self._transaction():
+            for op in ops:
+                if op[0] == 'add':
+                    data.append(self._add(*op[1:]))
+                elif op[0] == 'cursor':
+                    self._set_cursor(op[1])
+                elif op[0] == 'var':
+                    data.append(self._put_var(*op[1:]))
+                elif op[0] == 'var_parent':
+                    self._db.execute(
+                        'UPDATE var SET parent = ?'
+                        ' WHERE board_id = ? AND var_id = ?',
+                        (op[2], self._board_id, op[1]))
+                elif op[0] == 'var_del':
+                    self._db.execute(
+                        'DELETE FROM var WHERE board_id = ? AND var_id = ?',
+                        (self._board_id, op[1]))
+                else:
+                    self._set_var_id(op[1], op[2])
+        return ''.join(data)
+
+    def add_entry(self, seq, ent, zh=None):
+        """
+        add an entry, discarding the entries after it
+
+        Parameters
+        ----------
+        seq: int
+            entry index
+        ent: dict
+            encoded entry
+        zh: int
+            Zobrist hash
+
+        Returns
+        -------
+        data: str
+            serialized key or diff
+        """
+        return self.apply([('add', seq, ent, zh)])
+
+    def save_cursor(self, hist_i):
+        self.apply([('cursor', hist_i)])
+
+    def replace(self, hist):
+        """
+        replace all entries of the board (for migration)
+
+        Parameters
+        ----------
+        hist: ytBackgammonHistory
+        """
+        self._log.debug('len(hist)=%s', len(hist))
+        self._cur = None
+        with self._transaction():
+            self._db.execute('DELETE FROM entry WHERE board_id = ?',
+                             (self._board_id,))
+            self._db.execute('DELETE FROM game WHERE board_id = ?',
+                             (self._board_id,))
+            for (i, ent) in enumerate(hist.iter_entries()):
+                self._insert(i, ent, hist.zhash(i))
+            self._set_cursor(hist.hist_i)
+
+            self._db.execute('DELETE FROM var WHERE board_id = ?',
+                             (self._board_id,))
+            data = hist.dump_variations()
+            for var in data['vars']:
+                self._put_var(var, var['entries'])
+            self._set_var_id(data['current'], data['next'])
+        self._n = len(hist)
+
+    def load(self, window=0):
+        """
+        Parameters
+        ----------
+        window: int
+            > 0: load only from the keyframe before (hist_i - window)
+
+        Returns
+        -------
+        i0: int
+            index of the first loaded entry
+        entries: list of dict
+            encoded entries[i0:]
+        hist_i: int
+        """
+        self._log.debug('window=%s', window)
+        row = self._db.execute('SELECT hist_i FROM board WHERE board_id = ?',
+                               (self._board_id,)).fetchone()
+        if row is None:
+            return 0, [], 0
+        hist_i = row[0]
+
+        n = self._db.execute('SELECT COUNT(*) FROM entry WHERE board_id = ?',
+                             (self._board_id,)).fetchone()[0]
+        i = max(hist_i - window, 0) if window > 0 else 0
+        [i0, entries] = self.load_entries(min(i, max(n - 1, 0)), n)
+
+        self._cur = None
+        for ent in entries:
+            self._cur = self.scan_entry(ent, self._cur)
+        self._n = n
+        return i0, entries, hist_i
+
+    def load_entries(self, i, n):
+        """
+        loader of ytBackgammonHistory.set_loader()
+
+        Parameters
+        ----------
+        i: int
+            first entry needed
+        n: int
+            end of entries
+
+        Returns
+        -------
+        i0: int
+            keyframe at or before i
+        entries: list of dict
+            entries[i0:n]
+        """
+        i0 = self._db.execute(
+            'SELECT MAX(seq) FROM entry WHERE board_id = ? AND seq <= ?'
+            ' AND key IS NOT NULL', (self._board_id, i)).fetchone()[0]
+        if i0 is None:
+            i0 = 0
+        self._log.debug('i=%s, n=%s: i0=%s', i, n, i0)
+
+        entries = []
+        for (sn, key, diff) in self._db.execute(
+                'SELECT sn, key, diff FROM entry WHERE board_id = ?'
+                ' AND seq >= ? AND seq < ? ORDER BY seq',
+                (self._board_id, i0, n)):
+            if key is not None:
+                entries.append({'sn': sn, 'key': json.loads(key)})
+            else:
+                entries.append({'sn': sn, 'diff': json.loads(diff)})
+        return i0, entries
+
+    def load_variations(self):
+        """
+        Returns
+        -------
+        data: dict
+            for ytBackgammonHistory.set_variations(),
+            without entries (see load_var_entries())
+        """
+        row = self._db.execute(
+            'SELECT var_id, next_var_id FROM board WHERE board_id = ?',
+            (self._board_id,)).fetchone()
+        if row is None:
+            return {'current': 0, 'next': 1, 'vars': []}
+
+        return {'current': row[0], 'next': row[1],
+                'vars': [{'id': var_id, 'parent': parent, 'fork': fork,
+                          'n': n, 'sn': sn}
+                         for (var_id, parent, fork, n, sn)
+                         in self._db.execute(
+                             'SELECT var_id, parent, fork, n, sn FROM var'
+                             ' WHERE board_id = ? ORDER BY var_id',
+                             (self._board_id,))]}
+
+    def load_var_entries(self, var_id):
+        """
+        loader of ytBackgammonHistory.set_variations()
+
+        Parameters
+        ----------
+        var_id: int
+
+        Returns
+        -------
+        entries: list of dict
+            encoded entries of the variation after its fork
+        """
+        self._log.debug('var_id=%s', var_id)
+        row = self._db.execute(
+            'SELECT entries FROM var WHERE board_id = ? AND var_id = ?',
+            (self._board_id, var_id)).fetchone()
+        if row is None:
+            raise KeyError('var_id=%s: not in the database' % (var_id))
+        return json.loads(row[0])
+
+    def find_zhash(self, zh, n):
+        """
+        hash lookup of ytBackgammonHistory.set_loader()
+
+        Parameters
+        ----------
+        zh: int
+            Zobrist hash
+        n: int
+            end of entries
+
+        Returns
+        -------
+        indexes: list of int
+            seq (< n) of the entries with the hash, in ascending order
+        """
+        return [seq for (seq,) in self._db.execute(
+            'SELECT seq FROM entry WHERE zh = ? AND board_id = ?'
+            ' AND seq < ? ORDER BY seq',
+            (self.signed64(zh), self._board_id, n))]
+
+
+def games(db, player=None, board_id=None):
+    """
+    Parameters
+    ----------
+    db: sqlite3.Connection
+    player: str
+        None: all players
+    board_id: str
+        None: all boards
+
+    Returns
+    -------
+    games: list of dict
+    """
+    sql = ('SELECT board_id, game_num, player0, player1, first_sn, last_sn'
+           ' FROM game WHERE 1')
+    args = []
+    if player is not None:
+        sql += ' AND (player0 = ? OR player1 = ?)'
+        args += [player, player]
+    if board_id is not None:
+        sql += ' AND board_id = ?'
+        args.append(board_id)
+    sql += ' ORDER BY board_id, game_num'
+
+    return [{'board_id': b, 'game_num': g, 'playername': [p0, p1],
+             'first_sn': s0, 'last_sn': s1}
+            for (b, g, p0, p1, s0, s1) in db.execute(sql, args)]
+
+
+def game_positions(db, board_id, game_num):
+    """
+    gameinfo of each entry in a game
+
+    Parameters
+    ----------
+    db: sqlite3.Connection
+    board_id: str
+    game_num: int
+
+    Returns
+    -------
+    gameinfos: list of dict
+    """
+    row = db.execute('SELECT MIN(seq), MAX(seq) FROM entry'
+                     ' WHERE board_id = ? AND game_num = ?',
+                     (board_id, game_num)).fetchone()
+    if row is None or row[0] is None:
+        return []
+    [seq0, seq1] = row
+
+    # start from the keyframe at or before the first entry
+    k = db.execute('SELECT MAX(seq) FROM entry WHERE board_id = ?'
+                   ' AND seq <= ? AND key IS NOT NULL',
+                   (board_id, seq0)).fetchone()[0]
+
+    gameinfos = []
+    gameinfo = None
+    for (seq, key, diff) in db.execute(
+            'SELECT seq, key, diff FROM entry WHERE board_id = ?'
+            ' AND seq >= ? AND seq <= ? ORDER BY seq',
+            (board_id, k, seq1)):
+        if key is not None:
+            gameinfo = json.loads(key)
+        else:
+            gameinfo = gameinfo_patch(gameinfo, json.loads(diff))
+        if seq >= seq0:
+            gameinfos.append(copy.deepcopy(gameinfo))
+    return gameinfos
+
+
+@click.command(context_settings=CONTEXT_SETTINGS)
+@click.argument('path_name', type=click.Path(exists=True))
+@click.option('--player', '-p', 'player', type=str, default=None,
+              help='games of the player')
+@click.option('--board', '-b', 'board_id', type=str, default=None,
+              help='board id')
+@click.option('--game', '-g', 'game_num', type=int, default=None,
+              help='positions of the game (with --board)')
+@click.option('--debug', '-d', 'debug', is_flag=True, default=False,
+              help='debug flag')
+def main(path_name, player, board_id, game_num, debug):
+    """
+    query the history database (JSON lines)
+    """
+    _log = get_logger(__name__, debug)
+    _log.debug('path_name=%s, player=%s, board_id=%s, game_num=%s',
+               path_name, player, board_id, game_num)
+
+    db = sqlite3.connect('file:%s?mode=ro' % (path_name), uri=True)
+    try:
+        if game_num is not None:
+            if board_id is None:
+                raise click.BadParameter('--game needs --board',
+                                         param_hint='--game')
+            for gameinfo in game_positions(db, board_id, game_num):
+                print(json.dumps(gameinfo, ensure_ascii=False))
+        else:
+            for g in games(db, player, board_id):
+                print(json.dumps(g, ensure_ascii=False))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
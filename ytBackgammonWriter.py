@@ -0,0 +1,137 @@
+#
+# (c) Yoichi Tanibayashi
+#
+"""
+ytBackgammonWriter.py
+
+Write-behind persistence: one background thread writes the pending
+changes of all boards, so that disk I/O is out of the message handlers.
+Changes made while a write is in progress (or while waiting) are
+coalesced into one write.
+
+durability policy:
+  change:   write as soon as possible after each change
+  interval: write at most once per interval_ms
+  shutdown: write only on close()
+
+Usage:
+--
+writer = ytBackgammonWriter(ytBackgammonWriter.POLICY_INTERVAL, 500)
+
+writer.mark(target)  # target.flush() will be called in the thread
+...
+writer.close()       # flush all and stop
+--
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__   = '2020/05'
+
+import threading
+import time
+from MyLogger import get_logger
+
+
+class ytBackgammonWriter:
+    POLICY_CHANGE = 'change'
+    POLICY_INTERVAL = 'interval'
+    POLICY_SHUTDOWN = 'shutdown'
+    POLICY_LIST = [POLICY_CHANGE, POLICY_INTERVAL, POLICY_SHUTDOWN]
+
+    DEF_INTERVAL_MS = 500
+
+    _log = get_logger(__name__, False)
+
+    def __init__(self, policy=POLICY_CHANGE, interval_ms=DEF_INTERVAL_MS,
+                 debug=False):
+        """
+        Parameters
+        ----------
+        policy: str
+            POLICY_LIST
+        interval_ms: int
+            for POLICY_INTERVAL
+        """
+        self._dbg = debug
+        __class__._log = get_logger(__class__.__name__, self._dbg)
+        self._log.debug('policy=%s, interval_ms=%s', policy, interval_ms)
+
+        if policy not in self.POLICY_LIST:
+            raise ValueError('policy=%s: must be one of %s' % (
+                policy, self.POLICY_LIST))
+
+        self._policy = policy
+        self._interval = interval_ms / 1000
+
+        # targets to be flushed, in the order of the first change
+        self._dirty = {}
+        self._closing = False
+        self._cv = threading.Condition()
+
+        self._th = threading.Thread(target=self._run, daemon=True,
+                                    name='ytbg-writer')
+        self._th.start()
+
+    def mark(self, target):
+        """
+        Parameters
+        ----------
+        target: object
+            has flush()
+        """
+        with self._cv:
+            if target not in self._dirty:
+                self._dirty[target] = time.monotonic()
+                self._cv.notify()
+
+    def close(self):
+        """
+        flush all and stop the thread
+        """
+        self._log.debug('')
+        with self._cv:
+            self._closing = True
+            self._cv.notify()
+        self._th.join()
+
+    def _wait(self):
+        """
+        wait until some targets should be flushed
+
+        Returns
+        -------
+        targets: list
+            empty: closed
+        """
+        with self._cv:
+            while True:
+                if self._closing:
+                    break
+                if len(self._dirty) > 0:
+                    if self._policy == self.POLICY_CHANGE:
+                        break
+                    if self._policy == self.POLICY_INTERVAL:
+                        t = min(self._dirty.values()) + self._interval
+                        timeout = t - time.monotonic()
+                        if timeout <= 0:
+                            break
+                        self._cv.wait(timeout)
+                        continue
+                self._cv.wait()
+
+            targets = list(self._dirty)
+            self._dirty.clear()
+            return targets
+
+    def _run(self):
+        self._log.debug('start')
+        while True:
+            targets = self._wait()
+            for target in targets:
+                try:
+                    target.flush()
+                except Exception as e:
+                    self._log.warning('%s:%s.', type(e).__name__, e)
+
+            if len(targets) == 0:
+                break
+        self._log.debug('end')
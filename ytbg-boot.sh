@@ -5,6 +5,9 @@ images="images2 images0a images1a images3"
 
 VENVDIR="$HOME/env0-ytbg"
 
+# all boards in one process:
+#   ytbg.sh $VENVDIR -d -p 5000 1:images2 2:images0a 3:images1a 4:images3 &
+
 for i in 1 2 3 4; do
     _port=`expr 5000 + $i`
     _images=`echo $images | cut -d ' ' -f $i`
@@ -8,11 +8,25 @@ ytbg.py
 __author__ = 'Yoichi Tanibayashi'
 __date__   = '2020/05'
 
+import sys
+from ytBackgammonRuntime import ASYNC_MODE_LIST, ASYNC_MODE_AUTO
+from ytBackgammonRuntime import arg_async_mode, monkey_patch
+if __name__ == "__main__":
+    # before the other imports (see ytBackgammonRuntime)
+    monkey_patch(arg_async_mode(sys.argv[1:]))
+
 from ytBackgammonServer import ytBackgammonServer
-from flask import Flask, request
+from ytBackgammonAssets import ytBackgammonAssets
+from ytBackgammonCluster import ytBackgammonBrokerManager, BROKER_SCHEME
+from ytBackgammonClock import ClockScheduler
+from ytBackgammonEval import ytBackgammonEval
+from ytBackgammonMetrics import metrics
+from ytBackgammonWriter import ytBackgammonWriter
+from flask import Flask, Response, request, abort
 from flask_socketio import SocketIO
-import json
-from MyLogger import get_logger
+import os
+import signal
+from MyLogger import get_logger, configure_logging
 import click
 CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
 
@@ -26,72 +40,264 @@ app.config['SECRET_KEY'] = 'secret!'
 app.config['DEBUG'] = False
 app.config['JSON_AS_ASCII'] = False  # XXX 文字化け対策が効かない TBD
 
-socketio = SocketIO(app, cors_allowed_origins='*')
+# initialized in main(): the message queue and async mode are options
+socketio = SocketIO()
+CLUSTER_CHANNEL = 'ytbg'
 
 svr_id = "0"
-svr = None
+svr = None    # default board
+svrs = {}     # board id -> ytBackgammonServer
+sid_svr = {}  # request.sid -> ytBackgammonServer
+assets = None  # ytBackgammonAssets
+
+
+def get_svr(board_id=None):
+    """
+    Parameters
+    ----------
+    board_id: str
+        None or unknown: default board
+
+    Returns
+    -------
+    svr: ytBackgammonServer
+    """
+    return svrs.get(board_id, svr)
+
+
+@app.template_global()
+def asset_url(path):
+    """
+    URL of a file under static/ (see ytBackgammonAssets.url())
+    """
+    if assets is None:
+        return ytBackgammonAssets.STATIC_PREFIX + path
+    return assets.url(path)
+
+
+@app.route(ytBackgammonAssets.URL_PREFIX + '<path:name>')
+def app_assets(name):
+    resp = None
+    if assets is not None:
+        resp = assets.response(name, request)
+    if resp is None:
+        abort(404)
+    return resp
 
 
 @app.route('/')
 def top():
     _log.debug('')
-    return svr.app_index()
+    return svr.app_index(request)
 
 
 @app.route('/p1')
 def index_p1():
     _log.debug('')
-    return svr.app_index()
+    return svr.app_index(request)
 
 
 @app.route('/p2')
 def index_p2():
     _log.debug('')
-    return svr.app_index()
+    return svr.app_index(request)
+
+
+@app.route('/metrics')
+def app_metrics():
+    return Response(metrics.render(),
+                    content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.route('/watch')
+def index_watch():
+    _log.debug('')
+    return svr.app_index(request)
+
+
+@app.route('/<board_id>/')
+@app.route('/<board_id>/p1')
+@app.route('/<board_id>/p2')
+@app.route('/<board_id>/watch')
+def board_index(board_id):
+    _log.debug('board_id=%s', board_id)
+    if board_id not in svrs:
+        abort(404)
+    return svrs[board_id].app_index(request)
 
 
 @socketio.on('connect')
 def handle_connect():
-    svr.on_connect(request)
+    s = get_svr(request.args.get('board'))
+    sid_svr[request.sid] = s
+    s.on_connect(request)
 
 
 @socketio.on('disconnect')
 def handle_disconnect():
-    svr.on_disconnect(request)
+    sid_svr.pop(request.sid, svr).on_disconnect(request)
 
 
 @socketio.on_error_default
 def default_error_handler(e):
-    svr.on_error(request, e)
+    sid_svr.get(request.sid, svr).on_error(request, e)
 
 
 @socketio.on('json')
 def handle_json(msg):
-    _log.debug('msg=%s', json.dumps(msg, ensure_ascii=False))
-    svr.on_json(request, msg)
+    sid_svr.get(request.sid, svr).on_json(request, msg)
+
+
+@socketio.on('msgpack')
+def handle_msgpack(data):
+    _log.debug('len(data)=%d', len(data))
+    sid_svr.get(request.sid, svr).on_msgpack(request, data)
 
 
 @click.command(context_settings=CONTEXT_SETTINGS)
-@click.argument('server_id', type=str)
+@click.argument('server_id', type=str, nargs=-1, required=True)
 @click.option('--port', '-p', 'port', type=int, default=5001,
               help='port number')
 @click.option('--image_dir', '-i', 'image_dir', type=str,
               default="images1",
-              help="Images directory under '/static/'")
+              help="Images directory under '/static/' "
+              "(default for SERVER_ID without ':image_dir')")
+@click.option('--storage', '-s', 'storage',
+              type=click.Choice(ytBackgammonServer.STORAGE_LIST),
+              default=ytBackgammonServer.STORAGE_JSON,
+              help='history storage mode')
+@click.option('--compact', '-c', 'compact', is_flag=True, default=False,
+              help='keep the board state in a compact packed form')
+@click.option('--durability', '-D', 'durability',
+              type=click.Choice(ytBackgammonWriter.POLICY_LIST),
+              default=ytBackgammonWriter.POLICY_CHANGE,
+              help='when the history is written (by a background thread)')
+@click.option('--flush_ms', '-F', 'flush_ms', type=int,
+              default=ytBackgammonWriter.DEF_INTERVAL_MS,
+              help='write interval (msec) for "-D interval"')
+@click.option('--lazy', '-l', 'lazy', type=int, default=0,
+              help='load only the last N history entries at startup, '
+              'the older ones on demand (0: all)')
+@click.option('--max_hist', '-m', 'max_hist', type=int, default=0,
+              help='history entries in memory per board, '
+              'the others are spilled to disk (0: no limit)')
+@click.option('--rule', '-r', 'rule', is_flag=True, default=False,
+              help='reject illegal checker moves on the server')
+@click.option('--hint', '-H', 'hint', is_flag=True, default=False,
+              help='enable move hints (evaluated in a process pool)')
+@click.option('--watch_rate', '-W', 'watch_rate', type=float,
+              default=ytBackgammonServer.DEF_SPECTATOR_RATE,
+              help='updates/sec to the spectators (\'/watch\'), '
+              'coalesced (0: immediate)')
+@click.option('--asset_dir', '-a', 'asset_dir', type=str, default=None,
+              help='directory of the compressed static files '
+              '(default: ~/.ytbg-assets)')
+@click.option('--cluster', '-C', 'cluster', type=str, default=None,
+              help='message queue URL for the clustered mode '
+              '(\'%sHOST:PORT\', \'redis://..\' ..), with \'-s sqlite\''
+              % (BROKER_SCHEME))
+@click.option('--log_async', '-A', 'log_async', is_flag=True, default=False,
+              help='write the log in a background thread (non-blocking)')
+@click.option('--log_json', '-J', 'log_json', is_flag=True, default=False,
+              help='log in JSON lines')
+@click.option('--log_sample', '-S', 'log_sample', type=int, default=0,
+              help='log 1 of N messages per message type (0: all)')
+@click.option('--async_mode', '-M', 'async_mode',
+              type=click.Choice(ASYNC_MODE_LIST), default=ASYNC_MODE_AUTO,
+              help='server runtime (auto: eventlet, gevent or threading, '
+              'whichever is installed first)')
 @click.option('--debug', '-d', 'debug', is_flag=True, default=False,
               help='debug flag')
-def main(server_id, port, image_dir, debug):
-    global svr_id, svr
+def main(server_id, port, image_dir, storage, compact, durability,
+         flush_ms, lazy, max_hist, rule, hint, watch_rate, asset_dir,
+         cluster, log_async, log_json, log_sample, async_mode, debug):
+    """
+    SERVER_ID := id[:image_dir] ..
+
+    Two or more SERVER_IDs: multi-board mode.
+    Board 'id' is served at '/id/', '/id/p1' and '/id/p2'.
+    """
+    global svr_id, svr, assets
+    # already done, if run as a command
+    async_mode = monkey_patch(async_mode)
+
+    configure_logging(async_mode=log_async, json_format=log_json,
+                      sample=log_sample)
     _log = get_logger(__name__, debug)
-    _log.info('server_id=%s, port=%s, image_dir=%s',
-              server_id, port, image_dir)
+    _log.info('server_id=%s, port=%s, image_dir=%s, storage=%s, compact=%s',
+              server_id, port, image_dir, storage, compact)
+    _log.info('durability=%s, flush_ms=%s', durability, flush_ms)
+    _log.info('lazy=%s, max_hist=%s, rule=%s, hint=%s, watch_rate=%s',
+              lazy, max_hist, rule, hint, watch_rate)
+    _log.info('cluster=%s', cluster)
+    _log.info('log_async=%s, log_json=%s, log_sample=%s',
+              log_async, log_json, log_sample)
+    _log.info('async_mode=%s', async_mode)
+
+    if cluster is None:
+        socketio.init_app(app, cors_allowed_origins='*',
+                          async_mode=async_mode)
+    else:
+        if storage != ytBackgammonServer.STORAGE_SQLITE:
+            raise click.BadParameter('needs \'-s %s\''
+                                     % (ytBackgammonServer.STORAGE_SQLITE),
+                                     param_hint='--cluster')
+        if cluster.startswith(BROKER_SCHEME):
+            socketio.init_app(app, cors_allowed_origins='*',
+                              async_mode=async_mode,
+                              client_manager=ytBackgammonBrokerManager(
+                                  cluster, channel=CLUSTER_CHANNEL))
+        else:
+            socketio.init_app(app, cors_allowed_origins='*',
+                              async_mode=async_mode,
+                              message_queue=cluster, channel=CLUSTER_CHANNEL)
+
+    if asset_dir is None:
+        asset_dir = os.path.join(ytBackgammonServer.DATAFILE_DIR,
+                                 '.ytbg-assets')
+    _log.info('asset_dir=%s', asset_dir)
+    assets = ytBackgammonAssets(app.static_folder, asset_dir, debug=debug)
+
+    clock_scheduler = ClockScheduler(socketio, debug=debug)
+    # spectator updates: not to delay the clocks
+    fanout_scheduler = ClockScheduler(socketio, debug=debug)
+    evaluator = ytBackgammonEval(debug=debug) if hint else None
+    # cluster: written in the transaction of each change
+    writer = None
+    if cluster is None:
+        writer = ytBackgammonWriter(durability, flush_ms, debug=debug)
+
+    for sid_str in server_id:
+        [b_id, _, b_image_dir] = sid_str.partition(':')
+        if b_id in svrs:
+            raise click.BadParameter('%s: duplicated' % (b_id),
+                                     param_hint='SERVER_ID')
+        svrs[b_id] = ytBackgammonServer(MY_NAME, VERSION, b_id,
+                                        b_image_dir or image_dir,
+                                        storage=storage, compact=compact,
+                                        lazy=lazy, max_hist=max_hist,
+                                        writer=writer, rule=rule,
+                                        socketio=socketio,
+                                        clock_scheduler=clock_scheduler,
+                                        evaluator=evaluator,
+                                        fanout_scheduler=fanout_scheduler,
+                                        spectator_rate=watch_rate,
+                                        cluster=cluster is not None,
+                                        debug=True)
+
+    svr_id = server_id[0].partition(':')[0]
+    svr = svrs[svr_id]
 
-    svr_id = server_id
-    svr = ytBackgammonServer(MY_NAME, VERSION, svr_id, image_dir, debug=True)
+    # SIGTERM: exit through `finally` to flush the history
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
 
     try:
         socketio.run(app, host='0.0.0.0', port=int(port), debug=debug)
     finally:
+        if writer is not None:
+            writer.close()
+        if evaluator is not None:
+            evaluator.close()
         _log.info('end')
 
 